@@ -0,0 +1,393 @@
+"""
+End-to-end API and hub benchmarks, run against the software hub simulator (hub_simulator.py).
+
+Measures the whole path from the HTTP handlers in server.py, through ServerDialHandler and the hub worker,
+down to frames written by DialSerialDriver and answered by the simulated hub:
+
+    http_set_rps            `/api/v0/dial/<uid>/set` requests per second (keep-alive clients)
+    set_to_frame_latency    time from `/set` request to the SET_DIAL_PERC frame arriving at the hub
+    update_display_fps      full `update_display` frames per second (dial face push)
+    list_latency_<n>        `/api/v0/dial/list` latency with 1, 10 and 100 dials on the bus
+    image_pack              decode + resize + pack time of one uploaded image
+
+Results are printed as a table and written as JSON. Each metric is the best value of `--repeat` runs.
+Every metric is compared against the baseline file and the script exits with status 1 if any metric
+regressed by more than `--tolerance`.
+
+    python benchmarks/bench_api.py [--output results.json] [--baseline benchmarks/baseline.json] [--save-baseline]
+
+benchmarks/baseline.json was recorded with the default arguments on a development machine. Numbers depend
+on the machine, so record your own baseline before comparing changes (the script refuses to run without one):
+
+    python benchmarks/bench_api.py --save-baseline
+
+The simulator runs unthrottled by default, so the numbers reflect server-side overhead.
+Use `--baudrate 115200 --latency 2` to get numbers closer to a real hub.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import platform
+import tempfile
+import threading
+import statistics
+import http.client
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# pylint: disable=wrong-import-position
+import numpy as np
+from PIL import Image
+from tornado.web import Application
+from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_sockets
+from dials.base_logger import logger
+from hub_simulator import HubSimulator
+from dial_driver import DialSerialDriver, pack_image
+from server_config import ServerConfig
+from server_dial_handler import ServerDialHandler
+from dial_events import DialEventBroker
+from image_ingest import prepare_image
+from server import api_routes, log_request, Default_404_Handler
+
+MASTER_KEY = 'benchmarkMasterKey0000'
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+# Arguments that change the measured numbers, the only ones stored in the (committed) baseline
+MEASUREMENT_ARGS = ('dials', 'requests', 'clients', 'samples', 'frames', 'update_period', 'latency', 'baudrate', 'repeat')
+
+
+# BenchSimulator Class
+# ---
+# Hub simulator that remembers when each dial value arrived, so API-to-frame latency can be measured.
+# ---
+class BenchSimulator(HubSimulator):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.value_arrived = threading.Condition()
+        self.arrivals = {}
+
+    def _cmd_set_percent(self, cmd, data):
+        response = super()._cmd_set_percent(cmd, data)
+        now = time.perf_counter()
+        with self.value_arrived:
+            for pos in range(0, len(data) - 1, 2):
+                self.arrivals[(data[pos], data[pos+1])] = now
+            self.value_arrived.notify_all()
+        return response
+
+    def clear_arrivals(self):
+        with self.value_arrived:
+            self.arrivals.clear()
+
+    def wait_for_value(self, index, value, timeout=5):
+        with self.value_arrived:
+            self.value_arrived.wait_for(lambda: (index, value) in self.arrivals, timeout)
+            return self.arrivals.pop((index, value), None)
+
+
+# BenchEnvironment Class
+# ---
+# Simulated hub + DialSerialDriver + ServerDialHandler + HTTP server (on a background IOLoop thread),
+# wired together the same way Dial_API_Service does it. Config and database live in a temporary directory.
+# ---
+class BenchEnvironment:
+    def __init__(self, num_dials, dial_update_period=20, latency=0.0, baudrate=None):
+        self.num_dials = num_dials
+        self.dial_update_period = dial_update_period
+        self.simulator = BenchSimulator(num_dials=num_dials, latency=latency, baudrate=baudrate)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.port = None
+        self._loop = None
+        self._thread = None
+
+    def __enter__(self):
+        config_file = os.path.join(self.tmp_dir.name, 'config.yaml')
+        with open(config_file, 'w', encoding='utf-8') as file:
+            file.write("server:\n"
+                       "  hostname: localhost\n"
+                       "  port: 0\n"
+                       "  communication_timeout: 10\n"
+                       f"  dial_update_period: {self.dial_update_period}\n"
+                       f"  master_key: {MASTER_KEY}\n"
+                       "hardware:\n"
+                       "  port:\n")
+
+        # Dial dictionary of the config is a class attribute, don't carry dials over from the previous environment
+        ServerConfig.dials.clear()
+
+        self.config = ServerConfig(config_file, os.path.join(self.tmp_dir.name, 'vudials.db'))
+        self.dial_driver = DialSerialDriver(self.simulator.start())
+        self.dial_handler = ServerDialHandler(self.dial_driver, self.config)
+        self.dial_handler.start(self.dial_update_period)
+        self.event_broker = DialEventBroker(self.dial_handler)
+        self.dial_uids = list(self.dial_handler.dials.keys())
+
+        started = threading.Event()
+        self._thread = threading.Thread(target=self._serve, args=(started,), name='bench-ioloop', daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(5)
+        self.dial_handler.stop()
+        self.dial_driver.close()
+        self.simulator.stop()
+        self.config.database.connection.close()
+        self.tmp_dir.cleanup()
+
+    def _serve(self, started):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        app = Application(api_routes(self.dial_handler, self.config, self.event_broker),
+                          default_handler_class=Default_404_Handler, log_function=log_request)
+        sockets = bind_sockets(0, '127.0.0.1')
+        self.port = sockets[0].getsockname()[1]
+        server = HTTPServer(app)
+        server.add_sockets(sockets)
+        started.set()
+        self._loop.run_forever()
+        server.stop()
+        self._loop.close()
+
+    def connection(self):
+        return http.client.HTTPConnection('127.0.0.1', self.port, timeout=10)
+
+    @staticmethod
+    def get(connection, path):
+        connection.request('GET', path)
+        response = connection.getresponse()
+        body = response.read()
+        if response.status >= 400:
+            raise RuntimeError(f"GET {path} failed with {response.status}: {body[:200]}")
+        return body
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return {
+        'p50': samples[len(samples)//2],
+        'p95': samples[min(len(samples)-1, int(len(samples)*0.95))],
+        'mean': statistics.fmean(samples),
+    }
+
+
+# -- Benchmarks
+def bench_http_set(env, requests, clients):
+    def client(count):
+        connection = env.connection()
+        dial_uid = env.dial_uids[0]
+        for i in range(count):
+            env.get(connection, f"/api/v0/dial/{dial_uid}/set?key={MASTER_KEY}&value={i % 101}")
+        connection.close()
+
+    per_client = max(1, requests // clients)
+    with ThreadPoolExecutor(clients) as pool:
+        start = time.perf_counter()
+        list(pool.map(client, [per_client] * clients))
+        elapsed = time.perf_counter() - start
+    return {'value': per_client*clients / elapsed, 'unit': 'req/s', 'higher_is_better': True}
+
+
+def bench_set_to_frame(env, samples):
+    connection = env.connection()
+    dial_uid = env.dial_uids[0]
+    index = int(env.dial_handler.dials[dial_uid]['index'])
+    latencies = []
+    value = 0
+    for _ in range(samples):
+        value = 1 + (value % 100)
+        # Forget values that arrived earlier (ie. from the /set throughput run)
+        env.simulator.clear_arrivals()
+        start = time.perf_counter()
+        env.get(connection, f"/api/v0/dial/{dial_uid}/set?key={MASTER_KEY}&value={value}")
+        arrived = env.simulator.wait_for_value(index, value)
+        if arrived is None:
+            raise RuntimeError(f"Value {value} never reached dial {index}")
+        latencies.append((arrived - start) * 1000)
+        # Land the next request at a random point of the update period
+        time.sleep(random.uniform(0, env.dial_update_period / 1000))
+    connection.close()
+    stats = percentiles(latencies)
+    return {'value': stats['p50'], 'unit': 'ms', 'higher_is_better': False,
+            'p95': stats['p95'], 'mean': stats['mean'], 'dial_update_period_ms': env.dial_update_period}
+
+
+def bench_update_display(env, frames):
+    width, height = env.dial_driver.DISPLAY_WIDTH, env.dial_driver.DISPLAY_HEIGHT
+    rng = np.random.default_rng(0)
+    images = [Image.fromarray((rng.random((height, width)) > 0.5).astype(np.uint8) * 255, mode='L') for _ in range(2)]
+    framebuffers = [pack_image(img).tobytes() for img in images]
+    index = int(env.dial_handler.dials[env.dial_uids[0]]['index'])
+
+    def push():
+        for frame in range(frames):
+            # Always send the whole frame, the delta path is a separate (much cheaper) case
+            env.dial_driver.invalidate_framebuffer(index)
+            if not env.dial_driver.update_display(index, imageData=framebuffers[frame % 2]):
+                raise RuntimeError("update_display failed")
+
+    start = time.perf_counter()
+    env.dial_handler.enqueue(push).result()
+    elapsed = time.perf_counter() - start
+    return {'value': frames / elapsed, 'unit': 'frames/s', 'higher_is_better': True}
+
+
+def bench_list(env, samples):
+    connection = env.connection()
+    path = f"/api/v0/dial/list?key={MASTER_KEY}"
+    latencies = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        body = env.get(connection, path)
+        latencies.append((time.perf_counter() - start) * 1000)
+    connection.close()
+    if len(json.loads(body)['data']) != env.num_dials:
+        raise RuntimeError(f"Expected {env.num_dials} dials in the dial list")
+    stats = percentiles(latencies)
+    return {'value': stats['p50'], 'unit': 'ms', 'higher_is_better': False, 'p95': stats['p95'], 'dials': env.num_dials}
+
+
+def bench_image_pack(samples):
+    rng = np.random.default_rng(1)
+    img = Image.fromarray((rng.random((600, 800, 3)) * 255).astype(np.uint8), mode='RGB')
+    data = BytesIO()
+    img.save(data, format='PNG')
+    data = data.getvalue()
+
+    latencies = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        prepare_image(data, DialSerialDriver.DISPLAY_WIDTH, DialSerialDriver.DISPLAY_HEIGHT)
+        latencies.append((time.perf_counter() - start) * 1000)
+    stats = percentiles(latencies)
+    return {'value': stats['p50'], 'unit': 'ms', 'higher_is_better': False, 'p95': stats['p95']}
+
+
+def run(args):
+    results = {}
+    sim_args = {'latency': args.latency / 1000, 'baudrate': args.baudrate or None}
+
+    with BenchEnvironment(args.dials, args.update_period, **sim_args) as env:
+        results['http_set_rps'] = bench_http_set(env, args.requests, args.clients)
+        results['set_to_frame_latency'] = bench_set_to_frame(env, args.samples)
+        results['update_display_fps'] = bench_update_display(env, args.frames)
+
+    for num_dials in (1, 10, 100):
+        with BenchEnvironment(num_dials, args.update_period, **sim_args) as env:
+            results[f'list_latency_{num_dials}'] = bench_list(env, args.samples)
+
+    results['image_pack'] = bench_image_pack(args.samples)
+    return results
+
+
+def best_of(runs):
+    """
+    Keep the best value of every metric over several runs, scheduler noise only ever makes numbers worse.
+    """
+    results = {}
+    for name in runs[0]:
+        pick = max if runs[0][name]['higher_is_better'] else min
+        results[name] = pick((run_results[name] for run_results in runs), key=lambda result: result['value'])
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    @return dictionary of {metric: {'baseline': x, 'change': relative change, 'regression': True|False}}
+    """
+    comparison = {}
+    for name, result in results.items():
+        previous = baseline.get(name, None)
+        if not previous or not previous.get('value'):
+            continue
+        change = (result['value'] - previous['value']) / previous['value']
+        worse = -change if result['higher_is_better'] else change
+        comparison[name] = {'baseline': previous['value'], 'change': change, 'regression': worse > tolerance}
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description='VU Server end-to-end benchmark (simulated hub)')
+    parser.add_argument('--dials', type=int, default=6, help='Simulated dials for the /set and display benchmarks. Default is 6')
+    parser.add_argument('--requests', type=int, default=2000, help='Total /set requests for the throughput benchmark')
+    parser.add_argument('--clients', type=int, default=4, help='Concurrent keep-alive HTTP clients')
+    parser.add_argument('--samples', type=int, default=100, help='Samples per latency measurement')
+    parser.add_argument('--frames', type=int, default=20, help='Frames pushed for the update_display benchmark')
+    parser.add_argument('--update-period', type=int, default=20, help='dial_update_period (ms) used by the server. Default is 20')
+    parser.add_argument('--latency', type=float, default=0.0, help='Simulated per command hub latency in ms')
+    parser.add_argument('--baudrate', type=int, default=0, help='Simulated link speed, 0 to disable throttling')
+    parser.add_argument('--repeat', type=int, default=3, help='Run everything this many times and keep the best value of each metric. Default is 3')
+    parser.add_argument('--output', type=str, default=None, help='Write JSON results to this file')
+    parser.add_argument('--baseline', type=str, default=DEFAULT_BASELINE, help='Baseline JSON to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='Store results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative regression before failing. Default is 0.2 (20%%)')
+    args = parser.parse_args()
+
+    logger.setLevel(logging.ERROR)
+
+    if not args.save_baseline and not os.path.exists(args.baseline):
+        print(f"Baseline {args.baseline} does not exist. Record one first with:\n"
+              f"    python {sys.argv[0]} --save-baseline --baseline {args.baseline}", file=sys.stderr)
+        sys.exit(2)
+
+    results = best_of([run(args) for _ in range(max(1, args.repeat))])
+    baseline = {}
+    if not args.save_baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as file:
+            baseline = json.load(file).get('results', {})
+    comparison = compare(results, baseline, args.tolerance)
+
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'args': vars(args),
+        },
+        'results': results,
+        'comparison': comparison,
+    }
+
+    print(f"{'metric':<24} {'value':>12} {'unit':<9} {'baseline':>12} {'change':>8}")
+    for name, result in results.items():
+        line = f"{name:<24} {result['value']:>12.3f} {result['unit']:<9}"
+        if name in comparison:
+            entry = comparison[name]
+            line += f" {entry['baseline']:>12.3f} {entry['change']*100:>+7.1f}%"
+            if entry['regression']:
+                line += "  REGRESSION"
+        print(line)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+
+    if args.save_baseline:
+        # No paths, host or timestamp, so the file does not change with who or when regenerated it
+        baseline_report = {
+            'meta': {
+                'python': platform.python_version(),
+                'args': {name: getattr(args, name) for name in MEASUREMENT_ARGS},
+            },
+            'results': results,
+        }
+        with open(args.baseline, 'w', encoding='utf-8') as file:
+            json.dump(baseline_report, file, indent=2)
+            file.write('\n')
+        print(f"Baseline stored in {args.baseline}")
+
+    if any(entry['regression'] for entry in comparison.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
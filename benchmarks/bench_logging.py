@@ -0,0 +1,94 @@
+"""
+Logging overhead in the serial/driver hot path.
+
+Compares the logging pattern used before (eager f-string debug messages, log file written by the calling thread)
+with the current one (lazy %-style debug messages, optional QueueHandler + listener thread).
+Times are per call, measured on the calling thread (the hub worker or IOLoop thread in the server).
+
+    python benchmarks/bench_logging.py [-n 20000]
+"""
+import os
+import sys
+import queue
+import timeit
+import logging
+import argparse
+import tempfile
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+
+IMAGE_DATA = list(range(256)) * 15     # ~ one full 200x144 frame of packed image data
+PAYLOAD = b">030400020164\r\n"
+
+
+def make_logger(name, level, log_file=None):
+    bench_logger = logging.getLogger(name)
+    bench_logger.handlers.clear()
+    bench_logger.propagate = False
+    bench_logger.setLevel(level)
+    if log_file is not None:
+        file_handler = RotatingFileHandler(log_file, maxBytes=1*1024*1024, backupCount=2)
+        file_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(funcName)s(%(lineno)d) %(message)s'))
+        bench_logger.addHandler(file_handler)
+    return bench_logger
+
+
+# -- Logging done by one `_sendCommand` call + `display_send_image_data`, before and after
+def send_command_eager(log, cmd=3, dataType=4, dataLen=2):
+    log.debug(f"CMD:{cmd} - Type:{dataType} - Len:{dataLen}".format(PAYLOAD))
+    log.debug("Sending `{}`".format(PAYLOAD))
+
+def send_command_lazy(log, cmd=3, dataType=4, dataLen=2):
+    log.debug("CMD:%s - Type:%s - Len:%s", cmd, dataType, dataLen)
+    log.debug("Sending `%s`", PAYLOAD)
+
+def send_image_eager(log, device=1):
+    log.debug(f"@display_send_image_data(device={device}, imageData={IMAGE_DATA})")
+
+def send_image_lazy(log, device=1):
+    log.debug("@display_send_image_data(device=%s, len(imageData)=%s)", device, len(IMAGE_DATA))
+
+
+def per_call_us(fn, number):
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+
+def run(number):
+    results = []
+    tmp_dir = tempfile.mkdtemp()
+
+    # Debug messages at INFO level (production default), nothing is written
+    log = make_logger('bench_info', logging.INFO)
+    results.append(('_sendCommand debug @INFO', per_call_us(lambda: send_command_eager(log), number), per_call_us(lambda: send_command_lazy(log), number)))
+    results.append(('image data debug @INFO', per_call_us(lambda: send_image_eager(log), number // 10), per_call_us(lambda: send_image_lazy(log), number // 10)))
+
+    # Debug logging enabled, rotating file written by the calling thread vs. by the queue listener thread
+    log = make_logger('bench_file', logging.DEBUG, os.path.join(tmp_dir, 'direct.log'))
+    direct = per_call_us(lambda: send_command_lazy(log), number)
+
+    log = make_logger('bench_queue', logging.DEBUG, os.path.join(tmp_dir, 'queued.log'))
+    handlers = list(log.handlers)
+    log.handlers.clear()
+    log_queue = queue.SimpleQueue()
+    log.addHandler(QueueHandler(log_queue))
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    queued = per_call_us(lambda: send_command_lazy(log), number)
+    listener.stop()
+    results.append(('_sendCommand debug @DEBUG (file vs queue)', direct, queued))
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='VU Server logging overhead benchmark')
+    parser.add_argument('-n', '--number', type=int, default=20000, help='Calls per measurement')
+    args = parser.parse_args()
+
+    print(f"Python {sys.version.split()[0]}, {args.number} calls per measurement (best of 5)")
+    print(f"{'case':<44} {'before (us)':>12} {'after (us)':>12} {'speedup':>8}")
+    for name, before, after in run(args.number):
+        print(f"{name:<44} {before:>12.3f} {after:>12.3f} {before/after:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
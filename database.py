@@ -1,11 +1,12 @@
 import os
 import sqlite3
 import random
+from contextlib import contextmanager
+from threading import RLock
 from dials.base_logger import logger
 
 class DialsDB:
     connection = None
-    database_changes = 0
 
     def __init__(self, database_file='vudials.db', init_if_missing=False):
         # database_path = os.path.join(os.path.expanduser('~'), 'KaranovicResearch', 'vudials')
@@ -20,51 +21,89 @@ class DialsDB:
         if not os.path.exists(self.database_file) and not init_if_missing:
             raise SystemError("Database file does not exist!")
 
-        self.connection = sqlite3.connect(self.database_file)
+        # Connection is shared between the API (IOLoop) thread and the hub worker threads
+        self.lock = RLock()
+        self.connection = sqlite3.connect(self.database_file, check_same_thread=False)
         self.connection.row_factory = sqlite3.Row
+        self._configure_connection()
 
         if init_if_missing:
             self._init_database()
 
+        self.dial_columns = {row['name'] for row in self._fetch_all("PRAGMA table_info(dials)")}
+
+    # WAL lets readers run alongside the writer and only syncs on checkpoints (safe against app crashes,
+    # a power loss can only lose the last few commits). Every write is then a single append to the WAL file.
+    def _configure_connection(self):
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("PRAGMA cache_size=-4000")     # KiB
+        self.connection.execute("PRAGMA temp_store=MEMORY")
+
     # -- Dial
     def fetch_dial_info_or_create_default(self, dial_uid, dial_name='Not set'):
-
-        # check if dial exists
-        res = self._fetch_one_query(f"SELECT * FROM dials WHERE `dial_uid`='{dial_uid}' LIMIT 1")
-        if not res:
-            self._insert(f"INSERT INTO dials (`dial_uid`, `dial_name`) VALUES ('{dial_uid}', '{dial_name}')")
-            logger.debug(f"Added dial `{dial_uid}` to dial list with friendly name `{dial_name}`")
-            res = self._fetch_one_query(f"SELECT * FROM dials WHERE `dial_uid`='{dial_uid}' LIMIT 1")
+        with self._transaction() as cursor:
+            cursor.execute("SELECT * FROM dials WHERE `dial_uid`=? LIMIT 1", (dial_uid,))
+            res = cursor.fetchone()
+            if not res:
+                cursor.execute("INSERT INTO dials (`dial_uid`, `dial_name`) VALUES (?, ?)", (dial_uid, dial_name))
+                logger.debug(f"Added dial `{dial_uid}` to dial list with friendly name `{dial_name}`")
+                cursor.execute("SELECT * FROM dials WHERE `dial_uid`=? LIMIT 1", (dial_uid,))
+                res = cursor.fetchone()
 
         return res
 
     def dial_update_cell(self, dial_uid, cell, value):
-        logger.debug(f"Updating `{dial_uid}` to `{cell}`='{value}'")
-
         logger.debug(f"Attempting to update `{dial_uid}` to `{cell}='{value}'")
-        self._insert(f"UPDATE dials SET `{cell}`='{value}' WHERE `dial_uid`='{dial_uid}'")
-
-        return self._more_than_one_changed()
+        return self.dial_update_cell_with_dict(dial_uid, {cell: value})
 
     def dial_update_cell_with_dict(self, dial_uid, values_dict):
         if not isinstance(values_dict, dict):
             logger.error(f"Expecting type(dictionary) but {type(values_dict)} given.")
             return 0
 
-        logger.debug(f"Updating `{dial_uid}` to `{values_dict}'")
-
-        fields = ', '.join( f"`{key}`='{value}'" for key, value in values_dict.items())
-        query = f"UPDATE `dials` SET {fields} WHERE `dial_uid`='{dial_uid}'"
-        logger.debug(query)
+        # Column names can't be bound as parameters, only known ones are allowed into the statement
+        unknown = [key for key in values_dict if key not in self.dial_columns]
+        if unknown or not values_dict:
+            logger.error(f"Invalid dial column(s) {unknown}")
+            return False
 
         logger.debug(f"Attempting to update `{dial_uid}` to `{values_dict}'")
-        self._insert(query)
 
-        return self._more_than_one_changed()
+        fields = ', '.join(f"`{key}`=?" for key in values_dict)
+        return self._execute(f"UPDATE `dials` SET {fields} WHERE `dial_uid`=?", (*values_dict.values(), dial_uid)) > 0
+
+    # -- Hub topology (last known bus layout of every hub, used for warm start)
+    def topology_fetch(self, hub_id):
+        return self._fetch_all("SELECT * FROM hub_topology WHERE `hub_id`=? ORDER BY `dial_index`", (hub_id,))
+
+    def topology_store(self, hub_id, dials):
+        """
+        Replace stored topology of a hub.
+
+        @param dials list of (dial_index, dial_uid, easing) tuples, easing is a dictionary or None if unknown
+        """
+        rows = []
+        for dial_index, dial_uid, easing in dials:
+            easing = easing or {}
+            rows.append((hub_id, int(dial_index), dial_uid,
+                         easing.get('dial_step', None), easing.get('dial_period', None),
+                         easing.get('backlight_step', None), easing.get('backlight_period', None)))
+
+        with self._transaction() as cursor:
+            cursor.execute("DELETE FROM hub_topology WHERE `hub_id`=?", (hub_id,))
+            cursor.executemany("INSERT OR REPLACE INTO hub_topology (`hub_id`, `dial_index`, `dial_uid`, `easing_dial_step`, `easing_dial_period`, "
+                               "`easing_backlight_step`, `easing_backlight_period`) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def topology_update_easing(self, hub_id, dial_uid, easing):
+        self._execute("UPDATE hub_topology SET `easing_dial_step`=?, `easing_dial_period`=?, `easing_backlight_step`=?, "
+                      "`easing_backlight_period`=? WHERE `hub_id`=? AND `dial_uid`=?",
+                      (easing.get('dial_step', None), easing.get('dial_period', None),
+                       easing.get('backlight_step', None), easing.get('backlight_period', None), hub_id, dial_uid))
 
     # -- API keys
     def api_key_get_id(self, key):
-        res = self._fetch_one(table='api_keys', cell='key_id', where='key_uid', where_cmp=key, limit=1)
+        res = self._fetch_one("SELECT `key_id` FROM api_keys WHERE `key_uid`=? LIMIT 1", (key,))
         if not res:
             return None
         return res[0]
@@ -76,10 +115,15 @@ class DialsDB:
         if not db_keys:
             return api_keys
 
+        # Dial access of all keys in one go
+        key_access = {}
+        for item in self._fetch_all("SELECT `key_id`, `dial_uid` FROM `dial_access`"):
+            key_access.setdefault(item['key_id'], []).append(item['dial_uid'])
+
         for key in list(db_keys):
             item = {}
             item = {'key_name': key['key_name'], 'key_uid': key['key_uid'], 'priviledges': int(key['key_level'])}
-            item['dials'] = self.api_key_get_dial_access(key['key_id'])
+            item['dials'] = key_access.get(key['key_id'], [])
             api_keys[key['key_uid']] = item
 
         return api_keys
@@ -87,7 +131,7 @@ class DialsDB:
     def api_key_get_dial_access(self, key_id):
         dials = []
 
-        key_access = self._fetch_all(f"SELECT `dial_uid` FROM `dial_access` WHERE `key_id`='{key_id}'")
+        key_access = self._fetch_all("SELECT `dial_uid` FROM `dial_access` WHERE `key_id`=?", (key_id,))
 
         if not key_access:
             return dials
@@ -105,30 +149,26 @@ class DialsDB:
         if not dials:
             return False
 
-        # Wipe any existing entries that key has
-        self._query(f"DELETE FROM `dial_access` WHERE `key_id`={key_id}")
+        with self._transaction() as cursor:
+            # Wipe any existing entries that key has
+            cursor.execute("DELETE FROM `dial_access` WHERE `key_id`=?", (key_id,))
 
-        # Add dial access
-        for dial in dials:
-            self._insert(f"INSERT OR IGNORE INTO `dial_access` (dial_uid, key_id) VALUES ('{dial}', '{key_id}')")
-
-        return self._more_than_one_changed()
+            # Add dial access
+            cursor.executemany("INSERT OR IGNORE INTO `dial_access` (dial_uid, key_id) VALUES (?, ?)", [(dial, key_id) for dial in dials])
+            return cursor.rowcount > 0
 
 
     # Set master key to defined value (used to drive master key from .yaml file into sqlite database)
     def api_update_master(self, new_key):
-        self._query(f"INSERT OR REPLACE INTO api_keys (key_id, key_name, key_uid, key_level) VALUES ('1', 'MASTER_KEY', '{new_key}', 99)")
-        return self._more_than_one_changed()
+        return self._execute("INSERT OR REPLACE INTO api_keys (key_id, key_name, key_uid, key_level) VALUES (1, 'MASTER_KEY', ?, 99)", (new_key,)) > 0
 
     def api_key_generate(self, key_name='Not set', level=1):
         generated_key = self.generate_api_key_str()
-        while self._fetch_one(table='api_keys', cell='key_id', where='key_uid', where_cmp=generated_key, limit=1):
+        while self.api_key_get_id(generated_key):
             generated_key = self.generate_api_key_str()
 
-        # self._insert(f"INSERT INTO api_keys (`key_uid`, `key_name`, `key_level`) VALUES ('{generated_key}', '{key_name}', '{level}')")
         table_data = { 'key_uid': generated_key, 'key_name': key_name, 'key_level': level }
-        self._insert_dict('api_keys', table_data)
-        if self._more_than_one_changed():
+        if self._insert_dict('api_keys', table_data):
             return generated_key
         raise SystemError("Failed to generate and store new API key to database!")
 
@@ -141,85 +181,74 @@ class DialsDB:
         # Find key in DB
         key_id = self.api_key_get_id(key_uid)
 
-        query_update_level = ""
-        if level is not None:
-            query_update_level = f", `key_level`='{level}'"
-
         # Rename key
         if key_name is not None:
-            self._query(f"UPDATE `api_keys` SET `key_name`='{key_name}' {query_update_level} WHERE `key_id`='{key_id}'")
-            return self._more_than_one_changed()
+            if level is not None:
+                return self._execute("UPDATE `api_keys` SET `key_name`=?, `key_level`=? WHERE `key_id`=?", (key_name, level, key_id)) > 0
+            return self._execute("UPDATE `api_keys` SET `key_name`=? WHERE `key_id`=?", (key_name, key_id)) > 0
         return False
 
     def api_key_delete(self, key_uid):
-        # Make sure we are not deleting master key!
-        res = self._fetch_one_query(f"SELECT `key_id` FROM `api_keys` WHERE `key_uid`='{key_uid}' AND `key_level` < '99' LIMIT 1")
-        key_id = res['key_id']
-        if not key_id:
-            return False
-
-        # Delete the KEY
-        query = f"DELETE FROM `api_keys` WHERE `key_id`='{key_id}'"
-        logger.debug(query)
-        self._query(query)
-        self._commit()
-        if self._more_than_one_changed():
-            # Delete dial access
-            self._query(f"DELETE FROM `dial_access` WHERE `key_id`='{key_id}'")
-            self._commit()
+        with self._transaction() as cursor:
+            # Make sure we are not deleting master key!
+            cursor.execute("SELECT `key_id` FROM `api_keys` WHERE `key_uid`=? AND `key_level` < 99 LIMIT 1", (key_uid,))
+            res = cursor.fetchone()
+            if not res:
+                return False
+            key_id = res['key_id']
 
-            return self._more_than_one_changed()
+            # Delete the KEY and its dial access
+            cursor.execute("DELETE FROM `api_keys` WHERE `key_id`=?", (key_id,))
+            if cursor.rowcount <= 0:
+                return False
+            cursor.execute("DELETE FROM `dial_access` WHERE `key_id`=?", (key_id,))
 
-        return False
+        return True
 
 
     # -- Internal
+    # One logical operation = one transaction (single commit, rolled back if anything in it fails)
+    @contextmanager
+    def _transaction(self):
+        with self.lock:
+            cursor = self.connection.cursor()
+            try:
+                yield cursor
+                self.connection.commit()
+            except BaseException:
+                self.connection.rollback()
+                raise
+            finally:
+                cursor.close()
+
+    # Execute single statement in its own transaction. Returns number of affected rows
+    def _execute(self, query, params=()):
+        with self._transaction() as cursor:
+            cursor.execute(query, params)
+            return cursor.rowcount
+
     def _insert_dict(self, table_name, dict_data):
-        cursor = self.connection.cursor()
         attrib_names = ", ".join(dict_data.keys())
         attrib_values = ", ".join("?" * len(dict_data.keys()))
-        sql = f"INSERT INTO {table_name} ({attrib_names}) VALUES ({attrib_values})"
-        cursor.execute(sql, list(dict_data.values()))
-        self._commit()
-
-    def _commit(self):
-        self.connection.commit()
-
-    def _insert(self, query):
-        self._query(query)
-        self.connection.commit()
-
-    def _query(self, query):
-        cursor = self.connection.cursor()
-        cursor.execute(query)
-
-    def _fetch_one(self, table, cell, where, where_cmp, limit=1):
-        cursor = self.connection.cursor()
-        query = f"SELECT {cell} FROM {table} WHERE {where} ='{where_cmp}' LIMIT {limit}"
-        logger.debug(query)
-        cursor.execute(query)
-        return cursor.fetchone()
-
-    def _fetch_one_query(self, query):
-        cursor = self.connection.cursor()
-        cursor.execute(query)
-        return cursor.fetchone()
-
-    def _fetch_all(self, query):
-        cursor = self.connection.cursor()
-        cursor.execute(query)
-        return cursor.fetchall()
-
-
-    def _more_than_one_changed(self):
-        if self.connection.total_changes > self.database_changes:
-            self.database_changes = self.connection.total_changes
-            return True
-        return False
+        return self._execute(f"INSERT INTO {table_name} ({attrib_names}) VALUES ({attrib_values})", tuple(dict_data.values())) > 0
+
+    def _fetch_one(self, query, params=()):
+        with self.lock:
+            return self.connection.execute(query, params).fetchone()
+
+    def _fetch_all(self, query, params=()):
+        with self.lock:
+            return self.connection.execute(query, params).fetchall()
 
     def _init_database(self):
+        with self._transaction() as cursor:
+            self._create_tables(cursor)
+
+        self._migrate_database()
+
+    def _create_tables(self, cursor):
         # Create DIALS table
-        self._query("""
+        cursor.execute("""
                     CREATE TABLE IF NOT EXISTS dials (
                                                     "dial_id" INTEGER PRIMARY KEY AUTOINCREMENT,
                                                     "dial_uid" TEXT NOT NULL UNIQUE,
@@ -232,12 +261,22 @@ class DialsDB:
                                                     "easing_dial_step" INTEGER DEFAULT 2,
                                                     "easing_dial_period" INTEGER DEFAULT 50,
                                                     "easing_backlight_step" INTEGER DEFAULT 5,
-                                                    "easing_backlight_period" DEFAULT 100
+                                                    "easing_backlight_period" DEFAULT 100,
+                                                    "filter_ema_alpha" REAL DEFAULT 1.0,
+                                                    "filter_max_rate" REAL DEFAULT 0,
+                                                    "filter_deadband" REAL DEFAULT 0,
+                                                    "mapping_type" TEXT DEFAULT 'percent',
+                                                    "mapping_min" REAL DEFAULT 0,
+                                                    "mapping_max" REAL DEFAULT 100,
+                                                    "mapping_out_min" REAL DEFAULT 0,
+                                                    "mapping_out_max" REAL DEFAULT 100,
+                                                    "mapping_unit" TEXT DEFAULT '',
+                                                    "mapping_points" TEXT DEFAULT '[]'
                                                   )
                     """)
 
         # Create API KEYS table
-        self._query("""
+        cursor.execute("""
                     CREATE TABLE IF NOT EXISTS api_keys (
                                                          key_id INTEGER UNIQUE PRIMARY KEY AUTOINCREMENT ,
                                                          key_name TEXT,
@@ -246,11 +285,44 @@ class DialsDB:
                     """)
 
         # Create DIAL ACCESS table
-        self._query("""
+        cursor.execute("""
                     CREATE TABLE IF NOT EXISTS dial_access (
                                                             id INTEGER PRIMARY KEY AUTOINCREMENT,
                                                             dial_uid TEXT NOT NULL,
                                                             key_id INTEGER NOT NULL)
                     """)
 
-        self.connection.commit()
+        # Create HUB TOPOLOGY table (dial index -> UID map and easing config last sent to each dial)
+        cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS hub_topology (
+                                                             hub_id TEXT NOT NULL,
+                                                             dial_index INTEGER NOT NULL,
+                                                             dial_uid TEXT NOT NULL,
+                                                             easing_dial_step INTEGER,
+                                                             easing_dial_period INTEGER,
+                                                             easing_backlight_step INTEGER,
+                                                             easing_backlight_period INTEGER,
+                                                             PRIMARY KEY (hub_id, dial_index))
+                    """)
+
+    # Add columns introduced after the table was first created
+    def _migrate_database(self):
+        dial_columns = {
+            'filter_ema_alpha': 'REAL DEFAULT 1.0',
+            'filter_max_rate': 'REAL DEFAULT 0',
+            'filter_deadband': 'REAL DEFAULT 0',
+            'mapping_type': "TEXT DEFAULT 'percent'",
+            'mapping_min': 'REAL DEFAULT 0',
+            'mapping_max': 'REAL DEFAULT 100',
+            'mapping_out_min': 'REAL DEFAULT 0',
+            'mapping_out_max': 'REAL DEFAULT 100',
+            'mapping_unit': "TEXT DEFAULT ''",
+            'mapping_points': "TEXT DEFAULT '[]'",
+        }
+
+        existing = [row['name'] for row in self._fetch_all("PRAGMA table_info(dials)")]
+        with self._transaction() as cursor:
+            for column, definition in dial_columns.items():
+                if column not in existing:
+                    logger.info(f"Adding `{column}` column to dials table")
+                    cursor.execute(f"ALTER TABLE dials ADD COLUMN `{column}` {definition}")
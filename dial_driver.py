@@ -2,6 +2,7 @@ import os
 import time
 import textwrap
 import math
+import binascii
 from datetime import timedelta
 from io import BytesIO
 import numpy as np
@@ -10,25 +11,107 @@ from serial.tools.list_ports import comports
 from dials.Comms_Hub_Server import hub_config, hub_commands, hub_data_types, hub_status_codes
 from dials.base_logger import logger
 from serial_driver import SerialHardware
+from metrics import HUB_COMMAND_LATENCY, HUB_PIPELINE_LATENCY, HUB_RETRIES, HUB_IMAGE_TRANSFER
+
+
+def pack_image(img):
+    """
+    Pack image into 1-bit column data expected by the dial.
+    Each column is split into bytes of 8 vertical pixels (MSB is the top pixel).
+    If column height is not divisible by 8, the last byte holds the remaining pixels in its low bits.
+
+    @param img PIL image
+    @return numpy uint8 array with shape (columns, bytes_per_column)
+    """
+    bits = np.asarray(img.convert("L")).T > 127
+
+    remainder = bits.shape[1] % 8
+    if remainder:
+        split = bits.shape[1] - remainder
+        padding = np.zeros((bits.shape[0], 8 - remainder), dtype=bool)
+        bits = np.concatenate((bits[:, :split], padding, bits[:, split:]), axis=1)
+
+    return np.packbits(bits, axis=1)
 
 
 class DialSerialDriver(SerialHardware):
-    dials = {}
-    hub_info = {}
+    DISPLAY_WIDTH = 200
+    DISPLAY_HEIGHT = 144
 
-    def __init__(self, port_info):
+    def __init__(self, port_info, pipeline_window=4, image_flow_control='adaptive'):
         super(DialSerialDriver, self).__init__(port_info, timeout=2)
 
+        # Dials on this hub, keyed by hub index
+        self.dials = {}
+        self.hub_info = {}
+
+        # Max number of commands in flight when sending batches of commands (1 = stop-and-wait)
+        self.pipeline_window = pipeline_window
+
         self.commands = hub_commands()
         self.hub_config = hub_config()
         self.data_type = hub_data_types()
         self.status_codes = hub_status_codes()
 
+        # Frame encoder output buffer, sized for the largest frame the hub accepts
+        self._frame_prefix = self.serialPrefix.encode()
+        self._frame_suffix = self.serialSuffix.encode()
+        self._tx_buffer = bytearray(len(self._frame_prefix) + self.hub_config.GAUGE_COMM_HEADER_LEN +
+                                    2*self.hub_config.GAUGE_COMM_MAX_TX_DATA_LEN + len(self._frame_suffix))
+
+        # Image transfer pacing. 'adaptive' waits for the hub ACK of each chunk, 'fixed' sleeps after every chunk
+        self.image_flow_control = image_flow_control
+        self.image_busy_backoff = (0.01, 1.0)   # min/max delay (seconds) when hub reports GAUGE_STATUS_BUSY
+        self.image_busy_retries = 20
+        self.image_throughput = {}              # Last achieved image throughput per dial (bytes/s)
+        self._rx_buffer_sizes = {}
+
+        # Last framebuffer pushed to each e-ink dial, used to send only the changed parts of new images
+        self._framebuffers = {}
+        self.delta_merge_gap = 16       # Unchanged bytes between two changed runs that are cheaper to resend than a new GOTO_XY
+        self.delta_max_ratio = 0.5      # Fall back to full update if delta is larger than this fraction of the frame
+
     def _get_max_packet_size(self):
         max_size = math.floor( (self.hub_config.GAUGE_COMM_MAX_RX_DATA_LEN - (self.hub_config.GAUGE_COMM_HEADER_LEN*2) )/2)
         return max_size
 
-    def _sendCommand(self, cmd, dataType, dataLen=0, data=None):
+    def _encode_frame(self, cmd, dataType, *parts):
+        """
+        Encode binary payload into a complete `>CCTTLLLL<hex>` frame (including serial prefix/suffix).
+        Frame is written into a reusable buffer, so the returned memoryview is only valid until the next call.
+
+        @param cmd hub command
+        @param dataType hub data type
+        @param parts one or more bytes/bytearray/memoryview payload parts, sent back-to-back
+        @return memoryview of the encoded frame
+        """
+        dataLen = 0
+        for part in parts:
+            dataLen += len(part)
+
+        prefix = self._frame_prefix
+        suffix = self._frame_suffix
+        size = len(prefix) + self.hub_config.GAUGE_COMM_HEADER_LEN + 2*dataLen + len(suffix)
+        if len(self._tx_buffer) < size:
+            self._tx_buffer = bytearray(size)
+
+        buff = self._tx_buffer
+        pos = len(prefix)
+        buff[0:pos] = prefix
+        buff[pos:pos+self.hub_config.GAUGE_COMM_HEADER_LEN] = b">%02X%02X%04X" % (cmd, dataType, dataLen)
+        pos += self.hub_config.GAUGE_COMM_HEADER_LEN
+        for part in parts:
+            end = pos + 2*len(part)
+            buff[pos:end] = binascii.hexlify(part).upper()
+            pos = end
+        buff[pos:size] = suffix
+
+        return memoryview(buff)[:size]
+
+    def _build_payload(self, cmd, dataType, dataLen=0, data=None):
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            return self._encode_frame(cmd, dataType, data)
+
         if dataLen == 0:
             payload = ">{:02X}{:02X}{:04X}".format(cmd, dataType, dataLen)
         elif dataLen == 1:
@@ -47,12 +130,56 @@ class DialSerialDriver(SerialHardware):
                     raise ValueError('Unsupported data type ({})'.format(type(elem)))
 
             payload = ">{:02X}{:02X}{:04X}{}".format(cmd, dataType, int(len(formattedData)/2), formattedData)
+        return payload
 
-        logger.debug(f"CMD:{cmd} - Type:{dataType} - Len:{dataLen}".format(payload))
-        logger.debug("Sending `{}`".format(payload))
+    def _sendCommand(self, cmd, dataType, dataLen=0, data=None):
+        payload = self._build_payload(cmd, dataType, dataLen, data)
+        logger.debug("CMD:%s - Type:%s - Len:%s", cmd, dataType, dataLen)
+        logger.debug("Sending `%s`", payload)
+        start = time.perf_counter()
+        response = self.serial_transaction(payload)
+        HUB_COMMAND_LATENCY.labels(f"{cmd:02X}").observe(time.perf_counter() - start)
+        return self._parseResponse(response)
+
+    def _sendFrame(self, cmd, dataType, *parts):
+        payload = self._encode_frame(cmd, dataType, *parts)
+        logger.debug("CMD:%s - Type:%s - Len:%s", cmd, dataType, len(payload))
+        start = time.perf_counter()
         response = self.serial_transaction(payload)
+        HUB_COMMAND_LATENCY.labels(f"{cmd:02X}").observe(time.perf_counter() - start)
         return self._parseResponse(response)
 
+    def _sendCommands(self, commands):
+        """
+        Send a batch of commands using a pipelined serial transaction.
+
+        @param commands list of (cmd, dataType, dataLen, data) tuples
+        @return list of parsed responses (same as _sendCommand would return) in the same order
+        """
+        if not commands:
+            return []
+
+        payloads = []
+        for command in commands:
+            payload = self._build_payload(*command)
+            # Encoded frames share one output buffer, take a copy since all frames are queued at once
+            if isinstance(payload, memoryview):
+                payload = bytes(payload)
+            payloads.append(payload)
+        logger.debug("Sending %s pipelined commands (window=%s)", len(payloads), self.pipeline_window)
+        start = time.perf_counter()
+        futures = self.pipelined_transaction(payloads, window=self.pipeline_window)
+        HUB_PIPELINE_LATENCY.observe(time.perf_counter() - start)
+
+        results = []
+        for future in futures:
+            if future.exception() is not None:
+                logger.error(future.exception())
+                results.append(False)
+                continue
+            results.append(self._parseResponse(future.result()))
+        return results
+
     def _send_cmd_with_uin32(self, dialID, cmd, value, dt=None):
         if dt is None:
             dt = self.data_type.COMM_DATA_SINGLE_VALUE
@@ -69,11 +196,27 @@ class DialSerialDriver(SerialHardware):
                 data = line[9:]
                 ret = {'cmd':cmd, 'dataType':dataType, 'dataLen':dataLen, 'data':data}
 
-                if dataType == self.data_type.COMM_DATA_STATUS_CODE:
+                if int(dataType, 16) == self.data_type.COMM_DATA_STATUS_CODE:
                     return self._checkStatus(ret['data'])
                 return ret['data']
         return False
 
+    def _parseStatus(self, response):
+        """
+        Get status code from the hub response.
+
+        @return status code (int), GAUGE_STATUS_OK for responses carrying data or None if there was no response
+        """
+        for line in response:
+            if line.startswith('<'):
+                if int(line[3:5], 16) == self.data_type.COMM_DATA_STATUS_CODE:
+                    try:
+                        return int(line[9:], 16)
+                    except ValueError:
+                        return self.status_codes.GAUGE_STATUS_MALFORMED_PACKAGE
+                return self.status_codes.GAUGE_STATUS_OK
+        return None
+
     def _checkStatus(self, statusCode):
         if int(statusCode, 16) == self.status_codes.GAUGE_STATUS_OK:
             return True
@@ -82,11 +225,11 @@ class DialSerialDriver(SerialHardware):
 
     def _convert_hex_str_to_str(self, hex_string):
         if not hex_string:
-            logger.error(f"Empty hex string received {hex_string}")
+            logger.error("Empty hex string received %s", hex_string)
             return ''
 
         if len(hex_string)%2:
-            logger.error(f"Hex string should be divisible by 2! (len={len(hex_string)})")
+            logger.error("Hex string should be divisible by 2! (len=%s)", len(hex_string))
             return ''
 
         try:
@@ -99,11 +242,11 @@ class DialSerialDriver(SerialHardware):
 
     def _convert_hex_str_to_byte_array(self, hex_string):
         if not hex_string:
-            logger.error(f"Empty hex string received {hex_string}")
+            logger.error("Empty hex string received %s", hex_string)
             return bytes()
 
         if len(hex_string)%2:
-            logger.error(f"Hex string should be divisible by 2! (len={len(hex_string)})")
+            logger.error("Hex string should be divisible by 2! (len=%s)", len(hex_string))
             return bytes()
 
         try:
@@ -113,46 +256,63 @@ class DialSerialDriver(SerialHardware):
             logger.error(e)
             return bytes()
 
+    def hub_id(self):
+        # USB serial number survives re-enumeration of the port, fall back to the port name
+        return self.port_info.serial_number or self.port_info.device
+
     def bus_rescan(self):
         logger.debug("@bus_rescan")
         return self._sendCommand(self.commands.COMM_CMD_RESCAN_BUS, self.data_type.COMM_DATA_NONE)
 
+    def get_devices_map(self):
+        """
+        @return list of indexes of dials that are online, None if the hub did not send a valid device map
+        """
+        resp = self._sendCommand(self.commands.COMM_CMD_GET_DEVICES_MAP, self.data_type.COMM_DATA_NONE)
+        if not resp:
+            logger.error("Invalid response received from COMM_CMD_GET_DEVICES_MAP")
+            logger.error(resp)
+            return None
+
+        onlineDials = []
+        for key, elem in enumerate(textwrap.wrap(resp, 2)):
+            if int(elem, 16) == 1:
+                onlineDials.append(key)
+        return onlineDials
+
+    def _new_dial_entry(self, dialIndex, deviceUID):
+        # Friendly name will be added from config
+        return {
+                    'index': str(dialIndex),
+                    'uid': deviceUID,
+                    'dial_name': 'Not set',
+                    'value': 0,
+                    'rgbw': [0, 0, 0, 0],
+                    'easing': {
+                        'dial_step': '?',
+                        'dial_period': '?',
+                        'backlight_step': '?',
+                        'backlight_period': '?',
+                    },
+                    'fw_hash': '?',
+                    'fw_version': '?',
+                    'hw_version': '?',
+                    'protocol_version': '?',
+                }
+
     def get_dial_list(self, rescan=False):
-        logger.debug(f"@get_dial_list(rescan={rescan})")
+        logger.debug("@get_dial_list(rescan=%s)", rescan)
         if rescan:
+            # Dials could have been reset or replaced, we can't rely on what they are displaying
+            self.invalidate_framebuffer()
             resp = self.bus_rescan()
-            resp = self._sendCommand(self.commands.COMM_CMD_GET_DEVICES_MAP, self.data_type.COMM_DATA_NONE)
-            if not resp:
-                logger.error("Invalid response received from COMM_CMD_GET_DEVICES_MAP")
-                logger.error(resp)
+            onlineDials = self.get_devices_map()
+            if onlineDials is None:
                 return []
 
-            resp = textwrap.wrap(resp, 2)
-            onlineDials = []
-            for key, elem in enumerate(resp):
-                if int(elem, 16) == 1:
-                    onlineDials.append(key)
-
             for dialIndex in onlineDials:
                 deviceUID = self.dial_get_uid(dialIndex)                # Read dial UID
-                # Friendly name will be added from config
-                self.dials[dialIndex] = {
-                                            'index': str(dialIndex),
-                                            'uid': deviceUID,
-                                            'dial_name': 'Not set',
-                                            'value': 0,
-                                            'rgbw': [0, 0, 0, 0],
-                                            'easing': {
-                                                'dial_step': '?',
-                                                'dial_period': '?',
-                                                'backlight_step': '?',
-                                                'backlight_period': '?',
-                                            },
-                                            'fw_hash': '?',
-                                            'fw_version': '?',
-                                            'hw_version': '?',
-                                            'protocol_version': '?',
-                                        }
+                self.dials[dialIndex] = self._new_dial_entry(dialIndex, deviceUID)
 
         dialList = []
         for key, val in self.dials.items():
@@ -160,8 +320,55 @@ class DialSerialDriver(SerialHardware):
 
         return dialList
 
+    def get_dial_list_from_snapshot(self, snapshot):
+        """
+        Warm start version of `get_dial_list(rescan=True)`.
+        Trusts the last known bus topology, verifies it with a single device map query (no bus rescan)
+        and reads UIDs only for dial indexes that are not in the snapshot.
+
+        @param snapshot dictionary of {dial index: dial UID}
+        @return (list of dials, list of dial indexes whose UID was read from the hub) or (None, None) if the
+                device map could not be read
+        """
+        logger.debug("@get_dial_list_from_snapshot(snapshot=%s)", snapshot)
+        onlineDials = self.get_devices_map()
+        if onlineDials is None:
+            return None, None
+
+        queried = []
+        self.dials.clear()
+        for dialIndex in onlineDials:
+            deviceUID = snapshot.get(dialIndex, None)
+            if deviceUID is None:
+                deviceUID = self.dial_get_uid(dialIndex)
+                queried.append(dialIndex)
+            self.dials[dialIndex] = self._new_dial_entry(dialIndex, deviceUID)
+
+        return list(self.dials.values()), queried
+
+    def add_dial(self, dialIndex):
+        """
+        Read UID of a dial that appeared on the bus and add it to the dial list.
+
+        @return dial entry or None if the dial did not answer
+        """
+        logger.debug("@add_dial(dialIndex=%s)", dialIndex)
+        deviceUID = self.dial_get_uid(dialIndex)
+        if not deviceUID:
+            logger.error("Dial #%s did not report its UID", dialIndex)
+            return None
+        self.dials[dialIndex] = self._new_dial_entry(dialIndex, deviceUID)
+        return self.dials[dialIndex]
+
+    def remove_dial(self, dialIndex):
+        logger.debug("@remove_dial(dialIndex=%s)", dialIndex)
+        self.dials.pop(dialIndex, None)
+        self._framebuffers.pop(dialIndex, None)
+        self._rx_buffer_sizes.pop(dialIndex, None)
+        self.image_throughput.pop(dialIndex, None)
+
     def set_all_dials_to(self, value):
-        logger.debug(f"@set_all_dials_to(value={value})")
+        logger.debug("@set_all_dials_to(value=%s)", value)
         dials = []
         values = []
 
@@ -216,7 +423,7 @@ class DialSerialDriver(SerialHardware):
             device = self._findDial(device)
 
             if device is None:
-                logger.error(f"Can not find dial '{device}'")
+                logger.error("Can not find dial '%s'", device)
             return device
 
         elif isinstance(device, int):
@@ -226,46 +433,46 @@ class DialSerialDriver(SerialHardware):
             raise ValueError(f"Unexpected device type type(device)='{type(device)}'")
 
     def dial_get_uid(self, dialIndex):
-        logger.debug(f"@dial_get_uid(dialIndex={dialIndex})")
+        logger.debug("@dial_get_uid(dialIndex=%s)", dialIndex)
         return self._sendCommand(self.commands.COMM_CMD_GET_DEVICE_UID, self.data_type.COMM_DATA_SINGLE_VALUE, 1, dialIndex)
 
     def dial_get_fw_hash(self, dialIndex):
-        logger.debug(f"@dial_get_fw_hash(dialIndex={dialIndex})")
+        logger.debug("@dial_get_fw_hash(dialIndex=%s)", dialIndex)
         cmd = self.commands.COMM_CMD_GET_BUILD_INFO
         data = dialIndex
         ret = self._sendCommand(cmd, self.data_type.COMM_DATA_SINGLE_VALUE, 1, data)
         return self._convert_hex_str_to_str(ret)
 
     def dial_get_fw_version(self, dialIndex):
-        logger.debug(f"@dial_get_fw_version(dialIndex={dialIndex})")
+        logger.debug("@dial_get_fw_version(dialIndex=%s)", dialIndex)
         cmd = self.commands.COMM_CMD_GET_FW_INFO
         data = dialIndex
         ret = self._sendCommand(cmd, self.data_type.COMM_DATA_SINGLE_VALUE, 1, data)
         return self._convert_hex_str_to_str(ret)
 
     def dial_get_hw_version(self, dialIndex):
-        logger.debug(f"@dial_get_hw_version(dialIndex={dialIndex})")
+        logger.debug("@dial_get_hw_version(dialIndex=%s)", dialIndex)
         cmd = self.commands.COMM_CMD_GET_HW_INFO
         data = dialIndex
         ret = self._sendCommand(cmd, self.data_type.COMM_DATA_SINGLE_VALUE, 1, data)
         return self._convert_hex_str_to_str(ret)
 
     def dial_get_protocol_version(self, dialIndex):
-        logger.debug(f"@dial_get_hw_version(dialIndex={dialIndex})")
+        logger.debug("@dial_get_hw_version(dialIndex=%s)", dialIndex)
         cmd = self.commands.COMM_CMD_GET_PROTOCOL_INFO
         data = dialIndex
         ret = self._sendCommand(cmd, self.data_type.COMM_DATA_SINGLE_VALUE, 1, data)
         return self._convert_hex_str_to_str(ret)
 
     def set_dial_power(self, powerOn=True):
-        logger.debug(f"@set_dial_power(powerOn={powerOn})")
+        logger.debug("@set_dial_power(powerOn=%s)", powerOn)
         data = 0
         if powerOn is True:
             data = 1
         return self._sendCommand(self.commands.COMM_CMD_DIAL_POWER, self.data_type.COMM_DATA_SINGLE_VALUE, 1, data)
 
     def dial_calibrate(self, dialID, value, fullScale=True):
-        logger.debug(f"@dial_calibrate(dialID={dialID}, value={value}, fullScale={fullScale})")
+        logger.debug("@dial_calibrate(dialID=%s, value=%s, fullScale=%s)", dialID, value, fullScale)
         if fullScale:
             cmd = self.commands.COMM_CMD_SET_DIAL_CALIBRATE_MAX
         else:
@@ -274,34 +481,37 @@ class DialSerialDriver(SerialHardware):
         return self._send_cmd_with_uin32(dialID, cmd, value, dt=self.data_type.COMM_DATA_KEY_VALUE_PAIR)
 
     def dial_easing_dial_step(self, dialID, value):
-        logger.debug(f"@dial_easing_dial_step(dialID={dialID}, value={value})")
+        logger.debug("@dial_easing_dial_step(dialID=%s, value=%s)", dialID, value)
         cmd = self.commands.COMM_CMD_SET_DIAL_EASING_STEP
         data = [dialID, ((value>>24)&0xFF), ((value>>16)&0xFF), ((value>>8)&0xFF), (value&0xFF)]
         return self._sendCommand(cmd, self.data_type.COMM_DATA_SINGLE_VALUE, len(data), data)
 
     def dial_easing_dial_period(self, dialID, value):
-        logger.debug(f"@dial_easing_dial_period(dialID={dialID}, value={value})")
+        logger.debug("@dial_easing_dial_period(dialID=%s, value=%s)", dialID, value)
         cmd = self.commands.COMM_CMD_SET_DIAL_EASING_PERIOD
         data = [dialID, ((value>>24)&0xFF), ((value>>16)&0xFF), ((value>>8)&0xFF), (value&0xFF)]
         return self._sendCommand(cmd, self.data_type.COMM_DATA_SINGLE_VALUE, len(data), data)
 
     def dial_easing_backlight_step(self, dialID, value):
-        logger.debug(f"@dial_easing_backlight_step(dialID={dialID}, value={value})")
+        logger.debug("@dial_easing_backlight_step(dialID=%s, value=%s)", dialID, value)
         cmd = self.commands.COMM_CMD_SET_BACKLIGHT_EASING_STEP
         data = [dialID, ((value>>24)&0xFF), ((value>>16)&0xFF), ((value>>8)&0xFF), (value&0xFF)]
         return self._sendCommand(cmd, self.data_type.COMM_DATA_SINGLE_VALUE, len(data), data)
 
     def dial_easing_backlight_period(self, dialID, value):
-        logger.debug(f"@dial_easing_backlight_period(dialID={dialID}, value={value})")
+        logger.debug("@dial_easing_backlight_period(dialID=%s, value=%s)", dialID, value)
         cmd = self.commands.COMM_CMD_SET_BACKLIGHT_EASING_PERIOD
         data = [dialID, ((value>>24)&0xFF), ((value>>16)&0xFF), ((value>>8)&0xFF), (value&0xFF)]
         return self._sendCommand(cmd, self.data_type.COMM_DATA_SINGLE_VALUE, len(data), data)
 
     def dial_easing_get_config(self, dialID):
         easing = { 'dial_step':0, 'dial_period':0, 'backlight_step':0, 'backlight_period':0 }
-        logger.debug(f"@dial_easing_get_config(dialID={dialID})")
+        logger.debug("@dial_easing_get_config(dialID=%s)", dialID)
         ret = self._sendCommand(self.commands.COMM_CMD_GET_EASING_CONFIG, self.data_type.COMM_DATA_SINGLE_VALUE, 1, dialID)
         ret = self._convert_hex_str_to_byte_array(ret)
+        if len(ret) < 16:
+            logger.error("Invalid easing config received from dial %s", dialID)
+            return None
 
         easing['dial_step']         = int(ret[0]) << 24 | int(ret[1]) << 16 | int(ret[2]) << 8 | int(ret[3])
         easing['dial_period']       = int(ret[4]) << 24 | int(ret[5]) << 16 | int(ret[6]) << 8 | int(ret[7])
@@ -313,33 +523,75 @@ class DialSerialDriver(SerialHardware):
         return easing
 
     def dial_single_set_raw(self, dialID, value):
-        logger.debug(f"@dial_single_set_raw(dialID={dialID}, value={value})")
+        logger.debug("@dial_single_set_raw(dialID=%s, value=%s)", dialID, value)
         data = [dialID, ((value>>8)&0xFF), (value&0xFF)]
         return self._sendCommand(self.commands.COMM_CMD_SET_DIAL_RAW_SINGLE, self.data_type.COMM_DATA_KEY_VALUE_PAIR, len(data), data)
 
     def dial_single_set_percent(self, dialID, value):
-        logger.debug(f"@dial_single_set_percent(dialID={dialID}, value={value})")
+        logger.debug("@dial_single_set_percent(dialID=%s, value=%s)", dialID, value)
         if self.dials.get(int(dialID), False):
             self.dials[int(dialID)]['value'] = value
         data = [dialID, (value&0xFF)]
         return self._sendCommand(self.commands.COMM_CMD_SET_DIAL_PERC_SINGLE, self.data_type.COMM_DATA_KEY_VALUE_PAIR, len(data), data)
 
     def dial_multiple_set_percent(self, devices, values):
-        logger.debug(f"@dial_multiple_set_percent(devices={devices}, values={values})")
+        logger.debug("@dial_multiple_set_percent(devices=%s, values=%s)", devices, values)
         if len(devices) != len(values):
             logger.error("Number of devices does not match number of values")
             return False
 
-        data = []
+        data = bytearray()
         for i in range(len(devices)):
-            self.set_dial(devices[i], values[i], sendCMD=False)
-            data.append(devices[i])
-            data.append(values[i])
-
-        return self._sendCommand(self.commands.COMM_CMD_SET_DIAL_PERC_MULTIPLE, self.data_type.COMM_DATA_KEY_VALUE_PAIR, len(data), data)
+            if self.dials.get(int(devices[i]), False):
+                self.dials[int(devices[i])]['value'] = values[i]
+            data.append(int(devices[i]))
+            data.append(values[i]&0xFF)
+
+        return self._sendFrame(self.commands.COMM_CMD_SET_DIAL_PERC_MULTIPLE, self.data_type.COMM_DATA_KEY_VALUE_PAIR, data)
+
+    def _max_dials_per_frame(self):
+        # Each dial takes one index byte and one value byte of the frame payload
+        return max(1, self.hub_config.GAUGE_COMM_MAX_TX_DATA_LEN // 2)
+
+    def dial_batch_set_percent(self, updates):
+        """
+        Send (dialIndex, value) updates using as few COMM_CMD_SET_DIAL_PERC_MULTIPLE frames as possible.
+        If the hub rejects a frame, dials from that frame are retried one-by-one so that
+        a single offline dial does not fail the whole batch.
+
+        @param updates list of (dialIndex, value) tuples
+        @return list of dial indexes that could not be updated
+        """
+        logger.debug("@dial_batch_set_percent(updates=%s)", updates)
+        frame_size = self._max_dials_per_frame()
+        frames = [updates[start:start+frame_size] for start in range(0, len(updates), frame_size)]
+
+        commands = []
+        for frame in frames:
+            data = bytearray()
+            for index, value in frame:
+                if self.dials.get(int(index), False):
+                    self.dials[int(index)]['value'] = value
+                data.append(int(index))
+                data.append(value&0xFF)
+            commands.append((self.commands.COMM_CMD_SET_DIAL_PERC_MULTIPLE, self.data_type.COMM_DATA_KEY_VALUE_PAIR, len(data), data))
+
+        # Dials from rejected frames are retried one-by-one
+        retry = []
+        for frame, result in zip(frames, self._sendCommands(commands)):
+            if result is not True:
+                logger.error("Hub rejected multi-dial frame for dials %s. Retrying individually.", [index for index, _ in frame])
+                HUB_RETRIES.labels('multi_dial_frame').inc()
+                retry.extend(frame)
+
+        commands = [(self.commands.COMM_CMD_SET_DIAL_PERC_SINGLE, self.data_type.COMM_DATA_KEY_VALUE_PAIR, 2, bytes((int(index), value&0xFF)))
+                    for index, value in retry]
+        results = self._sendCommands(commands)
+
+        return [int(index) for (index, _), result in zip(retry, results) if result is not True]
 
     def dial_display_clear(self, device, whiteBackground=True):
-        logger.debug(f"@dial_display_clear(device={device}, whiteBackground={whiteBackground})")
+        logger.debug("@dial_display_clear(device=%s, whiteBackground=%s)", device, whiteBackground)
         if whiteBackground:
             data = [int(device), 0]
         else:
@@ -347,29 +599,33 @@ class DialSerialDriver(SerialHardware):
         return self._sendCommand(self.commands.COMM_CMD_DISPLAY_CLEAR, self.data_type.COMM_DATA_SINGLE_VALUE, len(data), data)
 
     def dial_display_goto_xy(self, device, x, y):
-        logger.debug(f"@dial_display_goto_xy(device={device}, x={x}, y={y})")
+        logger.debug("@dial_display_goto_xy(device=%s, x=%s, y=%s)", device, x, y)
         data = [int(device), ((x>>8)&0xFF), (x&0xFF), ((y>>8)&0xFF), (y&0xFF)]
         return self._sendCommand(self.commands.COMM_CMD_DISPLAY_GOTO_XY, self.data_type.COMM_DATA_SINGLE_VALUE, len(data), data)
 
     def display_send_image(self, device, img_filepath):
-        logger.debug(f"@display_send_image(device={device}, img_filepath={img_filepath})")
+        logger.debug("@display_send_image(device=%s, img_filepath=%s)", device, img_filepath)
         if not os.path.exists(img_filepath):
-            logger.error(f"File '{img_filepath}' does not exist.")
+            logger.error("File '%s' does not exist.", img_filepath)
             return False
 
         img_data = self.img_to_binary(img_filepath, True)
         return self.display_send_image_data(device, img_data)
 
     def display_send_image_data(self, device, imageData):
-        logger.debug(f"@display_send_image_data(device={device}, imageData={imageData})")
+        # Only log the size, formatting a full frame of image data is expensive
+        logger.debug("@display_send_image_data(device=%s, len(imageData)=%s)", device, len(imageData))
         device = self._verify_device(device)
 
+        if self.image_flow_control == 'adaptive':
+            return self._send_image_data_adaptive(device, imageData)
+
         # chunkSize = self._get_max_packet_size()
         chunkSize = 1000 # 1000 bytes at a time
         dataLen = len(imageData)
         chunks = math.ceil(len(imageData)/chunkSize)
 
-        logger.debug(f"Split {dataLen} bytes into {chunks} chunks of {chunkSize} bytes.")
+        logger.debug("Split %s bytes into %s chunks of %s bytes.", dataLen, chunks, chunkSize)
 
         start_time = time.time()
         for i in range(chunks):
@@ -380,113 +636,266 @@ class DialSerialDriver(SerialHardware):
                 return False
             time.sleep(0.2)
         end_time = time.time()
-        logger.debug(f"Send image data took {timedelta(seconds=end_time-start_time)}")
+        logger.debug("Send image data took %s", timedelta(seconds=end_time-start_time))
+        return True
+
+    def _image_chunk_size(self, device):
+        # Dial RX buffer size does not change, so only ask once per dial
+        if device not in self._rx_buffer_sizes:
+            rx_size = self.get_dial_rx_buffer_size(device)
+            if rx_size > 0:
+                self._rx_buffer_sizes[device] = rx_size
+            else:
+                rx_size = self.hub_config.GAUGE_COMM_MAX_TX_DATA_LEN
+        else:
+            rx_size = self._rx_buffer_sizes[device]
+        # Frame payload is the device index byte followed by the chunk, keep it within the protocol limit
+        return max(1, min(rx_size, self.hub_config.GAUGE_COMM_MAX_TX_DATA_LEN - 1))
+
+    def _send_image_data_adaptive(self, device, imageData):
+        """
+        Send image data as fast as the hub acknowledges it.
+        Next chunk is sent as soon as the previous one is ACKed. If the hub reports GAUGE_STATUS_BUSY
+        the same chunk is re-sent after an exponentially growing delay.
+        """
+        if not isinstance(imageData, (bytes, bytearray, memoryview)):
+            imageData = bytes(imageData)
+        imageData = memoryview(imageData)
+
+        chunkSize = self._image_chunk_size(device)
+        dataLen = len(imageData)
+        logger.debug("Sending %s bytes in chunks of %s bytes.", dataLen, chunkSize)
+
+        min_backoff, max_backoff = self.image_busy_backoff
+        backoff = min_backoff
+        busy_retries = 0
+        pos = 0
+
+        start_time = time.time()
+        while pos < dataLen:
+            dataChunk = imageData[pos:pos+chunkSize]
+            status = self._send_image_chunk_status(device, dataChunk)
+
+            if status == self.status_codes.GAUGE_STATUS_OK:
+                pos += len(dataChunk)
+                backoff = min_backoff
+                busy_retries = 0
+                continue
+
+            if status == self.status_codes.GAUGE_STATUS_BUSY and busy_retries < self.image_busy_retries:
+                busy_retries += 1
+                HUB_RETRIES.labels('image_busy').inc()
+                logger.debug("Dial %s busy, retrying chunk in %.3fs", device, backoff)
+                time.sleep(backoff)
+                backoff = min(backoff*2, max_backoff)
+                continue
+
+            logger.error("Image transfer to dial %s failed at byte %s/%s (status: %s)", device, pos, dataLen, status)
+            return False
+
+        elapsed = max(time.time() - start_time, 1e-6)
+        self.image_throughput[device] = dataLen/elapsed
+        logger.info("Sent %s bytes of image data to dial %s in %s (%.0f B/s)", dataLen, device, timedelta(seconds=elapsed), dataLen/elapsed)
         return True
 
     def _send_image_chunk(self, device, imageBuffer):
-        logger.debug(f"@_send_image_chunk(device={device})")
+        return self._send_image_chunk_status(device, imageBuffer) == self.status_codes.GAUGE_STATUS_OK
+
+    def _send_image_chunk_status(self, device, imageBuffer):
+        logger.debug("@_send_image_chunk(device=%s)", device)
         if len(imageBuffer) <= 0:
             logger.error("Invalid image buffer size!")
-            return False
+            return None
         if isinstance(device, str):
             device = self._findDial(device)
             device = int(device)
 
-        data = [ device ]
-        data.extend(imageBuffer)
-        return self._sendCommand(self.commands.COMM_CMD_DISPLAY_IMG_DATA, self.data_type.COMM_DATA_SINGLE_VALUE, len(data), data)
-
-    def _format_bits(self, bits):
-        buff = []
-        for i in bits:
-            if i > 127:
-                buff.append(1)
-            else:
-                buff.append(0)
-        return buff
-
-    def binary_to_image_data(self, image):
-        img = Image.open(Image.open(BytesIO(image)))
-        img = img.convert("L")
-
-        imgData = np.asarray(img)
-        imgData = imgData.T.tolist()
+        if not isinstance(imageBuffer, (bytes, bytearray, memoryview)):
+            imageBuffer = bytes(imageBuffer)
 
-        buff = []
-        # Each byte is 8 vertical bits
-        for bits in imgData:
-            bits = self._format_bits(bits)
-            byte = [int("".join(map(str, bits[i:i+8])), 2) for i in range(0, len(bits), 8)]
-            buff.append(byte)
+        payload = self._encode_frame(self.commands.COMM_CMD_DISPLAY_IMG_DATA, self.data_type.COMM_DATA_SINGLE_VALUE, bytes((device,)), imageBuffer)
+        start = time.perf_counter()
+        response = self.serial_transaction(payload)
+        HUB_COMMAND_LATENCY.labels(f"{self.commands.COMM_CMD_DISPLAY_IMG_DATA:02X}").observe(time.perf_counter() - start)
+        return self._parseStatus(response)
 
-        buff = [item for sublist in buff for item in sublist]
+    def _pack_image(self, img):
+        return pack_image(img)
 
-        return buff
+    def binary_to_image_data(self, image):
+        img = Image.open(BytesIO(image))
+        return self._pack_image(img).tobytes()
 
     def img_to_binary(self, img_filepath, flatten=True):
-        buff = []
-
         if not os.path.exists(img_filepath):
-            logger.error(f"File {img_filepath} does not exist!. Returning empty array.")
-            return buff
+            logger.error("File %s does not exist!. Returning empty array.", img_filepath)
+            return bytes()
 
         try:
-            #Load image and convert to greyscale
-            img = Image.open(img_filepath)
-            img = img.convert("L")
-
-            imgData = np.asarray(img)
-            imgData = imgData.T.tolist()
-
-            # Each byte is 8 vertical bits
-            for bits in imgData:
-                bits = self._format_bits(bits)
-                byte = [int("".join(map(str, bits[i:i+8])), 2) for i in range(0, len(bits), 8)]
-                buff.append(byte)
-
-            if flatten:
-                buff = [item for sublist in buff for item in sublist]
+            #Load image and convert to 1-bit column data
+            with Image.open(img_filepath) as img:
+                packed = self._pack_image(img)
         except Exception as e:
             logger.error(e)
+            return bytes()
 
-        return buff
-
-    def update_display(self, device, imageData=None, imageFile=None):
-        logger.debug(f"@update_display(device={device})")
+        if flatten:
+            return packed.tobytes()
+        return packed.tolist()
+
+    def update_display(self, device, imageData=None, imageFile=None, column_bytes=None):
+        """
+        Push image to the dial display.
+        If the dial already shows an image of the same size that was pushed by this driver,
+        only the changed parts of the framebuffer are sent (see `_framebuffer_delta`).
+
+        @param imageData packed image data (column major, 8 vertical pixels per byte)
+        @param imageFile path to image file (used if imageData is None)
+        @param column_bytes number of bytes per column in imageData (defaults to DISPLAY_HEIGHT/8)
+        """
+        logger.debug("@update_display(device=%s)", device)
         device = self._verify_device(device)
 
-        self.dial_display_clear(device, True)
-        self.dial_display_goto_xy(device, 0, 0)
-
         if imageData is not None:
-            self.display_send_image_data(device, imageData)
+            framebuffer = bytes(imageData)
+            if column_bytes is None:
+                column_bytes = math.ceil(self.DISPLAY_HEIGHT/8)
         elif imageFile is not None:
-            self.display_send_image(device, imageFile)
+            packed = self._load_packed_image(imageFile)
+            if packed is None:
+                return False
+            framebuffer = packed.tobytes()
+            column_bytes = packed.shape[1]
         else:
             raise ValueError("Image data and ImageFile can't both be none!")
+
+        previous = self._framebuffers.get(device, None)
+        if previous is not None and previous[0] == column_bytes and len(previous[1]) == len(framebuffer):
+            runs = self._framebuffer_delta(previous[1], framebuffer)
+            delta_len = sum(end-start for start, end in runs)
+            if not runs:
+                logger.debug("Dial %s already shows this image. Skipping update.", device)
+                return True
+            if delta_len <= len(framebuffer)*self.delta_max_ratio:
+                logger.debug("Sending %s/%s changed bytes in %s run(s) to dial %s", delta_len, len(framebuffer), len(runs), device)
+                start = time.perf_counter()
+                ret = self._update_display_delta(device, framebuffer, runs, column_bytes)
+                HUB_IMAGE_TRANSFER.labels('delta').observe(time.perf_counter() - start)
+                return ret
+
+        # Full update
+        start = time.perf_counter()
+        self._framebuffers.pop(device, None)
+        self.dial_display_clear(device, True)
+        self.dial_display_goto_xy(device, 0, 0)
+        if not self.display_send_image_data(device, framebuffer):
+            return False
         self.dial_display_show(device)
+        self._framebuffers[device] = (column_bytes, framebuffer)
+        HUB_IMAGE_TRANSFER.labels('full').observe(time.perf_counter() - start)
         return True
 
+    def pack_image_file(self, img_filepath):
+        """
+        @return (column_bytes, framebuffer) tuple for the image file or None if the image can't be loaded
+        """
+        packed = self._load_packed_image(img_filepath)
+        if packed is None:
+            return None
+        return packed.shape[1], packed.tobytes()
+
+    def _load_packed_image(self, img_filepath):
+        if not os.path.exists(img_filepath):
+            logger.error("File '%s' does not exist.", img_filepath)
+            return None
+        try:
+            with Image.open(img_filepath) as img:
+                return self._pack_image(img)
+        except Exception as e:
+            logger.error(e)
+            return None
+
+    def _framebuffer_delta(self, old, new):
+        """
+        Find runs of changed bytes between two framebuffers.
+        Changed bytes that are at most `delta_merge_gap` bytes apart are merged into a single run.
+
+        @return list of (start, end) byte offsets (end is exclusive)
+        """
+        changed = np.flatnonzero(np.frombuffer(old, dtype=np.uint8) != np.frombuffer(new, dtype=np.uint8))
+        if changed.size == 0:
+            return []
+
+        breaks = np.flatnonzero(np.diff(changed) > self.delta_merge_gap)
+        starts = changed[np.concatenate(([0], breaks+1))]
+        ends = changed[np.concatenate((breaks, [changed.size-1]))] + 1
+        return list(zip(starts.tolist(), ends.tolist()))
+
+    def _update_display_delta(self, device, framebuffer, runs, column_bytes):
+        # Dial writes image data sequentially (column by column) starting from the GOTO_XY position,
+        # same as the full frame update starting from (0, 0).
+        view = memoryview(framebuffer)
+        for start, end in runs:
+            x = start // column_bytes
+            y = (start % column_bytes) * 8
+            if self.dial_display_goto_xy(device, x, y) is not True or not self.display_send_image_data(device, view[start:end]):
+                # Dial framebuffer is now in unknown state, next update has to be a full one
+                self._framebuffers.pop(device, None)
+                return False
+
+        self.dial_display_show(device)
+        self._framebuffers[device] = (column_bytes, framebuffer)
+        return True
+
+    def invalidate_framebuffer(self, device=None):
+        if device is None:
+            self._framebuffers.clear()
+        else:
+            self._framebuffers.pop(self._verify_device(device), None)
 
     def get_dial_rx_buffer_size(self, device):
-        logger.debug(f"@get_dial_rx_buffer_size(device={device})")
+        logger.debug("@get_dial_rx_buffer_size(device=%s)", device)
         rxLen = self._sendCommand(self.commands.COMM_CMD_RX_BUFFER_SIZE, self.data_type.COMM_DATA_SINGLE_VALUE, 1, int(device))
-        rxLen = int(rxLen[:8], 16)
+        try:
+            rxLen = int(rxLen[:8], 16)
+        except (TypeError, ValueError):
+            logger.error("Invalid RX buffer size response from dial %s: %s", device, rxLen)
+            return 0
         return rxLen
 
     def dial_display_show(self, device):
-        logger.debug(f"@dial_display_show(device={device})")
+        logger.debug("@dial_display_show(device=%s)", device)
         return self._sendCommand(self.commands.COMM_CMD_DISPLAY_SHOW_IMG, self.data_type.COMM_DATA_SINGLE_VALUE, 1, int(device))
 
     def dial_set_backlight(self, device, red, green, blue, white):
-        logger.debug(f"@dial_set_backlight(device={device}, red={red}, green={green}, green={green}, blue={blue}, white={white})")
+        logger.debug("@dial_set_backlight(device=%s, red=%s, green=%s, blue=%s, white=%s)", device, red, green, blue, white)
         device = self._verify_device(device)
         self.dials[device]['rgbw'][0] = red
         self.dials[device]['rgbw'][1] = green
         self.dials[device]['rgbw'][2] = blue
         self.dials[device]['rgbw'][3] = white
-        data = [device, red, green, blue, white]
-        return self._sendCommand(self.commands.COMM_CMD_SET_RGB_BACKLIGHT, self.data_type.COMM_DATA_MULTIPLE_VALUE, len(data), data)
+        data = bytes((device, red&0xFF, green&0xFF, blue&0xFF, white&0xFF))
+        return self._sendFrame(self.commands.COMM_CMD_SET_RGB_BACKLIGHT, self.data_type.COMM_DATA_MULTIPLE_VALUE, data)
+
+    def dial_batch_set_backlight(self, updates):
+        """
+        Pipelined backlight update for multiple dials.
+
+        @param updates list of (device, red, green, blue, white) tuples
+        @return list of devices that could not be updated
+        """
+        logger.debug("@dial_batch_set_backlight(updates=%s)", updates)
+        commands = []
+        devices = []
+        for device, red, green, blue, white in updates:
+            device = self._verify_device(device)
+            self.dials[device]['rgbw'] = [red, green, blue, white]
+            data = bytes((device, red&0xFF, green&0xFF, blue&0xFF, white&0xFF))
+            commands.append((self.commands.COMM_CMD_SET_RGB_BACKLIGHT, self.data_type.COMM_DATA_MULTIPLE_VALUE, len(data), data))
+            devices.append(device)
+
+        results = self._sendCommands(commands)
+        return [device for device, result in zip(devices, results) if result is not True]
 
     def dial_send_keep_comm_alive(self, device):
         pass
@@ -517,9 +926,13 @@ class DialSerialDriver(SerialHardware):
             print(f"  - Value:{dial['value']}")
 
     @classmethod
-    def find_gauge_hub(cls):
+    def find_gauge_hubs(cls):
+        """
+        @return list of all VU1 hub ports (VID:1027 PID:24597) found on the USB bus
+        """
+        hubs = []
         availablePorts = comports()
-        logger.debug("Searching for COM port with VID:1027 and PID:24597")
+        logger.debug("Searching for COM ports with VID:1027 and PID:24597")
         for port in availablePorts:
             logger.debug(f"{port.device}")
             logger.debug(f"\tProduct: {port.product}")
@@ -529,6 +942,13 @@ class DialSerialDriver(SerialHardware):
             logger.debug(f"\tLocation: {port.location}")
             logger.debug(f"\tInterface: {port.interface}")
             if port.vid == 1027 and port.pid == 24597:
-                logger.debug("Using '{}' as GaugeHub COM port".format(port.description))
-                return port
-        return None
+                logger.debug("Found GaugeHub on '{}'".format(port.description))
+                hubs.append(port)
+        return hubs
+
+    @classmethod
+    def find_gauge_hub(cls):
+        hubs = cls.find_gauge_hubs()
+        if not hubs:
+            return None
+        return hubs[0]
@@ -0,0 +1,128 @@
+import json
+import threading
+from tornado.ioloop import IOLoop
+from tornado.websocket import WebSocketHandler, WebSocketClosedError
+from dials.base_logger import logger
+
+# DialEventBroker Class
+# ---
+# Receives dial state change events from ServerDialHandler (from any thread)
+# and fans them out to connected WebSocket clients on the IOLoop thread.
+# ---
+class DialEventBroker:
+    def __init__(self, dial_handler):
+        self.dial_handler = dial_handler
+        self.clients = set()
+        self.io_loop = None
+        self._io_loop_thread = None
+        dial_handler.add_listener(self.publish)
+
+    def register(self, client):
+        # Clients are registered from the IOLoop, remember it so events from other threads can be handed over
+        if self.io_loop is None:
+            self.io_loop = IOLoop.current()
+            self._io_loop_thread = threading.get_ident()
+        self.clients.add(client)
+
+    def unregister(self, client):
+        self.clients.discard(client)
+
+    def publish(self, dial_uid, event, data):
+        if not self.clients:
+            return
+        if threading.get_ident() == self._io_loop_thread:
+            self._dispatch(dial_uid, event, data)
+        else:
+            self.io_loop.add_callback(self._dispatch, dial_uid, event, data)
+
+    def _dispatch(self, dial_uid, event, data):
+        for client in list(self.clients):
+            client.queue_event(dial_uid, event, data)
+
+
+# Dial_Events_Socket Class
+# ---
+# WebSocket that pushes dial state changes to the client.
+# `/api/v0/dial/events?key=<api key>[&dials=UID1;UID2]`
+# Client can change subscription by sending `{"subscribe": ["UID1", "UID2"]}`.
+#
+# Events are coalesced per dial while a previous message is being written,
+# so a slow client only ever holds the latest state of each dial it subscribed to.
+# ---
+class Dial_Events_Socket(WebSocketHandler):
+    def initialize(self, handler, config, broker):
+        self.handler = handler # pylint: disable=attribute-defined-outside-init
+        self.config = config # pylint: disable=attribute-defined-outside-init
+        self.broker = broker # pylint: disable=attribute-defined-outside-init
+        self.api_key = None # pylint: disable=attribute-defined-outside-init
+        self.subscribed = set() # pylint: disable=attribute-defined-outside-init
+        self.pending = {} # pylint: disable=attribute-defined-outside-init
+        self.flushing = False # pylint: disable=attribute-defined-outside-init
+
+    def check_origin(self, origin):
+        # API is already open to any origin (see BaseHandler), access is controlled by API key
+        return True
+
+    def open(self, *args, **kwargs):
+        self.api_key = self.get_argument('key', None)
+        if not self.config.is_valid_api_key(self.api_key):
+            logger.error("Event socket: invalid API key")
+            self.close(code=4001, reason='Unauthorized')
+            return
+
+        dials = self.get_argument('dials', None)
+        self._subscribe(dials.split(';') if dials else None)
+        self.broker.register(self)
+        logger.debug(f"Event socket opened, subscribed to {len(self.subscribed)} dial(s)")
+
+    def on_message(self, message):
+        try:
+            request = json.loads(message)
+        except ValueError:
+            return
+        if isinstance(request, dict) and 'subscribe' in request:
+            self._subscribe(request['subscribe'])
+
+    def on_close(self):
+        self.broker.unregister(self)
+        self.pending.clear()
+
+    def _subscribe(self, dials=None):
+        available = self.handler.get_dial_info()
+        if dials is None:
+            dials = list(available)
+
+        self.subscribed = {uid for uid in dials if uid in available and self.config.api_key_has_access_to_dial(self.api_key, uid)} # pylint: disable=attribute-defined-outside-init
+
+        # Start with a snapshot of the current state
+        for uid in self.subscribed:
+            dial = available[uid]
+            self.queue_event(uid, 'value', dial['value'])
+            self.queue_event(uid, 'backlight', dict(dial['backlight']))
+            self.queue_event(uid, 'online', dial.get('online', True))
+
+    def queue_event(self, dial_uid, event, data):
+        if dial_uid not in self.subscribed:
+            return
+
+        state = self.pending.setdefault(dial_uid, {})
+        if isinstance(data, dict) and isinstance(state.get(event, None), dict):
+            state[event].update(data)
+        else:
+            state[event] = data
+
+        if not self.flushing:
+            self.flushing = True # pylint: disable=attribute-defined-outside-init
+            IOLoop.current().add_callback(self._flush)
+
+    async def _flush(self):
+        try:
+            while self.pending:
+                events = self.pending
+                self.pending = {} # pylint: disable=attribute-defined-outside-init
+                # Wait until message is written, anything that arrives meanwhile is coalesced into `pending`
+                await self.write_message({'type': 'update', 'data': events})
+        except WebSocketClosedError:
+            self.pending.clear()
+        finally:
+            self.flushing = False # pylint: disable=attribute-defined-outside-init
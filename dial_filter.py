@@ -0,0 +1,79 @@
+# DialValueFilter Class
+# ---
+# Server side value filter that sits between the API and the periodic dial updater.
+#   ema_alpha - exponential moving average weight of the new target, applied once per update tick (1.0 = no smoothing)
+#   max_rate  - maximum needle movement in percent per second (0 = unlimited)
+#   deadband  - minimum change (in percent) that is worth sending to the dial (0 = send every change)
+# ---
+class DialValueFilter:
+    def __init__(self, ema_alpha=1.0, max_rate=0, deadband=0, value=0):
+        self.configure(ema_alpha, max_rate, deadband)
+        self.target = float(value)
+        self.output = float(value)
+        self.last_step = None
+        self.converging = False
+
+    def configure(self, ema_alpha=1.0, max_rate=0, deadband=0):
+        self.ema_alpha = min(max(float(ema_alpha), 0.01), 1.0)
+        self.max_rate = max(float(max_rate), 0.0)
+        self.deadband = max(float(deadband), 0.0)
+
+    def is_passthrough(self):
+        return self.ema_alpha >= 1.0 and self.max_rate <= 0 and self.deadband <= 0
+
+    def config(self):
+        return {'ema_alpha': self.ema_alpha, 'max_rate': self.max_rate, 'deadband': self.deadband}
+
+    def set_target(self, value):
+        self.target = float(value)
+
+    def reset(self, value):
+        self.target = float(value)
+        self.output = float(value)
+        self.converging = False
+
+    def step(self, now):
+        """
+        Move filter output one tick towards the target.
+
+        @param now current time in seconds (monotonic)
+        @return filtered output value
+        """
+        dt = 0 if self.last_step is None else now - self.last_step
+        self.last_step = now
+
+        new_output = self.output + self.ema_alpha*(self.target - self.output)
+
+        # Snap to target once we are close enough, otherwise EMA never gets there
+        if abs(self.target - new_output) < 0.5:
+            new_output = self.target
+
+        if self.max_rate > 0:
+            max_step = self.max_rate*dt
+            new_output = min(max(new_output, self.output - max_step), self.output + max_step)
+
+        self.output = new_output
+        return self.output
+
+    def should_send(self, sent_value, new_value):
+        """
+        Check if filtered value is worth sending to the dial.
+
+        @param sent_value value that was last sent to the dial
+        @param new_value new filtered (rounded) value
+        @return True if dial should be updated
+        """
+        if new_value == sent_value:
+            return False
+
+        if abs(new_value - sent_value) >= self.deadband:
+            # Needle is moving, keep going until it lands on the target
+            self.converging = new_value != round(self.target)
+            return True
+
+        # Final step of a move that already exceeded the deadband may land exactly on the target
+        if self.converging and new_value == round(self.target):
+            self.converging = False
+            return True
+
+        return False
@@ -0,0 +1,211 @@
+import json
+from threading import Lock
+import numpy as np
+from dials.base_logger import logger
+
+MAPPING_TYPES = ('percent', 'linear', 'clamped', 'log', 'piecewise')
+PASSTHROUGH_COEFFICIENTS = (1.0, 0.0, 0.0, 100.0, 0.0)
+
+
+class DialMappingError(ValueError):
+    pass
+
+
+# DialMapping Class
+# ---
+# Value-to-percent mapping profile of a single dial.
+#   percent   - value is already in percent (default, pass-through)
+#   linear    - [in_min, in_max] maps to [out_min, out_max], extrapolated outside of the input range
+#   clamped   - same as linear, but the result never leaves [out_min, out_max]
+#   log       - log10 scale between in_min and in_max (both must be > 0)
+#   piecewise - linear interpolation between `points` ([[input, percent], ...], sorted by input)
+# ---
+class DialMapping:
+    def __init__(self, kind='percent', in_min=0, in_max=100, out_min=0, out_max=100, unit='', points=None):
+        if kind not in MAPPING_TYPES:
+            raise DialMappingError(f"Unknown mapping type `{kind}`. Expecting one of {', '.join(MAPPING_TYPES)}")
+
+        self.kind = kind
+        self.in_min = float(in_min)
+        self.in_max = float(in_max)
+        self.out_min = float(out_min)
+        self.out_max = float(out_max)
+        self.unit = unit or ''
+        self.points = self._parse_points(points) if kind == 'piecewise' else []
+
+        if kind in ('linear', 'clamped', 'log') and self.in_min == self.in_max:
+            raise DialMappingError("Mapping `min` and `max` must be different")
+
+        if kind == 'log' and (self.in_min <= 0 or self.in_max <= 0):
+            raise DialMappingError("Logarithmic mapping needs `min` and `max` above 0")
+
+    @staticmethod
+    def _parse_points(points):
+        if isinstance(points, str):
+            try:
+                points = json.loads(points)
+            except ValueError as e:
+                raise DialMappingError("Piecewise `points` must be a JSON list of [input, percent] pairs") from e
+
+        try:
+            points = sorted((float(x), float(y)) for x, y in points)
+        except (TypeError, ValueError) as e:
+            raise DialMappingError("Piecewise `points` must be a list of [input, percent] pairs") from e
+
+        if len(points) < 2:
+            raise DialMappingError("Piecewise mapping needs at least 2 points")
+        return points
+
+    def is_passthrough(self):
+        return self.kind == 'percent'
+
+    def coefficients(self):
+        """
+        Reduce linear/clamped/log profiles to `percent = x * scale + offset` (x is log10(value) for log
+        profiles) followed by clamping to [low, high].
+
+        @return tuple (scale, offset, low, high, is_log)
+        """
+        if self.kind == 'percent':
+            return PASSTHROUGH_COEFFICIENTS
+
+        in_min, in_max = self.in_min, self.in_max
+        if self.kind == 'log':
+            in_min, in_max = np.log10(in_min), np.log10(in_max)
+
+        scale = (self.out_max - self.out_min) / (in_max - in_min)
+        offset = self.out_min - in_min*scale
+
+        low, high = 0.0, 100.0
+        if self.kind == 'clamped':
+            low, high = min(self.out_min, self.out_max), max(self.out_min, self.out_max)
+
+        return scale, offset, low, high, self.kind == 'log'
+
+    def to_dict(self):
+        return {
+            'type': self.kind,
+            'min': self.in_min,
+            'max': self.in_max,
+            'out_min': self.out_min,
+            'out_max': self.out_max,
+            'unit': self.unit,
+            'points': [list(point) for point in self.points],
+        }
+
+    def to_db(self):
+        return {
+            'mapping_type': self.kind,
+            'mapping_min': self.in_min,
+            'mapping_max': self.in_max,
+            'mapping_out_min': self.out_min,
+            'mapping_out_max': self.out_max,
+            'mapping_unit': self.unit,
+            'mapping_points': json.dumps([list(point) for point in self.points]),
+        }
+
+    @classmethod
+    def from_dict(cls, mapping):
+        return cls(kind=mapping.get('type', 'percent'),
+                   in_min=mapping.get('min', 0),
+                   in_max=mapping.get('max', 100),
+                   out_min=mapping.get('out_min', 0),
+                   out_max=mapping.get('out_max', 100),
+                   unit=mapping.get('unit', ''),
+                   points=mapping.get('points', None))
+
+
+# DialMapper Class
+# ---
+# Holds mapping profiles of all dials and maps raw values to percent.
+# Profiles are flattened into coefficient tables whenever a profile changes, so mapping
+# a batch of values is a handful of numpy operations regardless of the number of dials.
+# Use `set_profiles` when registering many dials, tables are then rebuilt only once.
+# ---
+class DialMapper:
+    def __init__(self):
+        self.profiles = {}
+        self._lock = Lock()
+        self._rebuild()
+
+    def set_profile(self, dial_uid, mapping):
+        self.set_profiles({dial_uid: mapping})
+
+    def set_profiles(self, profiles):
+        """
+        @param profiles dictionary of {dial_uid: DialMapping}
+        """
+        with self._lock:
+            self.profiles.update(profiles)
+            self._rebuild()
+
+    def remove_profile(self, dial_uid):
+        with self._lock:
+            if self.profiles.pop(dial_uid, None) is not None:
+                self._rebuild()
+
+    def get_profile(self, dial_uid):
+        return self.profiles.get(dial_uid, None)
+
+    def is_passthrough(self, dial_uid):
+        mapping = self.profiles.get(dial_uid, None)
+        return mapping is None or mapping.is_passthrough()
+
+    def _rebuild(self):
+        # Swap in a complete set of tables so concurrent readers never see a half-built state
+        index = {}
+        coefficients = []
+        piecewise = {}
+        for row, (dial_uid, mapping) in enumerate(self.profiles.items()):
+            index[dial_uid] = row
+            coefficients.append(mapping.coefficients())
+            if mapping.kind == 'piecewise':
+                points = np.array(mapping.points, dtype=np.float64)
+                piecewise[row] = (points[:, 0], points[:, 1])
+
+        # Last row is used for dials without profile (row index -1)
+        coefficients.append(PASSTHROUGH_COEFFICIENTS)
+        table = np.array(coefficients, dtype=np.float64)
+        self._tables = (index, table, piecewise)
+
+    def map(self, dial_uid, value):
+        return float(self.map_many([dial_uid], [value])[0])
+
+    def map_many(self, dial_uids, values):
+        """
+        Map raw values of multiple dials to percent.
+
+        @param dial_uids list of dial UIDs, dials without profile are treated as `percent`
+        @param values list of raw values (same length as dial_uids)
+        @return numpy array of percent values in range 0-100
+        """
+        index, table, piecewise = self._tables
+        values = np.asarray(values, dtype=np.float64)
+        rows = np.array([index.get(dial_uid, -1) for dial_uid in dial_uids], dtype=np.intp)
+
+        scale, offset, low, high, is_log = table[rows].T
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x = np.where(is_log > 0, np.log10(np.maximum(values, np.finfo(np.float64).tiny)), values)
+        result = np.clip(x*scale + offset, low, high)
+
+        for position, row in enumerate(rows):
+            if row in piecewise:
+                xp, fp = piecewise[row]
+                result[position] = np.interp(values[position], xp, fp)
+
+        return np.clip(np.nan_to_num(result, nan=0.0), 0.0, 100.0)
+
+
+def mapping_from_db(dial_info):
+    try:
+        return DialMapping(kind=dial_info['mapping_type'],
+                           in_min=dial_info['mapping_min'],
+                           in_max=dial_info['mapping_max'],
+                           out_min=dial_info['mapping_out_min'],
+                           out_max=dial_info['mapping_out_max'],
+                           unit=dial_info['mapping_unit'],
+                           points=dial_info['mapping_points'])
+    except DialMappingError as e:
+        logger.error(f"Invalid mapping stored for dial {dial_info['dial_uid']} ({e}). Using `percent`.")
+        return DialMapping()
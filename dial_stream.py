@@ -0,0 +1,100 @@
+import json
+from tornado.websocket import WebSocketHandler
+from dials.base_logger import logger
+from metrics import STREAM_UPDATES
+
+STREAM_RECEIVED = STREAM_UPDATES.labels('received')
+STREAM_REJECTED = STREAM_UPDATES.labels('rejected')
+
+# Dial_Stream_Socket Class
+# ---
+# Persistent ingest channel for high-rate producers.
+# `/api/v0/dials/stream?key=<api key>`
+# API key is checked once when the socket is opened. After that every message is one of:
+#   {"uid": "UID", "value": 42}
+#   [{"uid": "UID1", "value": 42}, {"uid": "UID2", "value": 7}]
+#   {"UID1": 42, "UID2": 7}
+# Values are raw (mapped through the dial mapping profile) and go straight into
+# `ServerDialHandler.dial_set_values`, so the last value received before the next hub
+# update tick wins and memory use does not grow with message rate.
+# Received and rejected updates of all connections are exported on `/metrics` (vu_stream_updates_total).
+# ---
+class Dial_Stream_Socket(WebSocketHandler):
+    def initialize(self, handler, config):
+        self.handler = handler # pylint: disable=attribute-defined-outside-init
+        self.config = config # pylint: disable=attribute-defined-outside-init
+        self.api_key = None # pylint: disable=attribute-defined-outside-init
+        self.access = {} # pylint: disable=attribute-defined-outside-init
+        self.received = 0 # pylint: disable=attribute-defined-outside-init
+        self.rejected = 0 # pylint: disable=attribute-defined-outside-init
+
+    def check_origin(self, origin):
+        # API is already open to any origin (see BaseHandler), access is controlled by API key
+        return True
+
+    def open(self, *args, **kwargs):
+        self.api_key = self.get_argument('key', None) # pylint: disable=attribute-defined-outside-init
+        if not self.config.is_valid_api_key(self.api_key):
+            logger.error("Stream socket: invalid API key")
+            self.close(code=4001, reason='Unauthorized')
+            return
+        logger.debug("Stream socket opened")
+
+    def on_message(self, message):
+        try:
+            frames = json.loads(message)
+        except ValueError:
+            self._count(0, 1)
+            return
+
+        if isinstance(frames, dict):
+            if 'uid' in frames:
+                frames = [frames]
+            else:
+                frames = [{'uid': uid, 'value': value} for uid, value in frames.items()]
+        elif not isinstance(frames, list):
+            self._count(0, 1)
+            return
+
+        values = {}
+        rejected = 0
+        for frame in frames:
+            try:
+                dial_uid = frame['uid']
+                value = frame['value']
+            except (KeyError, TypeError):
+                rejected += 1
+                continue
+
+            if not isinstance(dial_uid, str) or not self._has_access(dial_uid):
+                rejected += 1
+                continue
+
+            values[dial_uid] = value
+
+        self._count(len(frames), rejected)
+        if values:
+            self.handler.dial_set_values(values)
+
+    def _count(self, received, rejected):
+        self.received += received
+        self.rejected += rejected
+        STREAM_RECEIVED.inc(received)
+        if rejected:
+            STREAM_REJECTED.inc(rejected)
+
+    def _has_access(self, dial_uid):
+        # Access is cached per connection, API key changes apply to new connections.
+        # Only known dials are cached, so the cache can't grow with made up UIDs
+        access = self.access.get(dial_uid, None)
+        if access is None:
+            known = self.handler.get_dial_info(dial_uid) is not None
+            access = known and self.config.api_key_has_access_to_dial(self.api_key, dial_uid)
+            if known:
+                self.access[dial_uid] = access
+            if not access:
+                self.write_message({'status': 'fail', 'uid': dial_uid, 'message': 'Unauthorized or unknown dial.'})
+        return access
+
+    def on_close(self):
+        logger.debug(f"Stream socket closed ({self.received} updates received, {self.rejected} rejected)")
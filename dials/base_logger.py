@@ -1,8 +1,9 @@
 import os
 import getpass
 import sys
+import queue
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from functools import partial, partialmethod
 
 def colorize(data, color):
@@ -67,6 +68,44 @@ def set_logger_level(level='info'):
         logger.setLevel(logging.INFO)
         logger.info("Logging level: INFO")
 
+# Set by enable_queue_logging()
+queue_listener = None
+
+def enable_queue_logging():
+    '''
+        Move all handlers of the shared logger behind a QueueHandler.
+        Log records are only put on a queue by the calling thread (serial/hub worker, IOLoop),
+        formatting and writing to stderr and the rotating log file happen on the listener thread.
+    '''
+    global queue_listener # pylint: disable=global-statement
+    if queue_listener is not None:
+        return
+
+    handlers = list(logger.handlers)
+    for log_handler in handlers:
+        logger.removeHandler(log_handler)
+
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(QueueHandler(log_queue))
+    queue_listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    queue_listener.start()
+    logger.info("Queue based logging enabled")
+
+def disable_queue_logging():
+    '''
+        Flush queued log records and restore direct logging
+    '''
+    global queue_listener # pylint: disable=global-statement
+    if queue_listener is None:
+        return
+
+    listener, queue_listener = queue_listener, None
+    listener.stop()
+    for log_handler in list(logger.handlers):
+        logger.removeHandler(log_handler)
+    for log_handler in listener.handlers:
+        logger.addHandler(log_handler)
+
 '''
     Shared stdout logger and logging to file
 '''
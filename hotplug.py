@@ -0,0 +1,83 @@
+import threading
+from serial.tools.list_ports import comports
+from dials.base_logger import logger
+from hub_worker import PRIORITY_LOW
+
+
+def _port_id(port):
+    return port.serial_number or port.device
+
+
+# HotplugScanner Class
+# ---
+# Picks up dials and hubs that were plugged in or removed while the server is running.
+# Every `interval` seconds an incremental bus scan (one device map query, see `ServerDialHandler.scan_hub`)
+# is queued on every hub worker with low priority, so it only runs when the worker has nothing better to do.
+# USB ports are polled with `comports()`. Dials of a hub that disappeared are marked offline and the hub is
+# re-opened (and its dials reconfigured) once it is enumerated again, even under a different port name.
+# Only hubs that were found on the USB bus are watched, ports set by path (ie. hub simulator) are not.
+# ---
+class HotplugScanner:
+    def __init__(self, dial_handler, interval=5):
+        self.dial_handler = dial_handler
+        self.interval = interval
+        self._thread = None
+        self._stop = threading.Event()
+        self._pending = {}
+        self._reported = set()
+        self._watched = {}
+
+    def start(self):
+        if not self.interval or self._thread is not None:
+            return
+
+        present = {_port_id(port) for port in comports()}
+        for hub, dial_driver in enumerate(self.dial_handler.dial_drivers):
+            if dial_driver.hub_id() in present:
+                self._watched[hub] = dial_driver.hub_id()
+        self._reported = set(self._watched.values())
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='hotplug-scanner', daemon=True)
+        self._thread.start()
+        logger.info(f"Hot-plug scanner running every {self.interval}s")
+
+    def stop(self, timeout=5):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self._poll_ports()
+            except Exception as e:
+                logger.error(f"Hot-plug USB port poll failed: {e}")
+
+            for hub in range(len(self.dial_handler.dial_drivers)):
+                self._queue(hub, self.dial_handler.scan_hub, hub)
+
+    def _queue(self, hub, fn, *args):
+        # Don't pile up scans behind a busy worker
+        pending = self._pending.get(hub, None)
+        if pending is not None and not pending.done():
+            return
+        self._pending[hub] = self.dial_handler.enqueue(fn, *args, priority=PRIORITY_LOW, hub=hub)
+
+    def _poll_ports(self):
+        ports = {_port_id(port): port for port in comports()}
+
+        for hub, hub_id in self._watched.items():
+            connected = self.dial_handler.hub_connected[hub]
+            if connected and hub_id not in ports:
+                self._queue(hub, self.dial_handler.hub_disconnected, hub)
+            elif not connected and hub_id in ports:
+                self._queue(hub, self.dial_handler.hub_reconnected, hub, ports[hub_id])
+
+        for hub_id, port in ports.items():
+            if hub_id in self._reported or (port.vid, port.pid) != (1027, 24597):
+                continue
+            self._reported.add(hub_id)
+            logger.info(f"New VU1 hub found on {port.device}. Restart VU Server to use it.")
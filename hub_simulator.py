@@ -0,0 +1,369 @@
+import os
+import sys
+import time
+import random
+import select
+import argparse
+import threading
+import numpy as np
+from PIL import Image
+from dials.Comms_Hub_Server import hub_config, hub_commands, hub_data_types, hub_status_codes
+from dials.base_logger import logger, set_logger_level
+
+COMMANDS = hub_commands()
+DATA_TYPES = hub_data_types()
+STATUS = hub_status_codes()
+
+
+# VirtualDial Class
+# ---
+# State of one simulated dial: needle, backlight, easing and an e-ink framebuffer with the same
+# layout the driver sends (column major, 8 vertical pixels per byte, MSB is the top pixel).
+# ---
+class VirtualDial:
+    def __init__(self, index, width=200, height=144, rx_buffer_size=1000, hub_id=0):
+        self.index = index
+        self.uid = bytes.fromhex(f"53494D{hub_id:02X}{index:016X}")     # 'SIM' + hub + index
+        self.value = 0
+        self.raw = 0
+        self.rgbw = [0, 0, 0, 0]
+        self.calibration = {'max': 0, 'half': 0}
+        self.easing = {'dial_step': 2, 'dial_period': 50, 'backlight_step': 5, 'backlight_period': 100}
+        self.build_hash = 'simulator'
+        self.fw_version = 'v0.0.0-sim'
+        self.hw_version = 'sim'
+        self.protocol_version = 'v1'
+
+        self.width = width
+        self.height = height
+        self.column_bytes = (height + 7) // 8
+        self.rx_buffer_size = rx_buffer_size
+        self.framebuffer = bytearray(b'\xFF' * (width * self.column_bytes))
+        self.displayed = bytes(self.framebuffer)
+        self.cursor = 0
+        self.frames_shown = 0
+
+    def image(self, displayed=True):
+        """
+        @return PIL image of the displayed (or not yet shown) framebuffer
+        """
+        data = self.displayed if displayed else bytes(self.framebuffer)
+        columns = np.frombuffer(data, dtype=np.uint8).reshape(self.width, self.column_bytes)
+        bits = np.unpackbits(columns, axis=1)
+        remainder = self.height % 8
+        if remainder:
+            split = self.height - remainder
+            bits = np.concatenate((bits[:, :split], bits[:, split + 8 - remainder:]), axis=1)
+        return Image.fromarray((bits.T * 255).astype(np.uint8), mode='L')
+
+
+# HubSimulator Class
+# ---
+# Software VU1 hub speaking the `>CCTTLLLL<hex>` / `<CCTTLLLL<hex>` protocol from dials/Comms_Hub_Server.py.
+# Runs on the master side of a pseudo terminal, the slave path can be passed to DialSerialDriver
+# (or set as hardware `port` in config.yaml) like a real hub port.
+#   num_dials      - number of dials on the bus (indexes 0..num_dials-1)
+#   latency        - processing time of every command in seconds
+#   latencies      - per command overrides, ie. {COMM_CMD_DISPLAY_IMG_DATA: 0.05}
+#   baudrate       - simulated link speed (10 bits per byte) for both directions, None to disable throttling
+#   busy_ratio     - probability that an image data chunk is answered with GAUGE_STATUS_BUSY
+#   hub_id         - part of the dial UIDs, so dials of several simulated hubs don't collide
+# ---
+class HubSimulator:
+    def __init__(self, num_dials=4, latency=0.0, latencies=None, baudrate=None, busy_ratio=0.0,
+                 rx_buffer_size=1000, width=200, height=144, seed=None, hub_id=0):
+        self.dials = {index: VirtualDial(index, width, height, rx_buffer_size, hub_id) for index in range(num_dials)}
+        self.map_size = num_dials
+        self.latency = latency
+        self.latencies = latencies or {}
+        self.baudrate = baudrate
+        self.busy_ratio = busy_ratio
+        self.random = random.Random(seed)
+        self.powered = True
+
+        self.commands_received = {}
+        self.bytes_received = 0
+        self.bytes_sent = 0
+
+        self.port = None
+        self._master = None
+        self._slave = None
+        self._thread = None
+        self._stop = threading.Event()
+
+        self._handlers = {
+            COMMANDS.COMM_CMD_SET_DIAL_RAW_SINGLE: self._cmd_set_raw,
+            COMMANDS.COMM_CMD_SET_DIAL_PERC_SINGLE: self._cmd_set_percent,
+            COMMANDS.COMM_CMD_SET_DIAL_PERC_MULTIPLE: self._cmd_set_percent,
+            COMMANDS.COMM_CMD_SET_DIAL_CALIBRATE_MAX: self._cmd_calibrate,
+            COMMANDS.COMM_CMD_SET_DIAL_CALIBRATE_HALF: self._cmd_calibrate,
+            COMMANDS.COMM_CMD_GET_DEVICES_MAP: self._cmd_devices_map,
+            COMMANDS.COMM_CMD_PROVISION_DEVICE: self._cmd_ok,
+            COMMANDS.COMM_CMD_RESET_ALL_DEVICES: self._cmd_ok,
+            COMMANDS.COMM_CMD_RESCAN_BUS: self._cmd_ok,
+            COMMANDS.COMM_CMD_DEBUG_I2C_SCAN: self._cmd_ok,
+            COMMANDS.COMM_CMD_DIAL_POWER: self._cmd_power,
+            COMMANDS.COMM_CMD_GET_DEVICE_UID: self._cmd_get_uid,
+            COMMANDS.COMM_CMD_DISPLAY_CLEAR: self._cmd_display_clear,
+            COMMANDS.COMM_CMD_DISPLAY_GOTO_XY: self._cmd_display_goto_xy,
+            COMMANDS.COMM_CMD_DISPLAY_IMG_DATA: self._cmd_display_img_data,
+            COMMANDS.COMM_CMD_DISPLAY_SHOW_IMG: self._cmd_display_show,
+            COMMANDS.COMM_CMD_RX_BUFFER_SIZE: self._cmd_rx_buffer_size,
+            COMMANDS.COMM_CMD_SET_RGB_BACKLIGHT: self._cmd_set_backlight,
+            COMMANDS.COMM_CMD_SET_DIAL_EASING_STEP: self._cmd_set_easing,
+            COMMANDS.COMM_CMD_SET_DIAL_EASING_PERIOD: self._cmd_set_easing,
+            COMMANDS.COMM_CMD_SET_BACKLIGHT_EASING_STEP: self._cmd_set_easing,
+            COMMANDS.COMM_CMD_SET_BACKLIGHT_EASING_PERIOD: self._cmd_set_easing,
+            COMMANDS.COMM_CMD_GET_EASING_CONFIG: self._cmd_get_easing,
+            COMMANDS.COMM_CMD_GET_BUILD_INFO: self._cmd_get_info,
+            COMMANDS.COMM_CMD_GET_FW_INFO: self._cmd_get_info,
+            COMMANDS.COMM_CMD_GET_HW_INFO: self._cmd_get_info,
+            COMMANDS.COMM_CMD_GET_PROTOCOL_INFO: self._cmd_get_info,
+        }
+
+    # -- Transport
+    def start(self):
+        """
+        Open a pseudo terminal and start answering commands on a background thread.
+
+        @return path of the serial device to connect to (ie. /dev/pts/3)
+        """
+        if self._thread is not None:
+            return self.port
+        if sys.platform == 'win32':
+            raise OSError("Hub simulator needs a POSIX pseudo terminal")
+
+        import tty # pylint: disable=import-outside-toplevel
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._serve, name='hub-simulator', daemon=True)
+        self._thread.start()
+        logger.info(f"Hub simulator with {len(self.dials)} dial(s) listening on {self.port}")
+        return self.port
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(2)
+        self._thread = None
+        os.close(self._master)
+        os.close(self._slave)
+
+    def _serve(self):
+        rx_buffer = bytearray()
+        while not self._stop.is_set():
+            readable, _, _ = select.select([self._master], [], [], 0.1)
+            if not readable:
+                continue
+            try:
+                data = os.read(self._master, 4096)
+            except OSError:
+                break
+            self._throttle(len(data))
+            self.bytes_received += len(data)
+            rx_buffer.extend(data)
+
+            while True:
+                end = rx_buffer.find(b'\n')
+                if end < 0:
+                    break
+                line = bytes(rx_buffer[:end]).strip()
+                del rx_buffer[:end+1]
+                if not line:
+                    continue
+                response = self.handle_frame(line.decode('ascii', errors='replace'))
+                if response is not None:
+                    self._write((response + '\r\n').encode())
+
+    def _write(self, data):
+        self._throttle(len(data))
+        view = memoryview(data)
+        while view:
+            written = os.write(self._master, view)
+            view = view[written:]
+        self.bytes_sent += len(data)
+
+    def _throttle(self, num_bytes):
+        if self.baudrate:
+            time.sleep(num_bytes * 10 / self.baudrate)
+
+    # -- Protocol
+    def handle_frame(self, frame):
+        """
+        Process one request frame.
+
+        @param frame request line without line ending, ie. `>0302000201` + data
+        @return response line (without line ending)
+        """
+        if len(frame) < hub_config.GAUGE_COMM_HEADER_LEN or frame[0] != hub_config.GAUGE_COMM_START_CHAR:
+            return self._status(0, STATUS.GAUGE_STATUS_PROTOCOL_ERROR)
+
+        try:
+            cmd = int(frame[1:3], 16)
+            data_len = int(frame[5:9], 16)
+            data = bytes.fromhex(frame[9:])
+        except ValueError:
+            return self._status(0, STATUS.GAUGE_STATUS_MALFORMED_PACKAGE)
+
+        if len(data) != data_len:
+            return self._status(cmd, STATUS.GAUGE_STATUS_MALFORMED_PACKAGE)
+
+        self.commands_received[cmd] = self.commands_received.get(cmd, 0) + 1
+        delay = self.latencies.get(cmd, self.latency)
+        if delay:
+            time.sleep(delay)
+
+        handler = self._handlers.get(cmd, None)
+        if handler is None:
+            return self._status(cmd, STATUS.GAUGE_STATUS_UNSUPPORTED)
+
+        try:
+            return handler(cmd, data)
+        except (IndexError, KeyError):
+            return self._status(cmd, STATUS.GAUGE_STATUS_INVALID_ARGUMENT)
+
+    def _status(self, cmd, status):
+        return f"<{cmd:02X}{DATA_TYPES.COMM_DATA_STATUS_CODE:02X}0002{status:04X}"
+
+    def _data(self, cmd, data, data_type=DATA_TYPES.COMM_DATA_MULTIPLE_VALUE):
+        return f"<{cmd:02X}{data_type:02X}{len(data):04X}{data.hex().upper()}"
+
+    def _dial(self, index):
+        dial = self.dials.get(index, None)
+        if dial is None:
+            raise KeyError(index)
+        return dial
+
+    @staticmethod
+    def _uint32(data, offset=1):
+        return int.from_bytes(data[offset:offset+4], 'big')
+
+    def _cmd_ok(self, cmd, data):
+        return self._status(cmd, STATUS.GAUGE_STATUS_OK)
+
+    def _cmd_power(self, cmd, data):
+        self.powered = bool(data[0])
+        return self._status(cmd, STATUS.GAUGE_STATUS_OK)
+
+    def _cmd_devices_map(self, cmd, data):
+        return self._data(cmd, bytes(1 if index in self.dials else 0 for index in range(self.map_size)))
+
+    def _cmd_get_uid(self, cmd, data):
+        return self._data(cmd, self._dial(data[0]).uid)
+
+    def _cmd_set_raw(self, cmd, data):
+        self._dial(data[0]).raw = int.from_bytes(data[1:3], 'big')
+        return self._status(cmd, STATUS.GAUGE_STATUS_OK)
+
+    def _cmd_set_percent(self, cmd, data):
+        if len(data) % 2:
+            return self._status(cmd, STATUS.GAUGE_STATUS_BAD_DATA)
+        pairs = [(data[pos], data[pos+1]) for pos in range(0, len(data), 2)]
+        if any(index not in self.dials for index, _ in pairs):
+            return self._status(cmd, STATUS.GAUGE_STATUS_DEVICE_OFFLINE)
+        for index, value in pairs:
+            self.dials[index].value = min(value, 100)
+        return self._status(cmd, STATUS.GAUGE_STATUS_OK)
+
+    def _cmd_calibrate(self, cmd, data):
+        key = 'max' if cmd == COMMANDS.COMM_CMD_SET_DIAL_CALIBRATE_MAX else 'half'
+        self._dial(data[0]).calibration[key] = self._uint32(data)
+        return self._status(cmd, STATUS.GAUGE_STATUS_OK)
+
+    def _cmd_set_easing(self, cmd, data):
+        key = {COMMANDS.COMM_CMD_SET_DIAL_EASING_STEP: 'dial_step',
+               COMMANDS.COMM_CMD_SET_DIAL_EASING_PERIOD: 'dial_period',
+               COMMANDS.COMM_CMD_SET_BACKLIGHT_EASING_STEP: 'backlight_step',
+               COMMANDS.COMM_CMD_SET_BACKLIGHT_EASING_PERIOD: 'backlight_period'}[cmd]
+        self._dial(data[0]).easing[key] = self._uint32(data)
+        return self._status(cmd, STATUS.GAUGE_STATUS_OK)
+
+    def _cmd_get_easing(self, cmd, data):
+        easing = self._dial(data[0]).easing
+        values = (easing['dial_step'], easing['dial_period'], easing['backlight_step'], easing['backlight_period'])
+        return self._data(cmd, b''.join(value.to_bytes(4, 'big') for value in values))
+
+    def _cmd_get_info(self, cmd, data):
+        dial = self._dial(data[0])
+        info = {COMMANDS.COMM_CMD_GET_BUILD_INFO: dial.build_hash,
+                COMMANDS.COMM_CMD_GET_FW_INFO: dial.fw_version,
+                COMMANDS.COMM_CMD_GET_HW_INFO: dial.hw_version,
+                COMMANDS.COMM_CMD_GET_PROTOCOL_INFO: dial.protocol_version}[cmd]
+        return self._data(cmd, info.encode())
+
+    def _cmd_set_backlight(self, cmd, data):
+        self._dial(data[0]).rgbw = [min(value, 100) for value in data[1:5]]
+        return self._status(cmd, STATUS.GAUGE_STATUS_OK)
+
+    def _cmd_rx_buffer_size(self, cmd, data):
+        return self._data(cmd, self._dial(data[0]).rx_buffer_size.to_bytes(4, 'big'))
+
+    def _cmd_display_clear(self, cmd, data):
+        dial = self._dial(data[0])
+        # 0 = white background (all bits set), 1 = black
+        fill = 0x00 if data[1] else 0xFF
+        dial.framebuffer[:] = bytes((fill,)) * len(dial.framebuffer)
+        dial.cursor = 0
+        return self._status(cmd, STATUS.GAUGE_STATUS_OK)
+
+    def _cmd_display_goto_xy(self, cmd, data):
+        dial = self._dial(data[0])
+        x = int.from_bytes(data[1:3], 'big')
+        y = int.from_bytes(data[3:5], 'big')
+        if x >= dial.width or y >= dial.height:
+            return self._status(cmd, STATUS.GAUGE_STATUS_INVALID_ARGUMENT)
+        dial.cursor = x*dial.column_bytes + y//8
+        return self._status(cmd, STATUS.GAUGE_STATUS_OK)
+
+    def _cmd_display_img_data(self, cmd, data):
+        dial = self._dial(data[0])
+        chunk = data[1:]
+        if len(chunk) > dial.rx_buffer_size:
+            return self._status(cmd, STATUS.GAUGE_STATUS_NO_MEMORY)
+        if self.busy_ratio and self.random.random() < self.busy_ratio:
+            return self._status(cmd, STATUS.GAUGE_STATUS_BUSY)
+        if dial.cursor + len(chunk) > len(dial.framebuffer):
+            return self._status(cmd, STATUS.GAUGE_STATUS_BAD_DATA)
+        dial.framebuffer[dial.cursor:dial.cursor+len(chunk)] = chunk
+        dial.cursor += len(chunk)
+        return self._status(cmd, STATUS.GAUGE_STATUS_OK)
+
+    def _cmd_display_show(self, cmd, data):
+        dial = self._dial(data[0])
+        dial.displayed = bytes(dial.framebuffer)
+        dial.frames_shown += 1
+        return self._status(cmd, STATUS.GAUGE_STATUS_OK)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Karanovic Research - VU1 hub simulator')
+    parser.add_argument('-n', '--dials', type=int, default=4, help='Number of simulated dials (per hub). Default is 4')
+    parser.add_argument('--hubs', type=int, default=1, help='Number of simulated hubs. Default is 1')
+    parser.add_argument('--latency', type=float, default=2.0, help='Per command processing time in ms. Default is 2')
+    parser.add_argument('--baudrate', type=int, default=115200, help='Simulated link speed, 0 to disable throttling. Default is 115200')
+    parser.add_argument('--busy-ratio', type=float, default=0.0, help='Probability of GAUGE_STATUS_BUSY reply to image data')
+    parser.add_argument('-l', '--logging', type=str, default='info', help='Set logging level. Default is `info`')
+    args = parser.parse_args()
+
+    set_logger_level(args.logging)
+    simulators = [HubSimulator(num_dials=args.dials, latency=args.latency/1000, baudrate=args.baudrate or None,
+                               busy_ratio=args.busy_ratio, hub_id=hub_id) for hub_id in range(args.hubs)]
+    ports = [simulator.start() for simulator in simulators]
+    if len(ports) == 1:
+        print(f"Simulated hub is available on `{ports[0]}`. Set it as hardware `port` in config.yaml.")
+    else:
+        print(f"Simulated hubs are available on {ports}. Set them as hardware `port` list in config.yaml.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        for simulator in simulators:
+            simulator.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+import itertools
+import queue
+import threading
+from time import monotonic
+from concurrent.futures import Future
+from dials.base_logger import logger
+from metrics import HUB_TICK_DURATION, HUB_TICK_LAG, HUB_TICK_OVERRUNS, HUB_QUEUE_DEPTH
+
+# Lower number means higher priority
+PRIORITY_HIGH = 0       # API requests that are waiting for a response
+PRIORITY_NORMAL = 1     # Regular hub work (dial updates, images)
+PRIORITY_LOW = 2        # Background maintenance
+
+# HubWorker Class
+# ---
+# Dedicated thread that owns all serial I/O towards one VU1 hub.
+# Work is submitted through a priority queue and every submission returns a `concurrent.futures.Future`,
+# so callers running on the Tornado IOLoop never block on the serial port.
+# Optional periodic function (ie. `periodic_dial_update`) is executed on the same thread between queued commands.
+# ---
+class HubWorker:
+    def __init__(self, name='hub-worker'):
+        self.name = name
+        self.queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._thread = None
+        self._periodic_fn = None
+        self._period = None
+        HUB_QUEUE_DEPTH.labels(name).set_function(self.queue_depth)
+
+    def start(self, periodic_fn=None, period_ms=None):
+        if self.is_running():
+            logger.error(f"{self.name} is already running")
+            return
+
+        self._periodic_fn = periodic_fn
+        self._period = (period_ms / 1000) if period_ms else None
+
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        logger.info(f"{self.name} started")
+
+    def stop(self, timeout=5):
+        if not self.is_running():
+            return
+        # Stop request jumps in front of any pending work
+        self.queue.put((-1, next(self._sequence), None, None, None, None))
+        self._thread.join(timeout)
+        self._thread = None
+        logger.info(f"{self.name} stopped")
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def submit(self, fn, *args, priority=PRIORITY_NORMAL, **kwargs):
+        """
+        Queue `fn(*args, **kwargs)` for execution on the hub thread.
+
+        @param fn callable to execute
+        @param priority one of PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+        @return concurrent.futures.Future resolved with the return value of `fn`
+        """
+        future = Future()
+        self.queue.put((priority, next(self._sequence), fn, args, kwargs, future))
+        return future
+
+    def _run(self):
+        next_tick = monotonic() + self._period if self._period else None
+
+        while True:
+            timeout = None
+            if next_tick is not None:
+                timeout = max(0, next_tick - monotonic())
+
+            try:
+                _, _, fn, args, kwargs, future = self.queue.get(timeout=timeout)
+                if fn is None:
+                    break
+                self._execute(fn, args, kwargs, future)
+            except queue.Empty:
+                pass
+
+            if next_tick is not None and monotonic() >= next_tick:
+                self._run_periodic(next_tick)
+                next_tick = next_tick + self._period
+                # Don't try to catch up on missed ticks, just schedule the next one
+                if next_tick < monotonic():
+                    HUB_TICK_OVERRUNS.labels(self.name).inc()
+                    next_tick = monotonic() + self._period
+
+    def _execute(self, fn, args, kwargs, future):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            logger.exception(f"{self.name} command failed: {e}")
+            future.set_exception(e)
+
+    def _run_periodic(self, scheduled):
+        start = monotonic()
+        HUB_TICK_LAG.labels(self.name).observe(start - scheduled)
+        try:
+            self._periodic_fn()
+        except Exception as e:
+            logger.exception(f"{self.name} periodic update failed: {e}")
+        HUB_TICK_DURATION.labels(self.name).observe(monotonic() - start)
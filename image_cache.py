@@ -0,0 +1,107 @@
+import os
+import zlib
+from collections import OrderedDict
+from threading import Lock
+from dials.base_logger import logger
+
+
+def file_crc(filepath):
+    if not os.path.exists(filepath):
+        logger.error(f"File {filepath} does not exist!")
+        return "00000000"
+
+    with open(filepath, 'rb') as fh:
+        fileCrc = 0
+        while True:
+            s = fh.read(65536)
+            if not s:
+                break
+            fileCrc = zlib.crc32(s, fileCrc)
+    return "%08X" % (fileCrc & 0xFFFFFFFF)
+
+
+def data_crc(data):
+    return "%08X" % (zlib.crc32(data) & 0xFFFFFFFF)
+
+
+# PackedImageCache Class
+# ---
+# In-memory LRU cache of packed (1-bit, column major) dial framebuffers.
+# Entries are keyed by image file CRC and dial display resolution, so dials showing
+# the same face share one entry and rotating between a few faces does not re-decode the PNG every time.
+# Cache size is limited by the total size of the packed framebuffers (`max_bytes`).
+# ---
+class PackedImageCache:
+    def __init__(self, max_bytes=4*1024*1024):
+        self.max_bytes = max_bytes
+        self.lock = Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, crc, resolution):
+        """
+        @return (column_bytes, framebuffer) tuple or None if image is not cached
+        """
+        key = (crc, tuple(resolution))
+        with self.lock:
+            entry = self._entries.get(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, crc, resolution, column_bytes, framebuffer):
+        key = (crc, tuple(resolution))
+        framebuffer = bytes(framebuffer)
+
+        if len(framebuffer) > self.max_bytes:
+            logger.error(f"Packed image {crc} ({len(framebuffer)} bytes) is larger than the whole image cache. Not caching.")
+            return
+
+        with self.lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous[1])
+
+            self._entries[key] = (column_bytes, framebuffer)
+            self._size += len(framebuffer)
+
+            while self._size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+                self.evictions += 1
+
+    def get_or_pack(self, crc, resolution, pack_fn):
+        """
+        Return cached framebuffer or call `pack_fn()` (returning (column_bytes, framebuffer)) and cache the result.
+        """
+        entry = self.get(crc, resolution)
+        if entry is not None:
+            return entry
+
+        entry = pack_fn()
+        if entry is None:
+            return None
+        self.put(crc, resolution, *entry)
+        return entry
+
+    def clear(self):
+        with self.lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self._entries),
+                'size_bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,91 @@
+import os
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from PIL import Image, ImageOps
+from dials.base_logger import logger
+from dial_driver import pack_image
+
+# Refuse to decode anything larger than this (protects the server from decompression bombs)
+MAX_IMAGE_PIXELS = 4096*4096
+
+
+class ImageIngestError(Exception):
+    pass
+
+
+def _to_greyscale(img):
+    # 16/32-bit greyscale images (ie. 16-bit PNGs) would be clipped by PIL's convert("L")
+    if img.mode in ('I', 'I;16', 'I;16B', 'I;16L', 'I;16N'):
+        data = np.asarray(img, dtype=np.uint32) >> 8
+        return Image.fromarray(np.clip(data, 0, 255).astype(np.uint8), mode='L')
+
+    # Transparent pixels are shown as white background
+    if img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info):
+        img = img.convert('RGBA')
+        background = Image.new('RGBA', img.size, (255, 255, 255, 255))
+        img = Image.alpha_composite(background, img)
+
+    return img.convert('L')
+
+
+def prepare_image(data, width, height):
+    """
+    Decode, resize to dial resolution, dither and pack image data.
+    Runs in the ingest process pool, so it only uses picklable arguments and return values.
+
+    @param data raw image file contents
+    @return (column_bytes, framebuffer) tuple
+    @raise ImageIngestError if the image can not be used
+    """
+    try:
+        img = Image.open(BytesIO(data))
+        if img.width*img.height > MAX_IMAGE_PIXELS:
+            raise ImageIngestError(f"Image is too large ({img.width}x{img.height})")
+        img.load()
+    except ImageIngestError:
+        raise
+    except Exception as e:
+        raise ImageIngestError(f"Invalid image: {e}") from e
+
+    img = _to_greyscale(img)
+
+    if img.size != (width, height):
+        img = ImageOps.pad(img, (width, height), color=255)
+
+    # Floyd-Steinberg dithering to 1-bit
+    img = img.convert('1')
+
+    packed = pack_image(img)
+    return packed.shape[1], packed.tobytes()
+
+
+def prepare_image_file(filepath, width, height):
+    with open(filepath, 'rb') as fh:
+        return prepare_image(fh.read(), width, height)
+
+
+# ImageIngest Class
+# ---
+# Runs image decoding/packing (`prepare_image`) in a process pool,
+# so that neither the IOLoop nor the hub worker thread spend time in PIL.
+# ---
+class ImageIngest:
+    def __init__(self, workers=1):
+        self.workers = workers
+        self._executor = None
+
+    def _get_executor(self):
+        # Pool is created on first use, so servers that never receive an image don't spawn processes
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            logger.info(f"Image ingest pool started with {self.workers} worker(s) (pid:{os.getpid()})")
+        return self._executor
+
+    def submit(self, data, resolution):
+        return self._get_executor().submit(prepare_image, data, resolution[0], resolution[1])
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
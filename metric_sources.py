@@ -0,0 +1,331 @@
+import re
+import heapq
+import shlex
+import subprocess
+import threading
+from time import monotonic
+from dials.base_logger import logger
+
+
+class MetricSourceError(ValueError):
+    pass
+
+
+# MetricSource Class
+# ---
+# Base class for built-in metric sources.
+# Every source is sampled by the MetricScheduler every `interval` milliseconds and the sampled
+# (raw) value is written to all bound dials through `ServerDialHandler.dial_set_values`, so the
+# dial mapping profile converts it to percent.
+# ---
+class MetricSource:
+    name = None
+
+    def __init__(self, dials, interval=1000, **options):
+        if not dials:
+            raise MetricSourceError(f"Source `{self.name}` is not bound to any dial (missing `dials`)")
+        if isinstance(dials, str):
+            dials = [dials]
+
+        self.dials = [str(dial_uid) for dial_uid in dials]
+        self.interval = max(int(interval), 50) / 1000
+        self.options = options
+
+    def sample(self):
+        """
+        Read the current value of the metric.
+
+        @return float value or None if no value is available (yet)
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def describe(self):
+        return f"{self.name} -> {', '.join(self.dials)}"
+
+
+# FileMetricSource Class
+# ---
+# Base for sources that read a (proc/sys) text file. File handle is opened once and rewound on every sample.
+# ---
+class FileMetricSource(MetricSource):
+    path = None
+
+    def __init__(self, dials, interval=1000, **options):
+        super().__init__(dials, interval, **options)
+        self._file = None
+
+    def _read(self):
+        if self._file is None:
+            self._file = open(self.path, 'r', encoding='utf-8') # pylint: disable=consider-using-with
+        self._file.seek(0)
+        return self._file.read()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+# Counter based sources report per-second rates, first sample only primes the previous value
+class RateMetricSource(FileMetricSource):
+    def __init__(self, dials, interval=1000, **options):
+        super().__init__(dials, interval, **options)
+        self._previous = None
+
+    def _counter(self):
+        raise NotImplementedError
+
+    def sample(self):
+        now = monotonic()
+        counter = self._counter()
+        previous, self._previous = self._previous, (now, counter)
+        if previous is None or now <= previous[0]:
+            return None
+        return max(counter - previous[1], 0) / (now - previous[0])
+
+
+# CPU utilization in percent (`cpu` option selects the line, ie. `cpu` for total or `cpu3` for a single core)
+class CpuSource(FileMetricSource):
+    name = 'cpu'
+    path = '/proc/stat'
+
+    def __init__(self, dials, interval=1000, cpu='cpu', **options):
+        super().__init__(dials, interval, **options)
+        self.cpu = cpu + ' '
+        self._previous = None
+
+    def sample(self):
+        for line in self._read().splitlines():
+            if line.startswith(self.cpu):
+                fields = [int(x) for x in line.split()[1:]]
+                break
+        else:
+            raise MetricSourceError(f"`{self.cpu.strip()}` not found in {self.path}")
+
+        # idle + iowait
+        idle = fields[3] + (fields[4] if len(fields) > 4 else 0)
+        total = sum(fields[:8])
+        previous, self._previous = self._previous, (idle, total)
+        if previous is None or total <= previous[1]:
+            return None
+        return 100 * (1 - (idle - previous[0]) / (total - previous[1]))
+
+
+# Memory utilization in percent, or any /proc/meminfo `field` in kB
+class MemorySource(FileMetricSource):
+    name = 'memory'
+    path = '/proc/meminfo'
+
+    def __init__(self, dials, interval=1000, field=None, **options):
+        super().__init__(dials, interval, **options)
+        self.field = field
+
+    def sample(self):
+        meminfo = {}
+        for line in self._read().splitlines():
+            key, _, value = line.partition(':')
+            meminfo[key] = int(value.split()[0])
+
+        if self.field is not None:
+            return meminfo[self.field]
+
+        total = meminfo['MemTotal']
+        available = meminfo.get('MemAvailable', meminfo['MemFree'])
+        return 100 * (total - available) / total
+
+
+# Disk throughput in bytes/s for `device` (ie. `sda`), `direction` is `read`, `write` or `total`
+class DiskIOSource(RateMetricSource):
+    name = 'disk'
+    path = '/proc/diskstats'
+    sector_size = 512
+
+    def __init__(self, dials, interval=1000, device='sda', direction='total', **options):
+        super().__init__(dials, interval, **options)
+        if direction not in ('read', 'write', 'total'):
+            raise MetricSourceError("Disk `direction` must be one of read, write or total")
+        self.device = device
+        self.direction = direction
+
+    def _counter(self):
+        for line in self._read().splitlines():
+            fields = line.split()
+            if len(fields) > 9 and fields[2] == self.device:
+                read, write = int(fields[5]), int(fields[9])
+                break
+        else:
+            raise MetricSourceError(f"Disk `{self.device}` not found in {self.path}")
+
+        return self.sector_size * {'read': read, 'write': write, 'total': read + write}[self.direction]
+
+
+# Network throughput in bytes/s for `interface` (ie. `eth0`), `direction` is `rx`, `tx` or `total`
+class NetworkSource(RateMetricSource):
+    name = 'network'
+    path = '/proc/net/dev'
+
+    def __init__(self, dials, interval=1000, interface='eth0', direction='total', **options):
+        super().__init__(dials, interval, **options)
+        if direction not in ('rx', 'tx', 'total'):
+            raise MetricSourceError("Network `direction` must be one of rx, tx or total")
+        self.interface = interface
+        self.direction = direction
+
+    def _counter(self):
+        for line in self._read().splitlines():
+            name, _, counters = line.partition(':')
+            if name.strip() == self.interface:
+                fields = counters.split()
+                rx, tx = int(fields[0]), int(fields[8])
+                break
+        else:
+            raise MetricSourceError(f"Interface `{self.interface}` not found in {self.path}")
+
+        return {'rx': rx, 'tx': tx, 'total': rx + tx}[self.direction]
+
+
+# First number found in a text file (ie. `/sys/class/thermal/thermal_zone0/temp`), multiplied by `scale`
+class FileSource(FileMetricSource):
+    name = 'file'
+    number_re = re.compile(r'[-+]?\d*\.?\d+(?:[eE][-+]?\d+)?')
+
+    def __init__(self, dials, interval=1000, path=None, scale=1.0, **options):
+        super().__init__(dials, interval, **options)
+        if not path:
+            raise MetricSourceError("File source needs a `path`")
+        self.path = path
+        self.scale = float(scale)
+
+    def sample(self):
+        match = self.number_re.search(self._read())
+        if match is None:
+            return None
+        return float(match.group(0)) * self.scale
+
+
+# First number printed by a command (executed without shell), multiplied by `scale`
+class CommandSource(MetricSource):
+    name = 'command'
+
+    def __init__(self, dials, interval=1000, command=None, timeout=5, scale=1.0, **options):
+        super().__init__(dials, interval, **options)
+        if not command:
+            raise MetricSourceError("Command source needs a `command`")
+        self.command = shlex.split(command) if isinstance(command, str) else list(command)
+        self.timeout = float(timeout)
+        self.scale = float(scale)
+
+    def sample(self):
+        result = subprocess.run(self.command, capture_output=True, text=True, timeout=self.timeout, check=False)
+        if result.returncode != 0:
+            logger.error(f"Command source `{' '.join(self.command)}` exited with {result.returncode}")
+            return None
+        match = FileSource.number_re.search(result.stdout)
+        if match is None:
+            return None
+        return float(match.group(0)) * self.scale
+
+
+METRIC_SOURCES = {source.name: source for source in (CpuSource, MemorySource, DiskIOSource, NetworkSource, FileSource, CommandSource)}
+
+
+def create_source(source_config):
+    """
+    Create metric source from a `sources` config entry.
+
+    @param source_config dictionary with `type`, `dials`, optional `interval` (ms) and source specific options
+    @return MetricSource instance
+    """
+    if not isinstance(source_config, dict):
+        raise MetricSourceError(f"Invalid source config `{source_config}`")
+
+    options = dict(source_config)
+    source_type = options.pop('type', None)
+    if source_type not in METRIC_SOURCES:
+        raise MetricSourceError(f"Unknown source type `{source_type}`. Expecting one of {', '.join(METRIC_SOURCES)}")
+
+    try:
+        return METRIC_SOURCES[source_type](**options)
+    except TypeError as e:
+        raise MetricSourceError(f"Invalid `{source_type}` source config: {e}") from e
+
+
+# MetricScheduler Class
+# ---
+# Samples all configured metric sources on their own interval from a single background thread
+# and queues sampled values for the bound dials. Sources that are due at the same time are
+# written to the dial handler as one batch.
+# ---
+class MetricScheduler:
+    def __init__(self, dial_handler, sources_config=None):
+        self.dial_handler = dial_handler
+        self.sources = []
+        self._thread = None
+        self._stop = threading.Event()
+
+        for source_config in sources_config or []:
+            try:
+                source = create_source(source_config)
+            except MetricSourceError as e:
+                logger.error(f"Skipping metric source: {e}")
+                continue
+            logger.info(f"Metric source {source.describe()} every {int(source.interval*1000)}ms")
+            self.sources.append(source)
+
+    def start(self):
+        if not self.sources or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='metric-sources', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+        for source in self.sources:
+            source.close()
+
+    def _run(self):
+        now = monotonic()
+        schedule = [(now, index) for index in range(len(self.sources))]
+        heapq.heapify(schedule)
+
+        while not self._stop.is_set():
+            due, _ = schedule[0]
+            if self._stop.wait(max(0, due - monotonic())):
+                break
+
+            values = {}
+            now = monotonic()
+            while schedule and schedule[0][0] <= now:
+                due, index = heapq.heappop(schedule)
+                source = self.sources[index]
+                self._sample(source, values)
+                # Skip missed intervals instead of sampling in a burst. A late source is due a full
+                # interval from now, never again in this pass (rate sources would see dt ~ 0)
+                next_due = due + source.interval
+                if next_due <= now:
+                    next_due = now + source.interval
+                heapq.heappush(schedule, (next_due, index))
+
+            if values:
+                self.dial_handler.dial_set_values(values)
+
+    def _sample(self, source, values):
+        try:
+            value = source.sample()
+        except Exception as e:
+            logger.error(f"Metric source `{source.name}` failed: {e}")
+            source.close()
+            return
+
+        if value is None:
+            return
+        for dial_uid in source.dials:
+            values[dial_uid] = value
@@ -0,0 +1,204 @@
+from bisect import bisect_left
+
+# Metrics registry
+# ---
+# Minimal Prometheus compatible metrics (counter, gauge, histogram) used to instrument the hub hot paths.
+# Recording a sample is a dictionary lookup and an addition. Nothing is formatted or aggregated
+# until `/metrics` is scraped, so instrumentation is (almost) free when nobody is looking.
+# Updates are not locked. Metrics are written from the hub workers and the IOLoop thread. Hub command metrics
+# are shared by all hubs, so with several hubs a concurrent update can (rarely) be lost.
+# ---
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [(name, str(value)) for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        child = self._children.get(values, None)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"Metric `{self.name}` expects labels {self.labelnames}")
+            child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self._children.items()):
+            lines.extend(child.render(self.name, self.labelnames, values))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def render(self, name, labelnames, values):
+        return [f"{name}{_format_labels(labelnames, values)} {_format_value(self.value)}"]
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ('function',)
+
+    def __init__(self):
+        super().__init__()
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set_function(self, function):
+        # Value is computed on scrape
+        self.function = function
+
+    def render(self, name, labelnames, values):
+        value = self.function() if self.function is not None else self.value
+        return [f"{name}{_format_labels(labelnames, values)} {_format_value(value)}"]
+
+
+class _HistogramChild:
+    __slots__ = ('buckets', 'counts', 'sum')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def render(self, name, labelnames, values):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(labelnames, values, ('le', _format_value(bound)))} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labelnames, values)} {_format_value(self.sum)}")
+        lines.append(f"{name}_count{_format_labels(labelnames, values)} {cumulative}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._children[()].inc(amount)
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self._children[()].set(value)
+
+    def set_function(self, function):
+        self._children[()].set_function(function)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._children[()].observe(value)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric `{metric.name}` is already registered")
+        self.metrics[metric.name] = metric
+
+    def render(self):
+        """
+        @return all metrics in Prometheus text exposition format
+        """
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+# -- Serial link
+SERIAL_BYTES_WRITTEN = Counter('vu_serial_bytes_written_total', 'Bytes written to the hub serial port')
+SERIAL_BYTES_READ = Counter('vu_serial_bytes_read_total', 'Bytes read from the hub serial port')
+SERIAL_READ_TIMEOUTS = Counter('vu_serial_read_timeouts_total', 'Hub responses that did not arrive in time')
+SERIAL_WRITE_TIMEOUTS = Counter('vu_serial_write_timeouts_total', 'Serial writes that timed out')
+
+# -- Hub commands
+HUB_COMMAND_LATENCY = Histogram('vu_hub_command_duration_seconds', 'Hub command round trip time', ('command',))
+HUB_PIPELINE_LATENCY = Histogram('vu_hub_pipeline_duration_seconds', 'Duration of pipelined command batches')
+HUB_RETRIES = Counter('vu_hub_retries_total', 'Hub commands that had to be re-sent', ('reason',))
+HUB_IMAGE_TRANSFER = Histogram('vu_hub_image_transfer_seconds', 'Time to push an image to a dial display', ('mode',),
+                               buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0))
+
+# -- Hub worker
+HUB_TICK_DURATION = Histogram('vu_hub_tick_duration_seconds', 'Duration of the periodic dial update', ('worker',))
+HUB_TICK_LAG = Histogram('vu_hub_tick_lag_seconds', 'Delay between scheduled and actual start of the periodic dial update', ('worker',))
+HUB_TICK_OVERRUNS = Counter('vu_hub_tick_overruns_total', 'Periodic dial updates that were skipped because the worker fell behind', ('worker',))
+HUB_QUEUE_DEPTH = Gauge('vu_hub_queue_depth', 'Commands waiting in the hub worker queue', ('worker',))
+
+# -- HTTP API
+HTTP_REQUEST_LATENCY = Histogram('vu_http_request_duration_seconds', 'HTTP API request duration', ('handler', 'method', 'status'))
+
+# -- UDP listener (`received` counts every update, `coalesced` ones are also counted as `accepted`)
+UDP_UPDATES = Counter('vu_udp_updates_total', 'Dial updates handled by the UDP listener', ('result',))
+
+# -- WebSocket stream (`received` counts every update frame, `rejected` also counts messages that could not be parsed)
+STREAM_UPDATES = Counter('vu_stream_updates_total', 'Dial updates received over the WebSocket stream', ('result',))
@@ -1,11 +1,16 @@
+import os
 import re
 import time
+from collections import deque
+from concurrent.futures import Future
+import logging
 from threading import Lock
 import serial as _serial
 import serial.tools.list_ports as _lp
 import serial.tools.list_ports_common as _lpc
 from serial.tools.list_ports import comports
 from dials.base_logger import logger
+from metrics import SERIAL_BYTES_WRITTEN, SERIAL_BYTES_READ, SERIAL_READ_TIMEOUTS, SERIAL_WRITE_TIMEOUTS
 
 
 class SerialHardware(object):
@@ -76,6 +81,22 @@ class SerialHardware(object):
         self.port.reset_output_buffer()
         self.port.close()
 
+    def reopen(self, port_info):
+        """
+        Re-open the port after the USB device was re-enumerated (possibly under a different name)
+
+        @param port_info ListPortInfo of the re-enumerated device
+        """
+        with self.lock:
+            if self.port.is_open:
+                try:
+                    self.port.close()
+                except (_serial.SerialException, OSError) as e:
+                    logger.debug("Closing stale port failed: %s", e)
+            self.port_info = port_info
+            self.port.port = port_info.device
+            self.open()
+
     def is_open(self):
         return self.port.is_open
 
@@ -103,6 +124,11 @@ class SerialHardware(object):
             if port.device == port_info:
                 logger.debug("Using '{}' as GaugeHub COM port".format(port.device))
                 return port
+
+        # Ports that are not enumerated (ie. pseudo terminals of the hub simulator)
+        if os.path.exists(port_info):
+            logger.debug(f"Using non-enumerated port '{port_info}'")
+            return _lpc.ListPortInfo(port_info, skip_link_detection=True)
         return None
 
     def _read_until_re_match(self, status_re=None, timeout=2):
@@ -124,7 +150,7 @@ class SerialHardware(object):
             line = self.handle_serial_read()
             if line:
                 if self.debug_uart:
-                    logger.debug(f"_read_until_re_match:{line}")
+                    logger.debug("_read_until_re_match:%s", line)
                 rx_lines.append(line)
                 if compiled_re.match(line):
                     return True, rx_lines
@@ -155,35 +181,46 @@ class SerialHardware(object):
                 if line.startswith('<'):
                     break
             if time.time() > timeout_timestmap:
-                logger.error(f"Timeout occured ({time.time()} > {timeout_timestmap})")
+                logger.error("Timeout occured (%s > %s)", time.time(), timeout_timestmap)
+                SERIAL_READ_TIMEOUTS.inc()
                 break
 
         return rx_lines
 
-    def handle_serial_send(self, command):
+    def handle_serial_send(self, command, flush=None):
         """
         Basic implementations of serial write for the serial_transaction.
         Sends the passed string, depending on the object settings, adds
         a newline and/or flushes the in port before sending
 
-        @param command the command str
+        Bytes-like commands are treated as complete frames (prefix and suffix
+        already included) and are written as they are.
+
+        @param command the command str or pre-encoded bytes/bytearray/memoryview frame
+        @param flush override flush_on_write for this write (pipelined writes must not flush)
         @return True if the command sent successfully
         """
         self.assert_open()
-        command = self.serialPrefix + command + self.serialSuffix
+        if isinstance(command, str):
+            command = (self.serialPrefix + command + self.serialSuffix).encode()
 
-        if self.flush_on_write and self.port.in_waiting > 0:
+        if flush is None:
+            flush = self.flush_on_write
+
+        if flush and self.port.in_waiting > 0:
             logger.error("Warning: In bytes waiting. Discarded. Port: \"{}\" description \"{}\"".format(self.port_info.name, self.description()))
 
-        if self.flush_on_write:
+        if flush:
             self.port.reset_input_buffer()
 
         try:
-            if self.debug_uart:
-                logger.debug(f"Writting: '{command.encode()}'")
-            self.port.write(command.encode())
+            if self.debug_uart and logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Writting: '%s'", bytes(command))
+            self.port.write(command)
+            SERIAL_BYTES_WRITTEN.inc(len(command))
             return True
         except _serial.SerialTimeoutException:
+            SERIAL_WRITE_TIMEOUTS.inc()
             logger.error("Warning: writing timed out. port: \"{}\" description \"{}\"".format(self.port_info.name, self.description()))
             return False
 
@@ -195,6 +232,7 @@ class SerialHardware(object):
         """
         try:
             response = self.port.readline()
+            SERIAL_BYTES_READ.inc(len(response))
             try:
                 ret = response.decode("utf-8").strip()
             except Exception as e:
@@ -224,8 +262,8 @@ class SerialHardware(object):
             self.lock.acquire()
             self.assert_open()
 
-            if not isinstance(payload, str) and not isinstance(payload, bytes) and not isinstance(payload, bytearray):
-                raise TypeError("Serial_transaction expects str/bytes/bytearray")
+            if not isinstance(payload, (str, bytes, bytearray, memoryview)):
+                raise TypeError("Serial_transaction expects str/bytes/bytearray/memoryview")
 
             # Check if any messages were received
             while self.port.in_waiting:
@@ -242,3 +280,86 @@ class SerialHardware(object):
             return lines
         finally:
             self.lock.release()
+
+    def _payload_command(self, payload):
+        """
+        Return the two hex digit command field of a `>CCTTLLLL...` frame (upper case)
+        """
+        if isinstance(payload, str):
+            return payload[1:3].upper()
+        # Pre-encoded frames already contain the serial prefix
+        start = len(self.serialPrefix) + 1
+        return bytes(payload[start:start+2]).decode().upper()
+
+    def pipelined_transaction(self, payloads, window=4, timeout=5):
+        """
+        Pipelined version of serial_transaction.
+        Keeps up to `window` commands outstanding on the link instead of waiting for each response
+        before sending the next command. Every `<` response is matched to the oldest outstanding
+        request with the same command byte (hub answers in FIFO order). Outstanding requests that
+        were skipped over by a later response are considered lost and resolve with an empty list.
+
+        @param payloads list of str payloads (same format as for serial_transaction)
+        @param window maximum number of commands waiting for a response
+        @param timeout time to wait for the response of the oldest outstanding command
+        @return list of Futures (one per payload, in order) resolved with the received lines
+        """
+        futures = [Future() for _ in payloads]
+        pending = deque(zip(payloads, futures))
+        outstanding = deque()
+        rx_lines = []
+        window = max(1, int(window))
+
+        with self.lock:
+            self.assert_open()
+
+            # Drop anything that was left in the buffer before we start matching responses
+            if self.port.in_waiting:
+                self.port.reset_input_buffer()
+
+            while pending or outstanding:
+                while pending and len(outstanding) < window:
+                    payload, future = pending.popleft()
+                    future.set_running_or_notify_cancel()
+                    if not self.handle_serial_send(payload, flush=False):
+                        future.set_exception(_serial.SerialException("Failed to send {}".format(payload)))
+                        continue
+                    outstanding.append((self._payload_command(payload), future, time.time() + timeout))
+
+                if not outstanding:
+                    break
+
+                line = self.handle_serial_read()
+                if not line:
+                    expected, future, deadline = outstanding[0]
+                    if time.time() > deadline:
+                        logger.error("Timeout waiting for response to command %s", expected)
+                        SERIAL_READ_TIMEOUTS.inc()
+                        outstanding.popleft()
+                        future.set_result(rx_lines)
+                        rx_lines = []
+                    continue
+
+                if self.debug_uart:
+                    logger.debug(line)
+                rx_lines.append(line)
+
+                if not line.startswith('<'):
+                    continue
+
+                cmd = line[1:3].upper()
+                if not any(entry[0] == cmd for entry in outstanding):
+                    logger.error("Received response for command %s that was not requested. Discarding.", cmd)
+                    rx_lines = []
+                    continue
+
+                while outstanding:
+                    expected, future, _ = outstanding.popleft()
+                    if expected == cmd:
+                        future.set_result(rx_lines)
+                        rx_lines = []
+                        break
+                    logger.error("No response received for command %s", expected)
+                    future.set_result([])
+
+        return futures
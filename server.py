@@ -2,16 +2,29 @@ import sys
 import os
 import signal
 import argparse
-import zlib
 import time
 import re
+import asyncio
+import multiprocessing
+import json
+import logging
 from mimetypes import guess_type
-from dials.base_logger import logger, set_logger_level
+from dials.base_logger import logger, set_logger_level, enable_queue_logging, disable_queue_logging
 from tornado.web import Application, RequestHandler, Finish, StaticFileHandler
-from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.ioloop import IOLoop
+from tornado.log import access_log
 from dial_driver import DialSerialDriver
 from server_config import ServerConfig
 from server_dial_handler import ServerDialHandler
+from image_cache import file_crc, data_crc
+from image_ingest import ImageIngestError
+from dial_events import DialEventBroker, Dial_Events_Socket
+from dial_stream import Dial_Stream_Socket
+from udp_listener import DialUDPListener
+from dial_mapping import DialMapping
+from metric_sources import MetricScheduler
+from hotplug import HotplugScanner
+from metrics import REGISTRY, HTTP_REQUEST_LATENCY
 from vu_notifications import show_error_msg, show_info_msg, show_warning_msg
 from serial.serialutil import SerialException
 
@@ -31,6 +44,22 @@ def pid_lock(service_name, create=True):
         if os.path.exists(pid_file):
             os.remove(pid_file)
 
+# Same access log as tornado's default, plus request latency metric
+def log_request(handler):
+    status = handler.get_status()
+    request_time = handler.request.request_time()
+    HTTP_REQUEST_LATENCY.labels(type(handler).__name__, handler.request.method, status).observe(request_time)
+
+    if status < 400:
+        log_level = logging.INFO
+    elif status < 500:
+        log_level = logging.WARNING
+    else:
+        log_level = logging.ERROR
+    # Access log is usually silent, don't format the line for nothing
+    if access_log.isEnabledFor(log_level):
+        access_log.log(log_level, f"{status} {handler._request_summary()} {1000.0 * request_time:.2f}ms") # pylint: disable=protected-access
+
 class BaseHandler(RequestHandler):
     def initialize(self, handler, config):
         self.handler = handler # pylint: disable=attribute-defined-outside-init
@@ -56,6 +85,10 @@ class BaseHandler(RequestHandler):
         self.write(resp)
         self.finish()
 
+    # Execute hub (serial) work on the hub worker thread without blocking the IOLoop
+    async def run_on_hub(self, fn, *args, **kwargs):
+        return await asyncio.wrap_future(self.handler.enqueue(fn, *args, **kwargs))
+
     def api_key_has_access_to_dial(self, gaugeUID, api_key=None):
         if api_key is None:
             api_key = self.get_argument('key', None)
@@ -83,18 +116,7 @@ class BaseHandler(RequestHandler):
         return True
 
     def get_file_crc(self, filepath):
-        if not os.path.exists(filepath):
-            logger.error(f"File {filepath} does not exist!")
-            return "00000000"
-
-        with open(filepath, 'rb') as fh:
-            fileCrc = 0
-            while True:
-                s = fh.read(65536)
-                if not s:
-                    break
-                fileCrc = zlib.crc32(s, fileCrc)
-        return "%08X" % (fileCrc & 0xFFFFFFFF)
+        return file_crc(filepath)
 
 
 class Device_Status_Handler(BaseHandler):
@@ -114,12 +136,40 @@ class Device_Set_Handler(BaseHandler):
         if not self.is_valid_api_key():
             return self.send_response(status='fail', message='Unauthorized', status_code=401)
 
-        if self.handler.dial_set_percent(dial_uid=dial_uid, value=value):
+        if self.handler.dial_set_value(dial_uid=dial_uid, value=value):
             return self.send_response(status='ok', message='Update queued')
         return self.send_response(status='fail', message='Invalid dial_uid or device is offline.')
 
+class Dials_Set_Bulk_Handler(BaseHandler):
+    def post(self):
+        logger.debug("Request:SET_BULK")
+
+        # Validate API key
+        api_key = self.get_argument('key', None)
+        if not self.config.is_valid_api_key(api_key):
+            return self.send_response(status='fail', message='Unauthorized', status_code=401)
+
+        try:
+            updates = json.loads(self.request.body)
+        except ValueError:
+            return self.send_response(status='fail', message='Invalid JSON body.', status_code=400)
+
+        if not isinstance(updates, dict) or not updates:
+            return self.send_response(status='fail', message='Expecting JSON object of {dial_uid: {value, backlight}}.', status_code=400)
+
+        allowed = {}
+        results = {}
+        for dial_uid, update in updates.items():
+            if self.config.api_key_has_access_to_dial(api_key, dial_uid):
+                allowed[dial_uid] = update
+            else:
+                results[dial_uid] = {'status': 'fail', 'message': 'Unauthorized'}
+
+        results.update(self.handler.dial_set_many(allowed))
+        return self.send_response(status='ok', data=results)
+
 class Device_SetRaw_Handler(BaseHandler):
-    def get(self, dial_uid):
+    async def get(self, dial_uid):
         value = self.get_argument('value', 0)
         logger.debug(f"Request:SET_RAW - Device:{dial_uid} To:{value}")
 
@@ -127,7 +177,7 @@ class Device_SetRaw_Handler(BaseHandler):
         if not self.is_valid_api_key():
             return self.send_response(status='fail', message='Unauthorized', status_code=401)
 
-        if self.handler.dial_set_raw(dial_uid=dial_uid, value=value):
+        if await self.run_on_hub(self.handler.dial_set_raw, dial_uid=dial_uid, value=value):
             return self.send_response(status='ok', message='Dial RAW value updated', status_code=201)
         return self.send_response(status='fail', message='Invalid dial_uid or device is offline.', status_code=503)
 
@@ -149,7 +199,7 @@ class Device_Backlight_Handler(BaseHandler):
         return self.send_response(status='fail', message='Invalid dial_uid or device is offline.', status_code=503)
 
 class Device_Set_Image(BaseHandler):
-    def post(self, dial_uid):
+    async def post(self, dial_uid):
         get_force = self.get_argument('force', False)
 
         force_img_update = bool(get_force is True)
@@ -160,51 +210,64 @@ class Device_Set_Image(BaseHandler):
         if not self.is_valid_api_key():
             return self.send_response(status='fail', message='Unauthorized', status_code=401)
 
-        # Store new image
-        img_file = self.handle_image_upload(dial_uid)
-        if not img_file:
-            logger.error("Handle image upload failed")
+        if self.handler.get_dial_info(dial_uid=dial_uid) is None:
+            return self.send_response(status='fail', message='Invalid dial_uid or device is offline.', status_code=503)
+
+        image_data = self.request.files.get('imgfile', None)
+        if image_data is None:
+            logger.error("imgfile field missing from request.")
             return self.send_response(status='fail', message='image upload failed', status_code=503)
+        image_body = image_data[0]['body']
 
         current_img = os.path.join(self.upload_path, f'img_{dial_uid}')
-        new_img = os.path.join(self.upload_path, f'tmp_{dial_uid}')
+        new_crc = data_crc(image_body)
 
         # If this is a different image from existing one
-        if self.different_image_uploaded(current_img, new_img) or force_img_update:
-
-            # Remove existing image (if exists)
-            if os.path.exists(current_img):
-                os.remove(current_img)
-            # Move (rename) new image and set as current
-            os.rename(new_img, current_img)
+        if not self.different_image_uploaded(dial_uid, current_img, new_crc) and not force_img_update:
+            logger.debug(f"Skipping dial `{dial_uid}` image update. Contents already match.")
+            return self.send_response(status='ok', message='Image CRC already maches existing one. Skipping update.')
 
+        # Decode, resize and pack the image before accepting it, so the hub worker only gets ready-to-send data
+        try:
+            packed = await asyncio.wrap_future(self.handler.ingest_image(image_body))
+        except ImageIngestError as e:
+            logger.error(f"Rejected image for dial `{dial_uid}`: {e}")
+            return self.send_response(status='fail', message=str(e), status_code=400)
 
-            if self.handler.dial_set_image(dial_uid=dial_uid, image_file=current_img):
-                return self.send_response(status='ok', status_code=201)
-            return self.send_response(status='fail', message='Invalid dial_uid or device is offline.', status_code=503)
+        # Store new image
+        if not self.handle_image_upload(dial_uid, image_body):
+            logger.error("Handle image upload failed")
+            return self.send_response(status='fail', message='image upload failed', status_code=503)
 
-        logger.debug(f"Skipping dial `{dial_uid}` image update. Contents already match.")
-        return self.send_response(status='ok', message='Image CRC already maches existing one. Skipping update.')
+        self.handler.store_packed_image(new_crc, packed)
+        if self.handler.dial_set_image(dial_uid=dial_uid, image_file=current_img, crc=new_crc):
+            return self.send_response(status='ok', status_code=201)
+        return self.send_response(status='fail', message='Invalid dial_uid or device is offline.', status_code=503)
 
-    def handle_image_upload(self, dial_uid):
+    def handle_image_upload(self, dial_uid, image_body):
         self.make_upload_folder()
-        image_data = self.request.files.get('imgfile', None)
-        if image_data is None:
-            logger.error("imgfile field missing from request.")
-            return None
-
-        # First upload image as temporary
-        file_path = os.path.join(self.upload_path, f'tmp_{dial_uid}')
 
-        with open(file_path, 'wb') as img:
-            img.write(image_data[0]['body'])
+        # Write to temporary file first, then replace current image
+        tmp_path = os.path.join(self.upload_path, f'tmp_{dial_uid}')
+        file_path = os.path.join(self.upload_path, f'img_{dial_uid}')
+        try:
+            with open(tmp_path, 'wb') as img:
+                img.write(image_body)
+            os.replace(tmp_path, file_path)
+        except OSError as e:
+            logger.error(e)
+            return None
 
         return file_path
 
-    def different_image_uploaded(self, old, new):
-        if self.get_file_crc(old) != self.get_file_crc(new):
-            return True
-        return False
+    def different_image_uploaded(self, dial_uid, old, new_crc):
+        # Use CRC of the image dial is already using, instead of re-reading the file
+        dial = self.handler.get_dial_info(dial_uid=dial_uid)
+        if dial is not None and dial.get('image_file', None) == old:
+            old_crc = dial['image_crc']
+        else:
+            old_crc = self.get_file_crc(old)
+        return old_crc != new_crc
 
     def make_upload_folder(self):
         if not os.path.exists(self.upload_path):
@@ -237,8 +300,12 @@ class Dial_Get_Image_CRC(BaseHandler):
     def get(self, gaugeUID):
         logger.debug("Request: GET_IMAGE_CRC")
 
-        img_file = os.path.join(os.path.dirname(__file__), 'upload', f'img_{gaugeUID}')
+        # Dials without an uploaded image show img_blank, but still report "00000000"
+        dial = self.handler.get_dial_info(dial_uid=gaugeUID)
+        if dial is not None and os.path.basename(dial.get('image_file', '')) == f'img_{gaugeUID}':
+            return self.send_response(status='ok', data=dial['image_crc'])
 
+        img_file = os.path.join(os.path.dirname(__file__), 'upload', f'img_{gaugeUID}')
         crc = self.get_file_crc(img_file)
         return self.send_response(status='ok', data=crc)
 
@@ -258,13 +325,13 @@ class Dial_Get_List(BaseHandler):
 
         # Reshape dials data to respond with only relevant information
         dialData = []
-        for uid in dials:
+        for uid, dial in list(dials.items()):
             tmp_dial =  {
                             'uid' : uid,
-                            'dial_name': dials[uid]['dial_name'],
-                            'value': dials[uid]['value'],
-                            'backlight': dials[uid]['backlight'],
-                            'image_file' : dials[uid]['image_file']
+                            'dial_name': dial['dial_name'],
+                            'value': dial['value'],
+                            'backlight': dict(dial['backlight']),
+                            'image_file' : dial['image_file']
                         }
             # Remove unused keys
             tmp_dial['backlight'].pop('white', None)
@@ -277,7 +344,7 @@ class Dial_Get_List(BaseHandler):
 
 
 class Dial_Provision(BaseHandler):
-    def get(self):
+    async def get(self):
 
         logger.debug("Request: PROVISION_NEW_DIALS")
 
@@ -285,7 +352,9 @@ class Dial_Provision(BaseHandler):
         if not self.valid_admin_key():
             return False
 
-        dials = self.handler.provision_dials()
+        # Every hub provisions its own bus, on its own worker
+        results = await asyncio.gather(*(asyncio.wrap_future(future) for future in self.handler.enqueue_all(self.handler.provision_dials)))
+        dials = [dial_uid for hub_dials in results for dial_uid in hub_dials]
         logger.debug(dials)
 
         return self.send_response(status='ok', data=dials)
@@ -320,7 +389,7 @@ class Dial_Set_Dial_Name(BaseHandler):
         return self.send_response(status='fail', message='Device not present!', status_code=406)
 
 class Dial_Reload_Device_Info(BaseHandler):
-    def get(self, gaugeUID):
+    async def get(self, gaugeUID):
 
         logger.debug(f"Request:GET_INFO - Device:{gaugeUID}")
 
@@ -328,11 +397,11 @@ class Dial_Reload_Device_Info(BaseHandler):
         if not self.is_valid_api_key():
             return self.send_response(status='fail', message='Unauthorized', status_code=401)
 
-        dial_info = self.handler.dial_reload_info_from_hardware(gaugeUID)
+        dial_info = await self.run_on_hub(self.handler.dial_reload_info_from_hardware, dial_uid=gaugeUID)
         return self.send_response(status='ok', data=dial_info)
 
 class Dial_Set_Calibration(BaseHandler):
-    def get(self, gaugeUID):
+    async def get(self, gaugeUID):
         dac_calibration = self.get_argument('value', None)
         logger.debug(f"Request:SET_CALIBRATION - Device:{gaugeUID} To: value={dac_calibration}")
 
@@ -341,12 +410,12 @@ class Dial_Set_Calibration(BaseHandler):
             return self.send_response(status='fail', message='Unauthorized', status_code=401)
 
         if dac_calibration is not None:
-            self.handler.dial_set_calibration(dial_uid=gaugeUID, value=dac_calibration, fullScale=False)
+            await self.run_on_hub(self.handler.dial_set_calibration, dial_uid=gaugeUID, value=dac_calibration, fullScale=False)
             return self.send_response(status='ok', message="Calibration value updated", status_code=201)
         return self.send_response(status='fail', message="Device not present", status_code=406)
 
 class Dial_Set_Easing_Dial(BaseHandler):
-    def get(self, gaugeUID):
+    async def get(self, gaugeUID):
         step = self.get_argument('step', None)
         period = self.get_argument('period', None)
         logger.debug(f"Request:SET_EASING_DIAL - Device:{gaugeUID} Step:{step} Period:{period}")
@@ -358,15 +427,15 @@ class Dial_Set_Easing_Dial(BaseHandler):
         if step is None and period is None:
             return self.send_response(status='fail', message="Please provide at least one of required parameters (`step` or `period`)", status_code=400)
 
-        if self.handler.dial_set_easing_dial(dial_uid=gaugeUID, step=step, period=period):
-            values_dict = { 'easing_dial_step': int(step), 'easing_dial_period': int(period) }
+        if await self.run_on_hub(self.handler.dial_set_easing_dial, dial_uid=gaugeUID, step=step, period=period):
+            values_dict = { f'easing_dial_{key}': int(val) for key, val in (('step', step), ('period', period)) if val is not None }
             self.config.update_dial_db_cell_with_dict(gaugeUID, values_dict)
             self.handler.dial_reload_info_from_database(gaugeUID)
             return self.send_response(status='ok')
         return self.send_response(status='fail', message="Device not present", status_code=406)
 
 class Dial_Set_Easing_Backlight(BaseHandler):
-    def get(self, gaugeUID):
+    async def get(self, gaugeUID):
         step = self.get_argument('step', None)
         period = self.get_argument('period', None)
         logger.debug(f"Request:SET_EASING_BACKLIGHT - Device:{gaugeUID} Step:{step} Period:{period}")
@@ -378,23 +447,98 @@ class Dial_Set_Easing_Backlight(BaseHandler):
         if step is None and period is None:
             return self.send_response(status='fail', message="Please provide at least one of required parameters (`step` or `period`)", status_code=400)
 
-        if self.handler.dial_set_easing_backlight(dial_uid=gaugeUID, step=step, period=period):
-            values_dict = { 'easing_backlight_step': step, 'easing_backlight_period': period }
+        if await self.run_on_hub(self.handler.dial_set_easing_backlight, dial_uid=gaugeUID, step=step, period=period):
+            values_dict = { f'easing_backlight_{key}': int(val) for key, val in (('step', step), ('period', period)) if val is not None }
             self.config.update_dial_db_cell_with_dict(gaugeUID, values_dict)
             self.handler.dial_reload_info_from_database(gaugeUID)
             return self.send_response(status='ok')
         return self.send_response(status='fail', message="Device not present", status_code=406)
 
-class Dial_Get_Easing_Config(BaseHandler):
+class Dial_Set_Filter(BaseHandler):
+    def get(self, gaugeUID):
+        ema_alpha = self.get_argument('ema', None)
+        max_rate = self.get_argument('max_rate', None)
+        deadband = self.get_argument('deadband', None)
+        logger.debug(f"Request:SET_FILTER - Device:{gaugeUID} EMA:{ema_alpha} MaxRate:{max_rate} Deadband:{deadband}")
+
+        # Validate API key
+        if not self.is_valid_api_key():
+            return self.send_response(status='fail', message='Unauthorized', status_code=401)
+
+        if ema_alpha is None and max_rate is None and deadband is None:
+            return self.send_response(status='fail', message="Please provide at least one of parameters (`ema`, `max_rate` or `deadband`)", status_code=400)
+
+        try:
+            dial_filter = self.handler.dial_set_filter(gaugeUID, ema_alpha=ema_alpha, max_rate=max_rate, deadband=deadband)
+        except ValueError:
+            return self.send_response(status='fail', message="Filter parameters must be numbers", status_code=400)
+
+        if dial_filter:
+            values_dict = { 'filter_ema_alpha': dial_filter['ema_alpha'],
+                            'filter_max_rate': dial_filter['max_rate'],
+                            'filter_deadband': dial_filter['deadband'] }
+            self.config.update_dial_db_cell_with_dict(gaugeUID, values_dict)
+            return self.send_response(status='ok', data=dial_filter)
+        return self.send_response(status='fail', message="Device not present", status_code=406)
+
+class Dial_Set_Mapping(BaseHandler):
     def get(self, gaugeUID):
+        mapping_type = self.get_argument('type', 'linear')
+        logger.debug(f"Request:SET_MAPPING - Device:{gaugeUID} Type:{mapping_type}")
+
+        # Validate API key
+        if not self.is_valid_api_key():
+            return self.send_response(status='fail', message='Unauthorized', status_code=401)
+
+        try:
+            mapping = DialMapping(kind=mapping_type,
+                                  in_min=self.get_argument('min', 0),
+                                  in_max=self.get_argument('max', 100),
+                                  out_min=self.get_argument('out_min', 0),
+                                  out_max=self.get_argument('out_max', 100),
+                                  unit=self.get_argument('unit', ''),
+                                  points=self.get_argument('points', None))
+        except ValueError as e:
+            return self.send_response(status='fail', message=str(e), status_code=400)
+
+        dial_mapping = self.handler.dial_set_mapping(gaugeUID, mapping)
+        if dial_mapping:
+            self.config.update_dial_db_cell_with_dict(gaugeUID, mapping.to_db())
+            return self.send_response(status='ok', data=dial_mapping)
+        return self.send_response(status='fail', message="Device not present", status_code=406)
+
+class Dial_Get_Easing_Config(BaseHandler):
+    async def get(self, gaugeUID):
         logger.debug(f"Request:GET_EASING_CONFIG - Device:{gaugeUID}")
 
         # Validate API key
         if not self.is_valid_api_key():
             return self.send_response(status='fail', message='Unauthorized', status_code=401)
 
-        # TODO: Implement in dial handler
-        return self.send_response(status='ok', message="not supported yet")
+        easing = await self.run_on_hub(self.handler.dial_get_easing_config, dial_uid=gaugeUID)
+        if easing:
+            return self.send_response(status='ok', data=easing)
+        return self.send_response(status='fail', message="Device not present", status_code=406)
+
+class Admin_Image_Cache_Stats(BaseHandler):
+    def get(self):
+        logger.debug("Request:Admin_Image_Cache_Stats")
+
+        # Validate master key
+        if not self.valid_admin_key():
+            return False # Above function already sends response
+
+        return self.send_response(status='ok', data=self.handler.image_cache_stats())
+
+class Admin_Metrics(BaseHandler):
+    def get(self):
+        # Prometheus scrape target, pass master key with `params: { admin_key: [...] }` in the scrape config
+        if not self.valid_admin_key():
+            return False # Above function already sends response
+
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.write(REGISTRY.render())
+        return self.finish()
 
 # -- Keys --
 class Admin_Keys_List(BaseHandler):
@@ -519,6 +663,41 @@ class FileHandler(RequestHandler):
             self.write(source_file.read())
 
 
+# API routes, shared by the service and the benchmark suite
+def api_routes(dial_handler, config, event_broker):
+    handlers_config = { "handler":dial_handler, "config":config }
+    events_config = { "handler":dial_handler, "config":config, "broker":event_broker }
+    return [
+        (r"/api/v0/dial/provision", Dial_Provision, handlers_config),
+        (r"/api/v0/dials/set", Dials_Set_Bulk_Handler, handlers_config),
+        (r"/api/v0/dial/events", Dial_Events_Socket, events_config),
+        (r"/api/v0/dials/stream", Dial_Stream_Socket, handlers_config),
+        (r"/api/v0/dial/list", Dial_Get_List, handlers_config),
+        (r"/api/v0/dial/([0-9A-F]*?)/status", Device_Status_Handler, handlers_config),
+        (r"/api/v0/dial/([0-9A-F]*?)/set", Device_Set_Handler, handlers_config),
+        (r"/api/v0/dial/([0-9A-F]*?)/setRaw", Device_SetRaw_Handler, handlers_config),
+        (r"/api/v0/dial/([0-9A-F]*?)/image/set", Device_Set_Image, handlers_config),
+        (r"/api/v0/dial/([0-9A-F]*?)/image/get", Dial_Get_Image, handlers_config),
+        (r"/api/v0/dial/([0-9A-F]*?)/image/crc", Dial_Get_Image_CRC, handlers_config),
+        (r"/api/v0/dial/([0-9A-F]*?)/backlight", Device_Backlight_Handler, handlers_config),
+        (r"/api/v0/dial/([0-9A-F]*?)/name", Dial_Set_Dial_Name, handlers_config),
+        (r"/api/v0/dial/([0-9A-F]*?)/reload", Dial_Reload_Device_Info, handlers_config),
+        (r"/api/v0/dial/([0-9A-F]*?)/calibrate", Dial_Set_Calibration, handlers_config),
+        (r"/api/v0/dial/([0-9A-F]*?)/easing/dial", Dial_Set_Easing_Dial, handlers_config),
+        (r"/api/v0/dial/([0-9A-F]*?)/easing/backlight", Dial_Set_Easing_Backlight, handlers_config),
+        (r"/api/v0/dial/([0-9A-F]*?)/easing/get", Dial_Get_Easing_Config, handlers_config),
+        (r"/api/v0/dial/([0-9A-F]*?)/filter", Dial_Set_Filter, handlers_config),
+        (r"/api/v0/dial/([0-9A-F]*?)/mapping", Dial_Set_Mapping, handlers_config),
+        (r"/api/v0/admin/keys/list", Admin_Keys_List, handlers_config),
+        (r"/api/v0/admin/keys/create", Admin_Keys_Create, handlers_config),
+        (r"/api/v0/admin/keys/remove", Admin_Keys_Remove, handlers_config),
+        (r"/api/v0/admin/keys/update", Admin_Keys_Update, handlers_config),
+        (r"/api/v0/admin/image_cache/stats", Admin_Image_Cache_Stats, handlers_config),
+        (r"/metrics", Admin_Metrics, handlers_config),
+        (r"/", FileHandler),
+        (r'/(.*)', StaticFileHandler, {'path': WEB_ROOT}),
+    ]
+
 class Dial_API_Service(Application):
     def __init__(self):
         pid_lock('server', True)
@@ -528,14 +707,14 @@ class Dial_API_Service(Application):
         logger.info("Loading server config...")
         self.config = ServerConfig('config.yaml')
 
-        # If config contains COM port, use it. Otherwise try to find it
+        # If config contains COM port(s), use them. Otherwise use every hub we can find
         hardware_config = self.config.get_hardware_config()
         port = hardware_config.get('port', None)
         if port:
-            self.serialPort = port
+            self.serialPorts = port if isinstance(port, list) else [port]
         else:
-            self.serialPort = DialSerialDriver.find_gauge_hub()
-            if self.serialPort is None:
+            self.serialPorts = DialSerialDriver.find_gauge_hubs()
+            if not self.serialPorts:
                 logger.error("Could not find VU1 Dials Hub. Please make sure it's plugged in and (if necessary) drivers are installed.")
                 show_error_msg("Hub not found", "Could not find VU1 Hub on the USB bus.\r\n"\
                                "Please make sure it is plugged in and (if necessary) drivers are installed.\r\n"\
@@ -543,62 +722,55 @@ class Dial_API_Service(Application):
                 sys.exit(0)
                 # raise Exception("Could not find VU1 Dials Hub. Please make sure it's plugged in and (if necessary) drivers are installed.")
 
-        logger.info("VU1 HUB port: {}".format(self.serialPort))
-        self.dial_driver = DialSerialDriver(self.serialPort)
-        self.dial_handler = ServerDialHandler(self.dial_driver, self.config)
+        self.dial_drivers = []
+        for serialPort in self.serialPorts:
+            logger.info("VU1 HUB port: {}".format(serialPort))
+            self.dial_drivers.append(DialSerialDriver(serialPort))
+        self.dial_handler = ServerDialHandler(self.dial_drivers, self.config)
 
         # If we don't see any dials, try looking/provisioning some
-        if len(self.dial_handler.dials) <= 1:
-            logger.info("No additional dials found. Searching the bus for new ones...")
-            self.dial_handler.provision_dials(num_attempts=3)
-
-        handlers_config = { "handler":self.dial_handler, "config":self.config }
-        self.handlers = [
-            (r"/api/v0/dial/provision", Dial_Provision, handlers_config),
-            (r"/api/v0/dial/list", Dial_Get_List, handlers_config),
-            (r"/api/v0/dial/([0-9A-F]*?)/status", Device_Status_Handler, handlers_config),
-            (r"/api/v0/dial/([0-9A-F]*?)/set", Device_Set_Handler, handlers_config),
-            (r"/api/v0/dial/([0-9A-F]*?)/setRaw", Device_SetRaw_Handler, handlers_config),
-            (r"/api/v0/dial/([0-9A-F]*?)/image/set", Device_Set_Image, handlers_config),
-            (r"/api/v0/dial/([0-9A-F]*?)/image/get", Dial_Get_Image, handlers_config),
-            (r"/api/v0/dial/([0-9A-F]*?)/image/crc", Dial_Get_Image_CRC, handlers_config),
-            (r"/api/v0/dial/([0-9A-F]*?)/backlight", Device_Backlight_Handler, handlers_config),
-            (r"/api/v0/dial/([0-9A-F]*?)/name", Dial_Set_Dial_Name, handlers_config),
-            (r"/api/v0/dial/([0-9A-F]*?)/reload", Dial_Reload_Device_Info, handlers_config),
-            (r"/api/v0/dial/([0-9A-F]*?)/calibrate", Dial_Set_Calibration, handlers_config),
-            (r"/api/v0/dial/([0-9A-F]*?)/easing/dial", Dial_Set_Easing_Dial, handlers_config),
-            (r"/api/v0/dial/([0-9A-F]*?)/easing/backlight", Dial_Set_Easing_Backlight, handlers_config),
-            (r"/api/v0/dial/([0-9A-F]*?)/easing/get", Dial_Get_Easing_Config, handlers_config),
-            (r"/api/v0/admin/keys/list", Admin_Keys_List, handlers_config),
-            (r"/api/v0/admin/keys/create", Admin_Keys_Create, handlers_config),
-            (r"/api/v0/admin/keys/remove", Admin_Keys_Remove, handlers_config),
-            (r"/api/v0/admin/keys/update", Admin_Keys_Update, handlers_config),
-            (r"/", FileHandler),
-            (r'/(.*)', StaticFileHandler, {'path': WEB_ROOT}),
-        ]
+        for hub, hub_dials in enumerate(self.dial_handler.hub_dials):
+            if len(hub_dials) <= 1:
+                logger.info(f"No additional dials found on hub {hub}. Searching the bus for new ones...")
+                self.dial_handler.provision_dials(num_attempts=3, hub=hub)
+
+        self.event_broker = DialEventBroker(self.dial_handler)
+        self.metric_scheduler = MetricScheduler(self.dial_handler, self.config.get_sources_config())
+        self.udp_listener = None
+        self.hotplug_scanner = HotplugScanner(self.dial_handler, self.config.get_server_config().get('hotplug_interval', 5))
+
+        self.handlers = api_routes(self.dial_handler, self.config, self.event_broker)
 
         self.server_settings = {
             "debug": True,
             "autoreload": False,
             # "autoreload": True,
             "default_handler_class": Default_404_Handler,
+            "log_function": log_request,
         }
 
     def signal_handler(self, signal, frame):
         pid_lock('server', False)
+        self.hotplug_scanner.stop()
+        if self.udp_listener is not None:
+            self.udp_listener.stop()
+        self.metric_scheduler.stop()
+        self.dial_handler.stop()
         self.shut_down_dials()
         IOLoop.current().add_callback_from_signal(self.shutdown_server)
         print('\r\nYou pressed Ctrl+C!')
         show_info_msg("CTRL+C", "CTRL+C pressed.\r\nVU Server app will exit now.")  # Remove if becomes annoying
+        disable_queue_logging()
         sys.exit(0)
 
     def shut_down_dials(self):
         print("Shutting down dials...")
         try:
-            for dial in self.dial_driver.dials:
-                logger.debug(f"Shutting down dial {dial}")
-                self.dial_driver.set_dial(dialID=dial, value=0)
-                self.dial_driver.dial_set_backlight(device=dial, red=0, green=0, blue=0, white=0)
+            for dial_driver in self.dial_drivers:
+                for dial in dial_driver.dials:
+                    logger.debug(f"Shutting down dial {dial}")
+                    dial_driver.set_dial(dialID=dial, value=0)
+                    dial_driver.dial_set_backlight(device=dial, red=0, green=0, blue=0, white=0)
 
         except Exception as e:
             logger.error("Failed to gracefully shut down dials")
@@ -641,8 +813,21 @@ class Dial_API_Service(Application):
             logger.error("Check your 'config.yaml' or add it manually under 'server' section.")
             sys.exit(0)
 
-        pc = PeriodicCallback(self.dial_handler.periodic_dial_update, dial_update_period)
-        pc.start()
+        # Dial updates (and all other serial I/O) run on the hub worker thread
+        self.dial_handler.start(dial_update_period)
+
+        # Optional UDP listener (disabled unless `udp_port` is set in config.yaml)
+        self.udp_listener = None
+        udp_port = server_config.get('udp_port', None)
+        if udp_port:
+            self.udp_listener = DialUDPListener(self.dial_handler, self.config, int(udp_port), server_config.get('hostname', 'localhost'))
+            self.udp_listener.start()
+
+        # Built-in metric sources (`sources` section in config.yaml)
+        self.metric_scheduler.start()
+
+        # Dial/hub hot-plug detection (`hotplug_interval` seconds, 0 disables it)
+        self.hotplug_scanner.start()
 
         IOLoop.instance().start()
 
@@ -652,6 +837,8 @@ def main(cmd_args=None):
         set_logger_level('info')
     else:
         set_logger_level(cmd_args.logging)
+        if cmd_args.log_queue:
+            enable_queue_logging()
     try:
         Dial_API_Service().run_forever()
     except SerialException:
@@ -661,10 +848,14 @@ def main(cmd_args=None):
         logger.exception("VU Dials API service crashed during setup.")
         logger.exception(f"Unhandled exception: ({type(e)}) {e}")
         show_error_msg("Crashed", "VU Server has crashed unexpectedly!\r\nPlease check log files for more information.")
+    disable_queue_logging()
     os._exit(0)
 
 if __name__ == '__main__':
+    # Image ingest uses a process pool, required for frozen (pyinstaller) builds
+    multiprocessing.freeze_support()
     parser = argparse.ArgumentParser(description='Karanovic Research - VU Dials API service')
     parser.add_argument('-l', '--logging', type=str, default='info', help='Set logging level. Default is `info`')
+    parser.add_argument('-q', '--log-queue', action='store_true', help='Write log files from a background thread instead of the serial/API threads')
     args = parser.parse_args()
     main(args)
@@ -5,6 +5,7 @@ from ruamel.yaml import YAML
 from dials.base_logger import logger
 from vu_notifications import show_error_msg, show_warning_msg
 import database as db
+from dial_mapping import mapping_from_db
 
 class ServerConfig:
     config_path = None
@@ -12,14 +13,15 @@ class ServerConfig:
     hardware = None
     server_default = {'hostname': 'localhost', 'port': 3000, 'communication_timeout': 10, 'master_key': 'cTpAWYuRpA2zx75Yh961Cg' }
     hardware_default = {'port': None }
+    sources = []
     dials = {}
     api_keys = {}
     database = None
 
-    def __init__(self, config_file='config.yaml'):
+    def __init__(self, config_file='config.yaml', database_file='vudials.db'):
         self.config_path =  os.path.join(os.path.dirname(__file__), config_file)
         logger.info(f"VU1 config yaml file: {self.config_path}")
-        self.database = db.DialsDB(init_if_missing=True)
+        self.database = db.DialsDB(database_file=database_file, init_if_missing=True)
         self._load_config()     # Load configuration from .yaml file
         self._load_API_keys()   # Load API keys from `api_keys` section
         self.debug_config()
@@ -113,6 +115,14 @@ class ServerConfig:
         self.server = cfg.get('server', self.server_default)
         self.hardware = cfg.get('hardware', self.hardware_default)
 
+        # Optional built-in metric sources
+        self.sources = cfg.get('sources', None) or []
+        if not isinstance(self.sources, list):
+            show_warning_msg("Invalid sources config", f"Config file '{self.config_path}' \r\n"\
+                             "Has invalid `sources` config entry (expecting a list).\r\n"\
+                             "Metric sources are disabled for this session.")
+            self.sources = []
+
         return True
 
     def _force_default_config(self):
@@ -149,10 +159,10 @@ class ServerConfig:
 
     def update_dial_db_cell_with_dict(self, dial_uid, values_dict):
         try:
-            self.database.dial_update_cell_with_dict(dial_uid=dial_uid, values_dict=values_dict)
+            return self.database.dial_update_cell_with_dict(dial_uid=dial_uid, values_dict=values_dict)
         except Exception as e:
             logger.error(e)
-            return
+            return False
 
     # Read dial information stored in the DB and append to existing list
     def append_dial_info_from_db(self, dial_list):
@@ -168,6 +178,12 @@ class ServerConfig:
             dial_list[key]['easing']['dial_period'] = dial_info['easing_dial_period']
             dial_list[key]['easing']['backlight_step'] = dial_info['easing_backlight_step']
             dial_list[key]['easing']['backlight_period'] = dial_info['easing_backlight_period']
+            dial_list[key]['filter'] = {
+                                            'ema_alpha': dial_info['filter_ema_alpha'],
+                                            'max_rate': dial_info['filter_max_rate'],
+                                            'deadband': dial_info['filter_deadband'],
+                                        }
+            dial_list[key]['mapping'] = mapping_from_db(dial_info).to_dict()
 
             self.dials[dial['uid']] = dial
 
@@ -176,6 +192,39 @@ class ServerConfig:
     def dial_fetch_db_info(self, dial_uid):
         return self.database.fetch_dial_info_or_create_default(dial_uid)
 
+    # Last known bus topology of a hub as {dial_index: {'uid': dial_uid, 'easing': dict or None}}
+    def fetch_hub_topology(self, hub_id):
+        topology = {}
+        try:
+            rows = self.database.topology_fetch(hub_id)
+        except Exception as e:
+            logger.error(e)
+            return topology
+
+        for row in rows:
+            easing = {
+                        'dial_step': row['easing_dial_step'],
+                        'dial_period': row['easing_dial_period'],
+                        'backlight_step': row['easing_backlight_step'],
+                        'backlight_period': row['easing_backlight_period'],
+                     }
+            if None in easing.values():
+                easing = None
+            topology[int(row['dial_index'])] = {'uid': row['dial_uid'], 'easing': easing}
+        return topology
+
+    def store_hub_topology(self, hub_id, dials):
+        try:
+            self.database.topology_store(hub_id, dials)
+        except Exception as e:
+            logger.error(e)
+
+    def update_hub_topology_easing(self, hub_id, dial_uid, easing):
+        try:
+            self.database.topology_update_easing(hub_id, dial_uid, easing)
+        except Exception as e:
+            logger.error(e)
+
     # Print out .yaml config
     def debug_config(self):
         logger.debug(f"\t Host: {self.server['hostname']}")
@@ -193,6 +242,9 @@ class ServerConfig:
     def get_hardware_config(self):
         return self.hardware
 
+    def get_sources_config(self):
+        return self.sources
+
     def create_api_key(self, key_name, priviledges=0):
         generated_key = self.database.api_key_generate(key_name=key_name, level=priviledges)
         logger.info(f"Generated API key '{generated_key}' (key_name:'{key_name}', priviledges:'{priviledges}')")
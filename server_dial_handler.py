@@ -1,7 +1,16 @@
 import os
-from time import time, sleep
+from functools import partial
+from threading import Lock
+from time import time, sleep, monotonic
 from math import trunc
 from dials.base_logger import logger
+from hub_worker import HubWorker, PRIORITY_HIGH
+from image_cache import PackedImageCache, file_crc
+from image_ingest import ImageIngest, ImageIngestError, prepare_image_file
+from dial_filter import DialValueFilter
+from dial_mapping import DialMapper, DialMapping
+
+EASING_KEYS = ('dial_step', 'dial_period', 'backlight_step', 'backlight_period')
 
 # ServerDialHandler Class
 # ---
@@ -9,44 +18,127 @@ from dials.base_logger import logger
 # It stores update requests (value, backlight, image etc) that are coming from the server API calls.
 # It will also periodically update the dials
 # ---
-# 'periodic_dial_update' function is called periodically from the main server loop
+# Every VU1 hub (DialSerialDriver) gets its own worker thread and only updates the dials connected to it.
+# 'periodic_dial_update' function is called periodically from each hub worker thread.
+# Anything that talks to the hub on behalf of the API should go through `enqueue`.
 #
 class ServerDialHandler:
-    dials = {}
-    hub_info = {}
     communication_timeout = 3
 
-    def __init__(self, dial_driver, server_config):
-        self.dial_driver = dial_driver
+    def __init__(self, dial_drivers, server_config):
+        if not isinstance(dial_drivers, (list, tuple)):
+            dial_drivers = [dial_drivers]
+        self.dial_drivers = list(dial_drivers)
         self.server_config = server_config
+        self.hub_workers = [HubWorker(f'hub-worker-{hub}') for hub in range(len(self.dial_drivers))]
+        # `dials` and `hub_dials` are read lock-free from the IOLoop and all hub workers. Writers take
+        # `dials_lock` and swap in updated copies instead of changing the dictionaries in place.
+        self.dials = {}                                     # All dials, keyed by UID
+        self.hub_dials = [{} for _ in self.dial_drivers]    # Dials of each hub, keyed by UID
+        self.dials_lock = Lock()
+        self.hub_connected = [True for _ in self.dial_drivers]
+        self.hub_info = {}
+        self.hardware_easing = {}                           # Easing config known to be set on each dial (None = unknown)
+        self.listeners = []
+        self.filters = {}
+        self.mapper = DialMapper()
 
         # Communication timeout
         cfg = self.server_config.get_server_config()
         self.communication_timeout = cfg.get('communication_timeout', 3)
         logger.info(f"Communication timeout set to {self.communication_timeout} seconds")
 
+        # Packed dial faces, shared by all dials
+        self.image_cache = PackedImageCache(cfg.get('image_cache_size', 4*1024*1024))
+        self.image_ingest = ImageIngest(cfg.get('image_ingest_workers', 1))
+
         logger.debug("Retrieving list of dials")
-        self._reload_dials(True)
+        for hub in range(len(self.dial_drivers)):
+            self._restore_dials(hub)
 
         logger.debug("Reconfiguring dials with stored behaviour")
         self._send_db_config_to_dials()
+        self._store_topology()
 
         logger.debug("Setting all dials percentage to 0")
-        self.dial_driver.set_all_dials_to(0)
-
-        logger.debug("Server dial handler up and running.")
+        for dial_driver in self.dial_drivers:
+            dial_driver.set_all_dials_to(0)
+
+        logger.debug(f"Server dial handler up and running with {len(self.dial_drivers)} hub(s).")
+
+    def start(self, dial_update_period):
+        for hub, hub_worker in enumerate(self.hub_workers):
+            hub_worker.start(partial(self.periodic_dial_update, hub), dial_update_period)
+
+    def stop(self):
+        for hub_worker in self.hub_workers:
+            hub_worker.stop()
+        self.image_ingest.shutdown()
+
+    # Listeners are called with (dial_uid, event, data) whenever dial state changes.
+    # They can be called from the IOLoop thread or any of the hub worker threads.
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def _notify(self, dial_uid, event, data):
+        for listener in self.listeners:
+            try:
+                listener(dial_uid, event, data)
+            except Exception as e:
+                logger.error(f"Dial event listener failed: {e}")
+
+    def _set_dial_online(self, dial_uid, online):
+        dial = self.dials[dial_uid]
+        if dial.get('online', True) == online:
+            return
+        dial['online'] = online
+        if online:
+            logger.info(f"Dial {dial_uid} is back online")
+        else:
+            logger.error(f"Dial {dial_uid} is not responding")
+        self._notify(dial_uid, 'online', online)
+
+    # Run `fn` on a hub worker thread and return a future with the result.
+    # Work for a dial (`dial_uid` keyword argument) runs on the worker of the hub that dial is connected to,
+    # anything else on the worker of `hub` (first hub by default).
+    def enqueue(self, fn, *args, priority=PRIORITY_HIGH, hub=None, **kwargs):
+        if hub is None:
+            hub = self._dial_hub(kwargs.get('dial_uid', None))
+        return self.hub_workers[hub].submit(fn, *args, priority=priority, **kwargs)
+
+    # Run `fn(*args, hub=N, **kwargs)` on every hub worker. Returns list of futures, one per hub
+    def enqueue_all(self, fn, *args, priority=PRIORITY_HIGH, **kwargs):
+        return [hub_worker.submit(fn, *args, hub=hub, priority=priority, **kwargs) for hub, hub_worker in enumerate(self.hub_workers)]
+
+    def _dial_hub(self, dial_uid):
+        dial = self.dials.get(dial_uid, None)
+        if dial is None:
+            return 0
+        return dial['hub']
+
+    def _driver(self, dial_uid):
+        return self.dial_drivers[self.dials[dial_uid]['hub']]
+
+    def periodic_dial_update(self, hub=0):
+        if not self.hub_connected[hub]:
+            return
 
-    def periodic_dial_update(self):
         updated = 0
         ret=0
 
-        ret = self._periodic_update_dial_values()
+        self._periodic_apply_filters(hub)
+
+        ret = self._periodic_update_dial_values(hub)
         updated = updated + ret
 
-        ret = self._periodic_update_dial_backlight()
+        ret = self._periodic_update_dial_backlight(hub)
         updated = updated + ret
 
-        ret = self._periodic_update_dial_images()
+        ret = self._periodic_update_dial_images(hub)
         updated = updated + ret
 
         if updated <=0:
@@ -63,12 +155,49 @@ class ServerDialHandler:
 
         return value
 
-    def _reload_dials(self, rescan=False):
+    def _reload_dials(self, rescan=False, hub=None):
+        if hub is None:
+            for hub_id in range(len(self.dial_drivers)):
+                self._reload_dials(rescan, hub_id)
+            return
+
         # Get dial list from the dial driver (actual list reported from the hub)
-        dials = self.dial_driver.get_dial_list(rescan)
+        dials = self.dial_drivers[hub].get_dial_list(rescan)
+        self._register_dials(hub, dials)
+        if rescan:
+            self._store_topology(hub)
+
+    # Warm start. Trust the last known topology of the hub, verify it with a single device map query
+    # and read UIDs only of dials that were not there before. Full bus rescan if that is not possible.
+    def _restore_dials(self, hub):
+        dial_driver = self.dial_drivers[hub]
+        snapshot = self.server_config.fetch_hub_topology(dial_driver.hub_id())
+        if not snapshot:
+            logger.info(f"No stored topology for hub {hub}. Scanning the bus.")
+            self._reload_dials(True, hub)
+            return
 
+        dials, queried = dial_driver.get_dial_list_from_snapshot({index: entry['uid'] for index, entry in snapshot.items()})
+        if not dials:
+            logger.info(f"Stored topology of hub {hub} could not be verified. Scanning the bus.")
+            self._reload_dials(True, hub)
+            return
+
+        logger.info(f"Restored {len(dials)-len(queried)} dial(s) of hub {hub} from stored topology, {len(queried)} new dial(s).")
+        for index, entry in snapshot.items():
+            if index not in queried and entry['easing'] is not None:
+                self.hardware_easing[entry['uid']] = dict(entry['easing'])
+        self._register_dials(hub, dials)
+
+    def _store_topology(self, hub=None):
+        hubs = range(len(self.dial_drivers)) if hub is None else [hub]
+        for hub_id in hubs:
+            dials = [(dial['index'], dial_uid, self.hardware_easing.get(dial_uid, None)) for dial_uid, dial in self.hub_dials[hub_id].items()]
+            self.server_config.store_hub_topology(self.dial_drivers[hub_id].hub_id(), dials)
+
+    def _register_dials(self, hub, dials):
         if len(dials)<=0:
-            logger.error("No dials connected to the bus!")
+            logger.error(f"No dials connected to the bus of hub {hub}!")
             return
 
         # 1 - Inform config/db what is the list of dials that we currently see
@@ -78,28 +207,89 @@ class ServerDialHandler:
 
         # Dial HUB uses indexes to address each dial. On the server side we use UID for flexibility
         # and also so that we can uniquely identify each dial.
-        for dial in dials:
-            dial['value'] = 0
-            dial['backlight'] = {'red':0, 'green':0, 'blue':0, 'white':0 }
-            dial['image_file'] = self._check_upload_for_dial_image(dial['uid'])
-            dial['update_deadline'] = time()
-            dial['value_changed'] = False
-            dial['backlight_changed'] = True
-            dial['image_changed'] = False
-            self.dials[dial['uid']] = dial
-
-    def _send_db_config_to_dials(self):
-        for _, dial in self.dials.items():
-            dial_step = dial['easing']['dial_step']
-            dial_period = dial['easing']['dial_period']
-            backlight_step = dial['easing']['backlight_step']
-            backlight_period = dial['easing']['backlight_period']
-
-            logger.debug(f"Configuring dial `{dial['uid']}`")
-            logger.debug(f"\tDial:{dial_step}% per {dial_period}ms")
-            logger.debug(f"\tBacklight {backlight_step}% {backlight_period}ms")
-            self.dial_set_easing_dial(dial['uid'], step=dial_step, period=dial_period)
-            self.dial_set_easing_backlight(dial['uid'], step=backlight_step, period=backlight_period)
+        with self.dials_lock:
+            all_dials = dict(self.dials)
+            hub_dials = [dict(dials_of_hub) for dials_of_hub in self.hub_dials]
+            mappings = {}
+            for dial in dials:
+                dial['value'] = 0
+                dial['backlight'] = {'red':0, 'green':0, 'blue':0, 'white':0 }
+                dial['image_file'] = self._check_upload_for_dial_image(dial['uid'])
+                dial['image_crc'] = file_crc(self._image_path(dial['image_file']))
+                dial['update_deadline'] = time()
+                dial['value_changed'] = False
+                dial['backlight_changed'] = True
+                dial['image_changed'] = False
+                dial['online'] = True
+                dial['hub'] = hub
+                # Dial could have been moved over from another hub
+                for dials_of_hub in hub_dials:
+                    dials_of_hub.pop(dial['uid'], None)
+                hub_dials[hub][dial['uid']] = dial
+                all_dials[dial['uid']] = dial
+                self.filters[dial['uid']] = DialValueFilter(value=dial['value'], **dial['filter'])
+                mappings[dial['uid']] = DialMapping.from_dict(dial['mapping'])
+
+            self.mapper.set_profiles(mappings)
+            self.hub_dials = hub_dials
+            self.dials = all_dials
+
+    def _send_db_config_to_dials(self, dial_uids=None):
+        for dial_uid, dial in list(self.dials.items()):
+            if dial_uids is not None and dial_uid not in dial_uids:
+                continue
+
+            easing = {key: self._convert_to_int(dial['easing'][key]) for key in EASING_KEYS}
+
+            logger.debug(f"Configuring dial `{dial_uid}`")
+            logger.debug(f"\tDial:{easing['dial_step']}% per {easing['dial_period']}ms")
+            logger.debug(f"\tBacklight {easing['backlight_step']}% {easing['backlight_period']}ms")
+            self._reconcile_easing(dial_uid, **easing)
+
+    # Bring dial easing config to the wanted values (None = leave as is) sending only parameters that differ.
+    # Returns dict of parameters that were sent to the dial (empty if it was already configured)
+    def _reconcile_easing(self, dial_uid, **wanted):
+        known = self._hardware_easing_config(dial_uid) or {}
+        changes = {key: value for key, value in wanted.items() if value is not None and known.get(key, None) != value}
+        if changes:
+            self._send_easing(dial_uid, **changes)
+        else:
+            logger.debug(f"Dial `{dial_uid}` easing is already configured")
+        return changes
+
+    # Easing config the dial is running with. Every send (and the stored topology) keeps `hardware_easing`
+    # up to date, so the dial is only asked (single GET_EASING_CONFIG) when some of it is not known.
+    def _hardware_easing_config(self, dial_uid):
+        easing = self.hardware_easing.get(dial_uid, None)
+        if easing is None or None in easing.values():
+            easing = self._read_hardware_easing(dial_uid)
+        return easing
+
+    def _read_hardware_easing(self, dial_uid):
+        easing = self._driver(dial_uid).dial_easing_get_config(int(self.dials[dial_uid]['index']))
+        if easing is None:
+            logger.error(f"Failed to read easing config from dial {dial_uid}")
+            return None
+
+        self.hardware_easing[dial_uid] = dict(easing)
+        return easing
+
+    # Send easing parameters (None = leave as is) and remember what the dial is configured with
+    def _send_easing(self, dial_uid, dial_step=None, dial_period=None, backlight_step=None, backlight_period=None):
+        dial_driver = self._driver(dial_uid)
+        index = self.dials[dial_uid]['index']
+        easing = self.hardware_easing.setdefault(dial_uid, dict.fromkeys(EASING_KEYS))
+        commands = (('dial_step', dial_step, dial_driver.dial_easing_dial_step),
+                    ('dial_period', dial_period, dial_driver.dial_easing_dial_period),
+                    ('backlight_step', backlight_step, dial_driver.dial_easing_backlight_step),
+                    ('backlight_period', backlight_period, dial_driver.dial_easing_backlight_period))
+        for key, value, send in commands:
+            if value is None:
+                continue
+            easing[key] = value if send(index, value) is True else None
+
+    def _store_hardware_easing(self, dial_uid):
+        self.server_config.update_hub_topology_easing(self._driver(dial_uid).hub_id(), dial_uid, self.hardware_easing.get(dial_uid, {}))
 
     def _check_upload_for_dial_image(self, dial_uid):
         filename = f'img_{dial_uid}'
@@ -109,44 +299,122 @@ class ServerDialHandler:
 
         return 'img_blank'
 
-    # TODO: Update to send multiple/all dial values in one go instead one-by-one
-    def _periodic_update_dial_values(self):
-        updated = 0
-        for _, dial in self.dials.items():
+    def _image_path(self, image_file):
+        if os.path.isabs(image_file):
+            return image_file
+        return os.path.join(os.path.dirname(os.path.realpath(__file__)), 'upload', image_file)
+
+    def _display_resolution(self):
+        return (self.dial_drivers[0].DISPLAY_WIDTH, self.dial_drivers[0].DISPLAY_HEIGHT)
+
+    # Packed framebuffer for dial's current image, from the image cache when possible
+    def get_packed_image(self, dial_uid):
+        if not self._dial_exists(dial_uid):
+            return None
+
+        dial = self.dials[dial_uid]
+        image_path = self._image_path(dial['image_file'])
+        width, height = self._display_resolution()
+
+        # Uploaded images are already in the cache, this is only needed after eviction or for images present on startup
+        def pack():
+            try:
+                return prepare_image_file(image_path, width, height)
+            except (OSError, ImageIngestError) as e:
+                logger.error(e)
+                return None
+
+        return self.image_cache.get_or_pack(dial['image_crc'], (width, height), pack)
+
+    # Decode and pack uploaded image in the ingest process pool. Returns future with (column_bytes, framebuffer)
+    def ingest_image(self, data):
+        return self.image_ingest.submit(data, self._display_resolution())
+
+    def store_packed_image(self, crc, packed):
+        self.image_cache.put(crc, self._display_resolution(), *packed)
+
+    def image_cache_stats(self):
+        return self.image_cache.stats()
+
+    def _periodic_apply_filters(self, hub=0):
+        now = monotonic()
+        for dial_uid, dial in self.hub_dials[hub].items():
+            dial_filter = self.filters.get(dial_uid, None)
+            if dial_filter is None or dial_filter.is_passthrough():
+                continue
+
+            new_value = int(round(dial_filter.step(now)))
+            if dial_filter.should_send(dial['value'], new_value):
+                dial['value'] = new_value
+                dial['value_changed'] = True
+                self._notify(dial_uid, 'value', new_value)
+
+    def _periodic_update_dial_values(self, hub=0):
+        pending = {}
+        for dial_uid, dial in self.hub_dials[hub].items():
             if dial['value_changed']:
-                self.dial_driver.dial_single_set_percent(dial['index'], dial['value'])
                 dial['value_changed'] = False
-                dial['update_deadline'] = time() + self.communication_timeout
-                updated = updated+1
-        if updated>0:
-            logger.debug(f"Updated {updated} dial values.")
+                pending[int(dial['index'])] = dial_uid
+
+        if not pending:
+            return 0
+
+        updates = [(index, self.dials[dial_uid]['value']) for index, dial_uid in pending.items()]
+        failed = self.dial_drivers[hub].dial_batch_set_percent(updates)
+
+        for index, dial_uid in pending.items():
+            if index in failed:
+                # Keep the dial dirty so it is retried on the next tick
+                self.dials[dial_uid]['value_changed'] = True
+                self._set_dial_online(dial_uid, False)
+                continue
+            self.dials[dial_uid]['update_deadline'] = time() + self.communication_timeout
+            self._set_dial_online(dial_uid, True)
+
+        updated = len(pending) - len(failed)
+        logger.debug("Updated %s dial values (%s failed).", updated, len(failed))
         return updated
 
-    def _periodic_update_dial_backlight(self):
-        updated = 0
-        for _, dial in self.dials.items():
+    def _periodic_update_dial_backlight(self, hub=0):
+        pending = {}
+        updates = []
+        for dial_uid, dial in self.hub_dials[hub].items():
             if dial['backlight_changed']:
-                self.dial_driver.dial_set_backlight(dial['index'],
-                                                    dial['backlight']['red'],
-                                                    dial['backlight']['green'],
-                                                    dial['backlight']['blue'],
-                                                    dial['backlight']['white']
-                                                    )
+                # Clear the flag before sending so updates queued by the API meanwhile are not lost
                 dial['backlight_changed'] = False
-                dial['update_deadline'] = time() + self.communication_timeout
-                updated = updated+1
-        if updated>0:
-            logger.debug(f"Updated {updated} dial backlight(s).")
+                backlight = dial['backlight']
+                pending[int(dial['index'])] = dial_uid
+                updates.append((int(dial['index']), backlight['red'], backlight['green'], backlight['blue'], backlight['white']))
+
+        if not updates:
+            return 0
+
+        failed = self.dial_drivers[hub].dial_batch_set_backlight(updates)
+        for index, dial_uid in pending.items():
+            if index in failed:
+                self.dials[dial_uid]['backlight_changed'] = True
+                self._set_dial_online(dial_uid, False)
+                continue
+            self.dials[dial_uid]['update_deadline'] = time() + self.communication_timeout
+            self._set_dial_online(dial_uid, True)
+
+        updated = len(pending) - len(failed)
+        logger.debug("Updated %s dial backlight(s) (%s failed).", updated, len(failed))
         return updated
 
-    def _periodic_update_dial_images(self):
+    def _periodic_update_dial_images(self, hub=0):
         updated = 0
-        for _, dial in self.dials.items():
+        for _, dial in self.hub_dials[hub].items():
             if dial['image_changed']:
                 logger.debug("Updating images")
-                self.dial_driver.update_display(device=dial['index'], imageFile=dial['image_file'])
-                dial['update_deadline'] = time() + self.communication_timeout
                 dial['image_changed'] = False
+                packed = self.get_packed_image(dial['uid'])
+                if packed is None:
+                    logger.error(f"Can not load image `{dial['image_file']}` for dial {dial['uid']}")
+                    continue
+                column_bytes, framebuffer = packed
+                self.dial_drivers[hub].update_display(device=dial['index'], imageData=framebuffer, column_bytes=column_bytes)
+                dial['update_deadline'] = time() + self.communication_timeout
                 updated = updated+1
         return updated
 
@@ -162,13 +430,127 @@ class ServerDialHandler:
     def _dial_exists(self, dial_uid):
         return dial_uid in self.dials
 
-    def provision_dials(self, num_attempts = 3):
-        logger.debug(f"Provisioning new dials (with {num_attempts} attempts)")
-        for _ in range(num_attempts):
-            self.dial_driver.provision_dials()
-            sleep(0.2)
-        logger.debug("Retrieving list of dials")
-        self._reload_dials(True)
+    # True if the last value requested for the dial was not sent to the dial yet
+    # (filtered dials: the dial has not reached the filter target yet)
+    def dial_value_pending(self, dial_uid):
+        dial = self.dials.get(dial_uid, None)
+        if dial is None:
+            return False
+        if dial['value_changed']:
+            return True
+        dial_filter = self.filters.get(dial_uid, None)
+        return dial_filter is not None and not dial_filter.is_passthrough() and round(dial_filter.target) != dial['value']
+
+    def scan_hub(self, hub=0):
+        """
+        Incremental bus scan, runs on the hub worker (see HotplugScanner).
+        Compares the hub device map with the known dials of the hub, reads UIDs only of dials that appeared
+        and marks dials that disappeared offline. Dials that are still there are not touched.
+
+        @return (list of added dial UIDs, list of removed dial UIDs)
+        """
+        if not self.hub_connected[hub]:
+            return [], []
+
+        dial_driver = self.dial_drivers[hub]
+        online = dial_driver.get_devices_map()
+        if online is None:
+            return [], []
+
+        online = set(online)
+        known = {int(dial['index']): dial_uid for dial_uid, dial in self.hub_dials[hub].items()}
+
+        removed = []
+        for index, dial_uid in known.items():
+            if index in online:
+                continue
+            logger.info(f"Dial {dial_uid} was removed from hub {hub}")
+            with self.dials_lock:
+                hub_dials = dict(self.hub_dials[hub])
+                hub_dials.pop(dial_uid, None)
+                self.hub_dials[hub] = hub_dials
+            self.hardware_easing.pop(dial_uid, None)
+            dial_driver.remove_dial(index)
+            self._set_dial_online(dial_uid, False)
+            removed.append(dial_uid)
+
+        new_dials = []
+        for index in sorted(online - set(known)):
+            dial = dial_driver.add_dial(index)
+            if dial is not None:
+                new_dials.append(dial)
+
+        # Dials that were plugged back in keep the state that was requested while they were away
+        previous = {dial['uid']: self.dials[dial['uid']] for dial in new_dials if dial['uid'] in self.dials}
+        added = [dial['uid'] for dial in new_dials]
+        if new_dials:
+            for dial_uid in added:
+                self.hardware_easing.pop(dial_uid, None)
+            self._register_dials(hub, new_dials)
+            self._send_db_config_to_dials(added)
+            for dial_uid in added:
+                logger.info(f"Dial {dial_uid} was added to hub {hub}")
+                old = previous.get(dial_uid, None)
+                if old is not None:
+                    self.dials[dial_uid]['value'] = old['value']
+                    self.dials[dial_uid]['value_changed'] = True
+                    self.dials[dial_uid]['backlight'] = old['backlight']
+                    self.filters[dial_uid].reset(old['value'])
+                self._notify(dial_uid, 'online', True)
+
+        if added or removed:
+            self._store_topology(hub)
+        return added, removed
+
+    def hub_disconnected(self, hub):
+        if not self.hub_connected[hub]:
+            return
+        self.hub_connected[hub] = False
+        logger.error(f"Hub {hub} ({self.dial_drivers[hub].get_port_info().device}) was disconnected")
+        try:
+            self.dial_drivers[hub].close()
+        except Exception as e:
+            logger.debug("Closing port of disconnected hub failed: %s", e)
+        for dial_uid in list(self.hub_dials[hub]):
+            self._set_dial_online(dial_uid, False)
+
+    def hub_reconnected(self, hub, port_info):
+        """
+        Re-open hub after its USB port was enumerated again. Dials lost power with the hub,
+        so their config and last requested state are sent again.
+        """
+        dial_driver = self.dial_drivers[hub]
+        dial_driver.reopen(port_info)
+        logger.info(f"Hub {hub} is back on {port_info.device}")
+        self.hub_connected[hub] = True
+
+        dial_driver.invalidate_framebuffer()
+        dial_driver.bus_rescan()
+        for dial_uid, dial in self.hub_dials[hub].items():
+            self.hardware_easing.pop(dial_uid, None)
+            dial['value_changed'] = True
+            dial['backlight_changed'] = True
+        self.scan_hub(hub)
+        self._send_db_config_to_dials(list(self.hub_dials[hub]))
+        for dial_uid in self.hub_dials[hub]:
+            self._set_dial_online(dial_uid, True)
+        self._store_topology(hub)
+
+    # Provision new dials on one hub, or on all hubs if `hub` is None.
+    # Must run on the worker of that hub (see `enqueue_all`) once hub workers are started.
+    # Returns list of UIDs of dials found on the provisioned hub(s)
+    def provision_dials(self, num_attempts = 3, hub=None):
+        hubs = range(len(self.dial_drivers)) if hub is None else [hub]
+        dials = []
+        for hub_id in hubs:
+            logger.debug(f"Provisioning new dials on hub {hub_id} (with {num_attempts} attempts)")
+            for _ in range(num_attempts):
+                self.dial_drivers[hub_id].provision_dials()
+                sleep(0.2)
+            logger.debug("Retrieving list of dials")
+            self._reload_dials(True, hub_id)
+            dials.extend(list(self.hub_dials[hub_id]))
+        return dials
 
     def get_dial_info(self, dial_uid=None):
         if dial_uid is not None:
@@ -180,18 +562,141 @@ class ServerDialHandler:
             logger.error(f"Dial {dial_uid} does not exist in dial list.")
             return False
 
-        value = self._convert_to_int(value)
+        value = min(max(self._convert_to_int(value), 0), 100)
+
+        # Filtered dials are moved towards the new value by the periodic update
+        dial_filter = self.filters.get(dial_uid, None)
+        if dial_filter is not None and not dial_filter.is_passthrough():
+            dial_filter.set_target(value)
+            return True
 
         # Check if already at value
         if self.dials[dial_uid]['value'] == value:
-            logger.debug(f"Dial {dial_uid} already at {value}")
+            logger.debug("Dial %s already at %s", dial_uid, value)
             return True
 
-        logger.debug(f"Queueing dial {dial_uid} value update to {value}")
+        logger.debug("Queueing dial %s value update to %s", dial_uid, value)
         self.dials[dial_uid]['value'] = value
         self.dials[dial_uid]['value_changed'] = True
+        self._notify(dial_uid, 'value', value)
         return True
 
+    def dial_set_value(self, dial_uid, value):
+        """
+        Set dial to a raw value, mapped to percent through the dial mapping profile.
+        """
+        if not self._dial_exists(dial_uid):
+            logger.error(f"Dial {dial_uid} does not exist in dial list.")
+            return False
+
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            logger.error(f"Failed to convert value `{value}` to number.")
+            return False
+
+        return self.dial_set_percent(dial_uid, self._percent_to_int(dial_uid, self.mapper.map(dial_uid, value)))
+
+    def dial_set_values(self, values):
+        """
+        Set multiple dials to raw values. Mapping is applied to the whole batch at once.
+
+        @param values dictionary of {dial_uid: raw value}
+        @return dictionary of {dial_uid: True|False}
+        """
+        results = {}
+        dial_uids = []
+        raw_values = []
+        for dial_uid, value in values.items():
+            try:
+                raw_values.append(float(value))
+                dial_uids.append(dial_uid)
+            except (TypeError, ValueError):
+                logger.error(f"Failed to convert value `{value}` to number.")
+                results[dial_uid] = False
+
+        for dial_uid, percent in zip(dial_uids, self.mapper.map_many(dial_uids, raw_values)):
+            results[dial_uid] = self.dial_set_percent(dial_uid, self._percent_to_int(dial_uid, percent))
+
+        return results
+
+    # Values of dials without mapping (`percent`) are truncated, same as `dial_set_percent` does.
+    # Mapped values are rounded to the nearest percent.
+    def _percent_to_int(self, dial_uid, percent):
+        if self.mapper.is_passthrough(dial_uid):
+            return trunc(percent)
+        return round(percent)
+
+    def dial_set_mapping(self, dial_uid, mapping):
+        if not self._dial_exists(dial_uid):
+            logger.error(f"Dial {dial_uid} does not exist in dial list.")
+            return False
+
+        self.mapper.set_profile(dial_uid, mapping)
+        self.dials[dial_uid]['mapping'] = mapping.to_dict()
+        return self.dials[dial_uid]['mapping']
+
+    def dial_set_many(self, updates):
+        """
+        Queue value and/or backlight updates for multiple dials in one pass.
+
+        @param updates dictionary of {dial_uid: {'value': x, 'backlight': {'red': r, 'green': g, 'blue': b, 'white': w}}}
+        @return dictionary of {dial_uid: {'status': 'ok'|'fail', 'message': str}}
+        """
+        results = {}
+        values = {}
+        for dial_uid, update in updates.items():
+            if not self._dial_exists(dial_uid):
+                results[dial_uid] = {'status': 'fail', 'message': 'Invalid dial_uid or device is offline.'}
+                continue
+
+            if not isinstance(update, dict):
+                results[dial_uid] = {'status': 'fail', 'message': 'Expecting object with `value` and/or `backlight`.'}
+                continue
+
+            if 'value' in update:
+                values[dial_uid] = update['value']
+
+            if 'backlight' in update:
+                backlight = update['backlight']
+                if isinstance(backlight, (list, tuple)):
+                    backlight = dict(zip(('red', 'green', 'blue', 'white'), backlight))
+                if not isinstance(backlight, dict):
+                    results[dial_uid] = {'status': 'fail', 'message': 'Invalid `backlight` value.'}
+                    continue
+                self.dial_set_backlight(dial_uid,
+                                        backlight.get('red', 0),
+                                        backlight.get('green', 0),
+                                        backlight.get('blue', 0),
+                                        backlight.get('white', 0))
+
+            results[dial_uid] = {'status': 'ok', 'message': 'Update queued'}
+
+        for dial_uid, status in self.dial_set_values(values).items():
+            if not status:
+                results[dial_uid] = {'status': 'fail', 'message': 'Invalid `value`.'}
+
+        return results
+
+    def dial_set_filter(self, dial_uid, ema_alpha=None, max_rate=None, deadband=None):
+        if not self._dial_exists(dial_uid):
+            logger.error(f"Dial {dial_uid} does not exist in dial list.")
+            return False
+
+        dial_filter = self.filters[dial_uid]
+        config = dial_filter.config()
+        if ema_alpha is not None:
+            config['ema_alpha'] = float(ema_alpha)
+        if max_rate is not None:
+            config['max_rate'] = float(max_rate)
+        if deadband is not None:
+            config['deadband'] = float(deadband)
+
+        dial_filter.configure(**config)
+        dial_filter.reset(self.dials[dial_uid]['value'])
+        self.dials[dial_uid]['filter'] = dial_filter.config()
+        return self.dials[dial_uid]['filter']
+
     # Debug function, mainly used for dial offset/calibration
     def dial_set_raw(self, dial_uid, value):
         if not self._dial_exists(dial_uid):
@@ -199,7 +704,7 @@ class ServerDialHandler:
             return False
 
         value = self._convert_to_int(value)
-        self.dial_driver.dial_single_set_raw(self.dials[dial_uid]['index'], value)
+        self._driver(dial_uid).dial_single_set_raw(self.dials[dial_uid]['index'], value)
         return True
 
 
@@ -210,7 +715,7 @@ class ServerDialHandler:
             return False
 
         value = self._convert_to_int(value)
-        self.dial_driver.dial_calibrate(self.dials[dial_uid]['index'], value, fullScale)
+        self._driver(dial_uid).dial_calibrate(self.dials[dial_uid]['index'], value, fullScale)
         return True
 
     def dial_set_easing_dial(self, dial_uid, step=None, period=None):
@@ -220,12 +725,14 @@ class ServerDialHandler:
 
         if step is not None:
             step = self._convert_to_int(step)
-            self.dial_driver.dial_easing_dial_step(self.dials[dial_uid]['index'], step)
 
         if period is not None:
             period = self._convert_to_int(period)
-            self.dial_driver.dial_easing_dial_period(self.dials[dial_uid]['index'], period)
 
+        changes = self._reconcile_easing(dial_uid, dial_step=step, dial_period=period)
+        if changes:
+            self._store_hardware_easing(dial_uid)
+            self._notify(dial_uid, 'easing', changes)
         return True
 
     def dial_set_easing_backlight(self, dial_uid, step=None, period=None):
@@ -235,12 +742,14 @@ class ServerDialHandler:
 
         if step is not None:
             step = self._convert_to_int(step)
-            self.dial_driver.dial_easing_backlight_step(self.dials[dial_uid]['index'], step)
 
         if period is not None:
             period = self._convert_to_int(period)
-            self.dial_driver.dial_easing_backlight_period(self.dials[dial_uid]['index'], period)
 
+        changes = self._reconcile_easing(dial_uid, backlight_step=step, backlight_period=period)
+        if changes:
+            self._store_hardware_easing(dial_uid)
+            self._notify(dial_uid, 'easing', changes)
         return True
 
     def dial_set_backlight(self, dial_uid, red, green, blue, white):
@@ -263,36 +772,55 @@ class ServerDialHandler:
 
         # Check if already at value
         if self.dials[dial_uid]['backlight'] == new_value:
-            logger.debug(f"Dial {dial_uid} already at {red}:{green}:{blue}:{white}")
+            logger.debug("Dial %s already at %s:%s:%s:%s", dial_uid, red, green, blue, white)
             return True
 
-        logger.debug(f"Queueing dial {dial_uid} RGBW update to {red}:{green}:{blue}:{white}")
-        self.dials[dial_uid]['backlight'] = {'red':red, 'green':green, 'blue':blue, 'white':white }
+        logger.debug("Queueing dial %s RGBW update to %s:%s:%s:%s", dial_uid, red, green, blue, white)
+        self.dials[dial_uid]['backlight'] = new_value
         self.dials[dial_uid]['backlight_changed'] = True
+        self._notify(dial_uid, 'backlight', dict(new_value))
         return True
 
-    def dial_set_image(self, dial_uid, image_file):
+    def dial_set_image(self, dial_uid, image_file, crc=None):
         if not self._dial_exists(dial_uid):
             logger.error(f"Dial {dial_uid} does not exist in dial list.")
             return False
 
-        logger.debug(f"Queueing dial {dial_uid} background image to {image_file}")
+        if crc is None:
+            crc = file_crc(self._image_path(image_file))
+
+        logger.debug("Queueing dial %s background image to %s", dial_uid, image_file)
         self.dials[dial_uid]['image_file'] = image_file
+        self.dials[dial_uid]['image_crc'] = crc
         self.dials[dial_uid]['image_changed'] = True
+        self._notify(dial_uid, 'image', {'image_file': os.path.basename(image_file), 'image_crc': crc})
         return True
 
+    def dial_get_easing_config(self, dial_uid):
+        if not self._dial_exists(dial_uid):
+            logger.error(f"Dial {dial_uid} does not exist in dial list.")
+            return False
+
+        easing = self._hardware_easing_config(dial_uid)
+        if easing is None:
+            return False
+        return dict(easing)
+
     def dial_reload_info_from_hardware(self, dial_uid):
         if not self._dial_exists(dial_uid):
             logger.error(f"Dial {dial_uid} does not exist in dial list.")
             return False
 
         deviceIndex = int(self.dials[dial_uid]['index'])
-
-        fw_hash = self.dial_driver.dial_get_fw_hash(deviceIndex)
-        fw_version = self.dial_driver.dial_get_fw_version(deviceIndex)
-        hw_version = self.dial_driver.dial_get_hw_version(deviceIndex)
-        protocol_version = self.dial_driver.dial_get_protocol_version(deviceIndex)
-        deviceEasing = self.dial_driver.dial_easing_get_config(deviceIndex)   # Read dial easing config
+        dial_driver = self._driver(dial_uid)
+
+        fw_hash = dial_driver.dial_get_fw_hash(deviceIndex)
+        fw_version = dial_driver.dial_get_fw_version(deviceIndex)
+        hw_version = dial_driver.dial_get_hw_version(deviceIndex)
+        protocol_version = dial_driver.dial_get_protocol_version(deviceIndex)
+        deviceEasing = self._read_hardware_easing(dial_uid)
+        if deviceEasing is None:
+            return False
 
         self.dials[dial_uid]['fw_hash'] = fw_hash
         self.dials[dial_uid]['fw_version'] = fw_version
@@ -302,15 +830,17 @@ class ServerDialHandler:
         self.dials[dial_uid]['easing']['dial_period'] = deviceEasing['dial_period']
         self.dials[dial_uid]['easing']['backlight_step'] = deviceEasing['backlight_step']
         self.dials[dial_uid]['easing']['backlight_period'] = deviceEasing['backlight_period']
-
-        self.server_config.update_dial_db_cell(dial_uid, 'dial_build_hash', fw_hash)
-        self.server_config.update_dial_db_cell(dial_uid, 'dial_fw_version', fw_version)
-        self.server_config.update_dial_db_cell(dial_uid, 'dial_hw_version', hw_version)
-        self.server_config.update_dial_db_cell(dial_uid, 'dial_protocol_version', protocol_version)
-        self.server_config.update_dial_db_cell(dial_uid, 'easing_dial_step', deviceEasing['dial_step'])
-        self.server_config.update_dial_db_cell(dial_uid, 'easing_dial_period', deviceEasing['dial_period'])
-        self.server_config.update_dial_db_cell(dial_uid, 'easing_backlight_step', deviceEasing['backlight_step'])
-        self.server_config.update_dial_db_cell(dial_uid, 'easing_backlight_period', deviceEasing['backlight_period'])
+        self._store_hardware_easing(dial_uid)
+
+        values_dict = { 'dial_build_hash': fw_hash,
+                        'dial_fw_version': fw_version,
+                        'dial_hw_version': hw_version,
+                        'dial_protocol_version': protocol_version,
+                        'easing_dial_step': deviceEasing['dial_step'],
+                        'easing_dial_period': deviceEasing['dial_period'],
+                        'easing_backlight_step': deviceEasing['backlight_step'],
+                        'easing_backlight_period': deviceEasing['backlight_period'] }
+        self.server_config.update_dial_db_cell_with_dict(dial_uid, values_dict)
 
         return self.dials[dial_uid]
 
@@ -0,0 +1,60 @@
+"""
+`DialValueFilter` deadband behaviour.
+
+    python -m pytest tests
+"""
+import os
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from dial_filter import DialValueFilter  # pylint: disable=wrong-import-position
+
+
+def run_filter(dial_filter, targets, sent_value, ticks=1, tick=0.1):
+    """
+    Feed targets to the filter the same way the periodic dial update does.
+
+    @return list of values sent to the dial
+    """
+    sent = []
+    now = 0.0
+    for target in targets:
+        dial_filter.set_target(target)
+        for _ in range(ticks):
+            now += tick
+            new_value = int(round(dial_filter.step(now)))
+            if dial_filter.should_send(sent_value, new_value):
+                sent_value = new_value
+                sent.append(new_value)
+    return sent
+
+
+def test_deadband_suppresses_small_changes():
+    dial_filter = DialValueFilter(deadband=5, value=50)
+    assert run_filter(dial_filter, [51, 52, 50, 53, 49, 51], sent_value=50) == []
+
+
+def test_deadband_sends_changes_that_exceed_it():
+    dial_filter = DialValueFilter(deadband=5, value=50)
+    assert run_filter(dial_filter, [51, 56, 58, 50, 44], sent_value=50) == [56, 50, 44]
+
+
+def test_deadband_lands_on_target_after_large_move():
+    # EMA steps shrink while converging, last one is inside the deadband but still reaches the target
+    dial_filter = DialValueFilter(ema_alpha=0.5, deadband=5, value=0)
+    sent = run_filter(dial_filter, [20], sent_value=0, ticks=20)
+    assert sent[-1] == 20
+    assert all(b - a >= 5 for a, b in zip([0] + sent[:-2], sent[:-1]))
+
+
+def test_deadband_rate_limited_move_lands_on_target():
+    dial_filter = DialValueFilter(max_rate=10, deadband=5, value=0)
+    sent = run_filter(dial_filter, [12], sent_value=0, ticks=20)
+    assert sent == [5, 10, 12]
+
+
+def test_no_deadband_sends_every_change():
+    dial_filter = DialValueFilter(ema_alpha=1.0, max_rate=0, deadband=0, value=50)
+    assert run_filter(dial_filter, [51, 52, 50], sent_value=50) == [51, 52, 50]
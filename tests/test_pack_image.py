@@ -0,0 +1,74 @@
+"""
+`pack_image` must produce exactly the same bytes as the original per-pixel encoder
+(DialSerialDriver `img_to_binary` / `_format_bits`), which now only lives here as the reference.
+
+    python -m pytest tests
+"""
+import os
+import sys
+import numpy as np
+import pytest
+from PIL import Image
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from dial_driver import pack_image  # pylint: disable=wrong-import-position
+
+
+def legacy_format_bits(bits):
+    buff = []
+    for i in bits:
+        if i > 127:
+            buff.append(1)
+        else:
+            buff.append(0)
+    return buff
+
+
+def legacy_img_to_binary(img):
+    buff = []
+    img = img.convert("L")
+
+    imgData = np.asarray(img)
+    imgData = imgData.T.tolist()
+
+    # Each byte is 8 vertical bits
+    for bits in imgData:
+        bits = legacy_format_bits(bits)
+        byte = [int("".join(map(str, bits[i:i+8])), 2) for i in range(0, len(bits), 8)]
+        buff.append(byte)
+
+    return [item for sublist in buff for item in sublist]
+
+
+def random_image(width, height, mode='L', seed=0):
+    rng = np.random.default_rng(seed)
+    if mode == 'RGB':
+        return Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8), 'RGB')
+    return Image.fromarray(rng.integers(0, 256, (height, width), dtype=np.uint8), 'L')
+
+
+@pytest.mark.parametrize('width, height, mode', [
+    (200, 144, 'L'),
+    (200, 144, 'RGB'),
+    (200, 141, 'L'),        # height not divisible by 8
+    (13, 5, 'L'),           # single partial byte per column
+])
+def test_pack_image_matches_legacy_encoder(width, height, mode):
+    img = random_image(width, height, mode)
+    packed = pack_image(img)
+
+    assert packed.shape == (width, (height + 7) // 8)
+    assert packed.tobytes() == bytes(legacy_img_to_binary(img))
+
+
+def test_pack_image_threshold():
+    # 127 is black, 128 is white
+    img = Image.fromarray(np.array([[127], [128], [0], [255], [127], [128], [0], [255]], dtype=np.uint8), 'L')
+    assert pack_image(img).tobytes() == bytes(legacy_img_to_binary(img)) == bytes([0b01010101])
+
+
+def test_pack_image_blank_upload():
+    with Image.open(os.path.join(REPO_DIR, 'upload', 'img_blank')) as img:
+        assert pack_image(img).tobytes() == bytes(legacy_img_to_binary(img))
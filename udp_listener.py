@@ -0,0 +1,114 @@
+import socket
+from tornado.ioloop import IOLoop
+from dials.base_logger import logger
+from metrics import UDP_UPDATES
+
+# DialUDPListener Class
+# ---
+# Optional fire-and-forget UDP listener for very high-rate producers.
+# Each datagram holds one or more newline separated updates in the following format
+#   <api key>:<dial uid>:<value>[|backlight=<red>,<green>,<blue>[,<white>]]
+# Value can be left empty to only update the backlight (ie. `key:uid:|backlight=0,100,0`).
+#
+# Updates are validated against the in-memory API key map and written into ServerDialHandler state,
+# so multiple updates for the same dial between two hub ticks are coalesced into one serial update.
+# ---
+class DialUDPListener:
+    max_datagrams_per_event = 1000
+    max_datagram_size = 2048
+
+    def __init__(self, dial_handler, server_config, port, host='localhost'):
+        self.dial_handler = dial_handler
+        self.server_config = server_config
+        self.port = port
+        self.host = host
+        self.socket = None
+        self.io_loop = None
+
+        # Counters are exported on `/metrics` (vu_udp_updates_total)
+        self.received = UDP_UPDATES.labels('received')      # Updates received
+        self.accepted = UDP_UPDATES.labels('accepted')      # Updates applied to dial state
+        self.coalesced = UDP_UPDATES.labels('coalesced')    # Updates that replaced a value that was not sent to the dial yet
+        self.rejected = UDP_UPDATES.labels('rejected')      # Updates with invalid API key or key without access to the dial
+        self.dropped = UDP_UPDATES.labels('dropped')        # Malformed updates, invalid values or updates for unknown dials
+
+    def start(self):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+        self.socket.bind((self.host, self.port))
+        self.io_loop = IOLoop.current()
+        self.io_loop.add_handler(self.socket.fileno(), self._on_readable, IOLoop.READ)
+        logger.info(f"VU1 UDP listener is listening on {self.host}:{self.port}")
+
+    def stop(self):
+        if self.socket is None:
+            return
+        self.io_loop.remove_handler(self.socket.fileno())
+        self.socket.close()
+        self.socket = None
+        logger.info(f"UDP listener stopped. {self.stats()}")
+
+    def stats(self):
+        return {
+            'received': self.received.value,
+            'accepted': self.accepted.value,
+            'coalesced': self.coalesced.value,
+            'rejected': self.rejected.value,
+            'dropped': self.dropped.value,
+        }
+
+    def _on_readable(self, fd, events):
+        # Drain socket, but give other IOLoop callbacks a chance if producers never stop
+        for _ in range(self.max_datagrams_per_event):
+            try:
+                data = self.socket.recv(self.max_datagram_size)
+            except BlockingIOError:
+                return
+            except OSError as e:
+                logger.error(f"UDP listener receive failed: {e}")
+                return
+
+            for line in data.splitlines():
+                if line:
+                    self._handle_update(line)
+
+    def _handle_update(self, line):
+        self.received.inc()
+        try:
+            update, _, options = line.decode('ascii').strip().partition('|')
+            api_key, dial_uid, value = update.split(':')
+            backlight = None
+            if options:
+                name, _, values = options.partition('=')
+                if name != 'backlight':
+                    raise ValueError(f"unsupported option `{name}`")
+                backlight = [int(x) for x in values.split(',')]
+                if len(backlight) not in (3, 4):
+                    raise ValueError("backlight needs 3 or 4 values")
+        except ValueError:
+            self.dropped.inc()
+            return
+
+        if not self.server_config.api_key_has_access_to_dial(api_key, dial_uid):
+            self.rejected.inc()
+            return
+
+        if self.dial_handler.get_dial_info(dial_uid) is None:
+            self.dropped.inc()
+            return
+
+        if value:
+            pending = self.dial_handler.dial_value_pending(dial_uid)
+            if not self.dial_handler.dial_set_value(dial_uid, value):
+                self.dropped.inc()
+                return
+            if pending:
+                self.coalesced.inc()
+
+        if backlight is not None:
+            backlight.extend([0]*(4-len(backlight)))
+            if not self.dial_handler.dial_set_backlight(dial_uid, *backlight):
+                self.dropped.inc()
+                return
+
+        self.accepted.inc()